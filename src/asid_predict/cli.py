@@ -0,0 +1,361 @@
+"""
+NDJSON形式の地震データをまとめて震度予測するコマンドラインツール
+
+読み込み・バッチ化、モデルでの推論、書き出しをそれぞれ別スレッドで並行して行う。
+入力は1行ずつ読むので、メモリに載らない大きなファイルでも処理できる。
+
+    asid-predict --weights out/model.weights.h5 --targets data/predict.json < events.ndjson
+"""
+
+import argparse
+import json
+import queue
+import struct
+import sys
+import threading
+import time
+from typing import IO, Iterator
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake
+
+__all__ = ["main"]
+
+# 2進形式のマジックナンバー
+BINARY_MAGIC = b"ASID"
+
+# スレッド間で終了を伝える
+_END = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _load_model(model_type: str, path: str):
+    """学習済みモデルを読み込む"""
+    if model_type == "quantized":
+        from asid_predict.models import QuantizedModel
+
+        return QuantizedModel.load(path)
+
+    from asid_predict.models import PredictModel, StudentModel
+
+    model = StudentModel() if model_type == "student" else PredictModel()
+    model.load_weight(path)
+    return model
+
+
+def _load_targets(path: str) -> dict[str, np.ndarray]:
+    """予測地点のJSONを列ごとの配列にする(細分区域コードは任意)"""
+    with open(path, "r") as f:
+        points = json.load(f)
+
+    targets = {
+        "lat": np.array([p["lat"] for p in points]),
+        "lon": np.array([p["lon"] for p in points]),
+        "arv400": np.array([p["arv400"] for p in points]),
+    }
+    if all("region" in p for p in points):
+        targets["region"] = np.array([str(p["region"]) for p in points])
+
+    return targets
+
+
+def _read_events(stream: IO[str]) -> Iterator[tuple[str, Earthquake]]:
+    """NDJSONを1行ずつ読んで(地震ID, Earthquake)にする"""
+    for line_number, line in enumerate(stream):
+        line = line.strip()
+        if not line:
+            continue
+
+        d = json.loads(line)
+        event_id = str(d.get("id", line_number))
+        yield event_id, Earthquake(
+            lat=d["lat"], lon=d["lon"], depth=d["depth"], magnitude=d["magnitude"]
+        )
+
+
+def _drain(q: queue.Queue):
+    """終了の印が来るまで読み捨てる(前の段がputで止まったままにならないように)"""
+    while q.get() is not _END:
+        pass
+
+
+def _run_stage(
+    func,
+    output: queue.Queue,
+    stop: threading.Event,
+    input_queue: queue.Queue = None,
+):
+    """
+    パイプラインの1段を実行し、例外は次の段に渡す
+
+    例外と終了の印は必ず次の段に届ける(キューが空くまで待つ)。
+    stop は前の段を早めに止めるためだけに使う。
+    """
+    try:
+        func()
+    except BaseException as e:
+        output.put(_StageError(e))
+        if input_queue is not None:
+            # 前の段を止め、残りは読み捨てる
+            stop.set()
+            _drain(input_queue)
+    finally:
+        output.put(_END)
+
+
+class _RegionAggregator:
+    """地点ごとの震度を細分区域ごとの最大震度にまとめる"""
+
+    def __init__(self, regions: np.ndarray):
+        self.codes, self.inverse = np.unique(regions, return_inverse=True)
+
+    def aggregate(self, intensities: np.ndarray) -> np.ndarray:
+        """(地震数, 地点数) -> (地震数, 区域数)"""
+        result = np.full((len(intensities), len(self.codes)), -np.inf)
+        for row, values in zip(result, intensities):
+            np.maximum.at(row, self.inverse, values)
+        return result
+
+
+def run_pipeline(
+    model,
+    targets: dict[str, np.ndarray],
+    input_stream: IO[str],
+    output_stream: IO[bytes],
+    mode: str = "station",
+    output_format: str = "ndjson",
+    batch_size: int = 16,
+    queue_size: int = 8,
+    report_stream: IO[str] = None,
+    report_interval: float = 5.0,
+    predict_batch_size: int = 8192,
+) -> dict:
+    """
+    読み込み -> 推論 -> 書き出し のパイプラインを実行
+
+    :param mode: "station" 地点ごと / "region" 細分区域ごとの最大震度
+    :param output_format: "ndjson" / "binary"
+    :param batch_size: 1回の推論にまとめる地震の数
+    :param queue_size: 各段の間のキューの長さ(メモリ使用量の上限)
+    :param predict_batch_size: モデルに1度に渡す行数
+    :return: 処理件数と処理速度
+    """
+    from asid_predict.prediction.predictor import predict_intensity_array
+
+    if mode == "region" and "region" not in targets:
+        raise ValueError("細分区域ごとの予測には予測地点に region が必要です")
+
+    aggregator = _RegionAggregator(targets["region"]) if mode == "region" else None
+    stop = threading.Event()
+    batches: queue.Queue = queue.Queue(maxsize=queue_size)
+    results: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def read():
+        batch: list[tuple[str, Earthquake]] = []
+        for event in _read_events(input_stream):
+            if stop.is_set():
+                return
+            batch.append(event)
+            if len(batch) >= batch_size:
+                batches.put(batch)
+                batch = []
+        if batch:
+            batches.put(batch)
+
+    def infer():
+        while True:
+            batch = batches.get()
+            if batch is _END:
+                return
+            if isinstance(batch, _StageError):
+                raise batch.error
+            if stop.is_set():
+                # 書き出しが止まったので計算しない
+                continue
+
+            eqs = [eq for _, eq in batch]
+
+            # 地震 x 地点 をまとめて1回で推論
+            intensities = predict_intensity_array(
+                model,
+                np.array([eq.magnitude for eq in eqs])[:, None],
+                np.array([eq.depth for eq in eqs])[:, None],
+                np.array([eq.lat for eq in eqs])[:, None],
+                np.array([eq.lon for eq in eqs])[:, None],
+                targets["lat"][None, :],
+                targets["lon"][None, :],
+                targets["arv400"][None, :],
+                batch_size=predict_batch_size,
+            )
+            if aggregator is not None:
+                intensities = aggregator.aggregate(intensities)
+
+            results.put(([event_id for event_id, _ in batch], intensities))
+
+    threads = [
+        threading.Thread(target=_run_stage, args=(read, batches, stop), daemon=True),
+        threading.Thread(
+            target=_run_stage, args=(infer, results, stop, batches), daemon=True
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+
+    keys = aggregator.codes if aggregator is not None else None
+    n_values = len(keys) if keys is not None else len(targets["lat"])
+    if output_format == "binary":
+        _write_binary_header(output_stream, mode, keys, n_values)
+
+    start = time.perf_counter()
+    last_report = start
+    n_events = 0
+    error = None
+    finished = False
+
+    # 書き出しはメインスレッドで行う
+    try:
+        while True:
+            item = results.get()
+            if item is _END:
+                finished = True
+                break
+            if isinstance(item, _StageError):
+                error = item.error
+                continue
+
+            event_ids, intensities = item
+            for event_id, values in zip(event_ids, intensities):
+                if output_format == "binary":
+                    _write_binary_event(output_stream, event_id, values)
+                else:
+                    _write_ndjson_event(output_stream, event_id, values, keys)
+            n_events += len(event_ids)
+
+            now = time.perf_counter()
+            if report_stream is not None and now - last_report >= report_interval:
+                last_report = now
+                print(
+                    f"{n_events} events, {n_events / (now - start):.1f} events/s",
+                    file=report_stream,
+                )
+    finally:
+        if not finished:
+            # 書き出しで失敗した場合は前の段を止め、残りは読み捨てる
+            stop.set()
+            _drain(results)
+        for thread in threads:
+            thread.join()
+
+    output_stream.flush()
+    if error is not None:
+        raise error
+
+    elapsed = time.perf_counter() - start
+    return {
+        "events": n_events,
+        "predictions": n_events * len(targets["lat"]),
+        "seconds": elapsed,
+        "events_per_second": n_events / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def _write_ndjson_event(
+    stream: IO[bytes], event_id: str, values: np.ndarray, keys: np.ndarray | None
+):
+    if keys is None:
+        d = {"id": event_id, "intensities": [round(float(v), 3) for v in values]}
+    else:
+        d = {
+            "id": event_id,
+            "regions": [
+                {"code": str(code), "maxInt": round(float(v), 3)}
+                for code, v in sorted(zip(keys, values), key=lambda x: -x[1])
+            ],
+        }
+    stream.write(json.dumps(d, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def _write_binary_header(
+    stream: IO[bytes], mode: str, keys: np.ndarray | None, n_values: int
+):
+    """
+    2進形式のヘッダ
+
+    "ASID", モード(0: 地点, 1: 細分区域), 値の数(uint32), 区域コードのJSONの長さ(uint32), 区域コードのJSON
+    """
+    codes = json.dumps([str(k) for k in keys] if keys is not None else []).encode()
+    stream.write(BINARY_MAGIC)
+    stream.write(struct.pack("<BII", mode == "region", n_values, len(codes)))
+    stream.write(codes)
+
+
+def _write_binary_event(stream: IO[bytes], event_id: str, values: np.ndarray):
+    """地震1つ分: IDの長さ(uint16), ID, 震度(float32 x 値の数)"""
+    encoded = event_id.encode("utf-8")
+    stream.write(struct.pack("<H", len(encoded)))
+    stream.write(encoded)
+    stream.write(np.asarray(values, dtype="<f4").tobytes())
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="asid-predict", description="NDJSONの地震データから震度をまとめて予測"
+    )
+    parser.add_argument("--weights", required=True, help="学習済みモデルの重み")
+    parser.add_argument(
+        "--model-type",
+        choices=["full", "student", "quantized"],
+        default="full",
+        help="モデルの種類",
+    )
+    parser.add_argument("--targets", required=True, help="予測地点のJSON")
+    parser.add_argument("--input", default="-", help="入力NDJSON (既定: 標準入力)")
+    parser.add_argument("--output", default="-", help="出力先 (既定: 標準出力)")
+    parser.add_argument("--mode", choices=["station", "region"], default="station")
+    parser.add_argument("--format", choices=["ndjson", "binary"], default="ndjson")
+    parser.add_argument("--batch-size", type=int, default=16, help="1回の推論の地震数")
+    parser.add_argument("--queue-size", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    model = _load_model(args.model_type, args.weights)
+    targets = _load_targets(args.targets)
+
+    input_stream = sys.stdin if args.input == "-" else open(args.input, "r")
+    output_stream = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+
+    # 標準出力は結果専用にして、kerasの進捗表示などは標準エラーに出す
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        report = run_pipeline(
+            model,
+            targets,
+            input_stream,
+            output_stream,
+            mode=args.mode,
+            output_format=args.format,
+            batch_size=args.batch_size,
+            queue_size=args.queue_size,
+            report_stream=sys.stderr,
+        )
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not stdout.buffer:
+            output_stream.close()
+        sys.stdout = stdout
+
+    print(
+        f"{report['events']} events ({report['predictions']} predictions) "
+        f"in {report['seconds']:.2f} s, {report['events_per_second']:.1f} events/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,10 @@ DROPOUT_RATE = 0.1
 HIDDEN_LAYERS = 7
 OUTPUT_DIMS = 1  # 予測震度
 
+# Student model parameters (蒸留用の小型モデル)
+STUDENT_DENSE_UNITS = 64
+STUDENT_HIDDEN_LAYERS = 3
+
 # Training parameters
 BATCH_SIZE = 128
 EPOCHS = 40
@@ -2,7 +2,26 @@
 学習用データの作成に関するモジュール
 """
 
+from .catalog_index import CatalogIndex
 from .data_file_loader import DataFileLoader
+from .interpolation import compare_interpolators
+from .interpolators import (
+    CompactRBFInterpolator,
+    IDWInterpolator,
+    Interpolator,
+    KrigingInterpolator,
+    get_interpolator,
+)
 from .train_record_generator import TrainingRecordGenerator
 
-__all__ = ["DataFileLoader", "TrainingRecordGenerator"]
+__all__ = [
+    "CatalogIndex",
+    "CompactRBFInterpolator",
+    "DataFileLoader",
+    "IDWInterpolator",
+    "Interpolator",
+    "KrigingInterpolator",
+    "TrainingRecordGenerator",
+    "compare_interpolators",
+    "get_interpolator",
+]
@@ -0,0 +1,198 @@
+"""
+地震データの一覧から条件に合う地震をまとめて選ぶための索引
+"""
+
+import json
+from collections.abc import Sequence
+
+import numpy as np
+
+from asid_predict.dataclass import EarthquakeRecord
+from asid_predict.utils import is_pacific_plate_area
+
+__all__ = ["CatalogIndex", "LazyEarthquakeRecords"]
+
+
+def _field(earthquake, name: str):
+    return earthquake[name] if isinstance(earthquake, dict) else getattr(earthquake, name)
+
+
+class LazyEarthquakeRecords(Sequence):
+    """選んだ地震の一覧 EarthquakeRecordは取り出すときに作る"""
+
+    def __init__(self, catalog: "CatalogIndex", indices: np.ndarray):
+        self._catalog = catalog
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return LazyEarthquakeRecords(self._catalog, self.indices[i])
+        return self._catalog.record(int(self.indices[i]))
+
+
+class CatalogIndex:
+    """
+    地震ごとの値を列ごとの配列で持ち、震央は格子に分けて索引をつける
+
+    各条件は地震数の長さのboolの配列を返すので、& | ~ で組み合わせて records() に渡す。
+
+        catalog = CatalogIndex.from_json("data/train_data.json")
+        mask = catalog.magnitude_between(5, 7) & catalog.in_polygon(polygon)
+        earthquakes = catalog.records(mask)
+    """
+
+    def __init__(self, earthquakes: list[dict | EarthquakeRecord], cell_size: float = 1.0):
+        """
+        :param earthquakes: 地震データ(JSONの辞書のままでも EarthquakeRecord でもよい)
+        :param cell_size: 震央の格子の大きさ[°]
+        """
+        self._source = earthquakes
+        self._records: dict[int, EarthquakeRecord] = {}
+
+        self.lat = np.array([_field(e, "lat") for e in earthquakes], dtype=np.float64)
+        self.lon = np.array([_field(e, "lon") for e in earthquakes], dtype=np.float64)
+        self.magnitude = np.array(
+            [_field(e, "magnitude") for e in earthquakes], dtype=np.float64
+        )
+        self.depth = np.array([_field(e, "depth") for e in earthquakes], dtype=np.float64)
+        self.n_stations = np.array(
+            [len(_field(e, "stations")) for e in earthquakes], dtype=np.int64
+        )
+        self.is_pacific = np.asarray(is_pacific_plate_area(self.lon, self.lat), dtype=bool)
+
+        # 震央の格子 格子の番号順に並べた地震の番号と、その格子の番号
+        self.cell_size = cell_size
+        self._lat0 = np.floor(self.lat.min()) if len(self.lat) else 0.0
+        self._lon0 = np.floor(self.lon.min()) if len(self.lon) else 0.0
+        rows, cols = self._cell_of(self.lat, self.lon)
+        self._n_cols = int(cols.max()) + 1 if len(cols) else 1
+        self._n_rows = int(rows.max()) + 1 if len(rows) else 1
+        cell = rows * self._n_cols + cols
+        self._order = np.argsort(cell, kind="stable")
+        self._sorted_cells = cell[self._order]
+
+    @classmethod
+    def from_json(cls, filepath: str, cell_size: float = 1.0) -> "CatalogIndex":
+        """学習データのJSONから作成(EarthquakeRecordは使うときに作る)"""
+        with open(filepath, "r") as f:
+            return cls(json.load(f), cell_size)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def _cell_of(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        rows = np.floor((lat - self._lat0) / self.cell_size).astype(np.int64)
+        cols = np.floor((lon - self._lon0) / self.cell_size).astype(np.int64)
+        return rows, cols
+
+    def record(self, i: int) -> EarthquakeRecord:
+        """i番目の地震のEarthquakeRecord(初回だけ作る)"""
+        if i not in self._records:
+            source = self._source[i]
+            self._records[i] = (
+                EarthquakeRecord(**source) if isinstance(source, dict) else source
+            )
+        return self._records[i]
+
+    def records(self, mask: np.ndarray = None) -> LazyEarthquakeRecords:
+        """条件に合う地震(元の順番)"""
+        if mask is None:
+            return LazyEarthquakeRecords(self, np.arange(len(self)))
+        return LazyEarthquakeRecords(self, np.flatnonzero(mask))
+
+    def all(self) -> np.ndarray:
+        return np.ones(len(self), dtype=bool)
+
+    def magnitude_between(self, low: float = -np.inf, high: float = np.inf) -> np.ndarray:
+        """low <= magnitude <= high"""
+        return (low <= self.magnitude) & (self.magnitude <= high)
+
+    def depth_between(self, low: float = -np.inf, high: float = np.inf) -> np.ndarray:
+        """low <= depth <= high"""
+        return (low <= self.depth) & (self.depth <= high)
+
+    def station_count_between(
+        self, low: float = 0, high: float = np.inf
+    ) -> np.ndarray:
+        """low <= 観測点数 <= high"""
+        return (low <= self.n_stations) & (self.n_stations <= high)
+
+    def pacific_plate(self, pacific: bool = True) -> np.ndarray:
+        """太平洋プレート(False: フィリピン海プレート)の地震"""
+        return self.is_pacific if pacific else ~self.is_pacific
+
+    def _candidates(
+        self, lat_range: tuple[float, float], lon_range: tuple[float, float]
+    ) -> np.ndarray:
+        """範囲にかかる格子に含まれる地震の番号"""
+        (row0, row1), (col0, col1) = self._cell_of(
+            np.array(lat_range), np.array(lon_range)
+        )
+        row0, col0 = max(row0, 0), max(col0, 0)
+        row1, col1 = min(row1, self._n_rows - 1), min(col1, self._n_cols - 1)
+        if row0 > row1 or col0 > col1:
+            return np.empty(0, dtype=np.int64)
+
+        # 格子の行ごとに列の範囲は連続しているので、行ごとに1回の検索で済む
+        rows = np.arange(row0, row1 + 1)
+        starts = np.searchsorted(self._sorted_cells, rows * self._n_cols + col0, "left")
+        stops = np.searchsorted(self._sorted_cells, rows * self._n_cols + col1, "right")
+        return np.concatenate(
+            [self._order[start:stop] for start, stop in zip(starts, stops)]
+        )
+
+    def in_box(
+        self,
+        lat_range: tuple[float, float],
+        lon_range: tuple[float, float],
+        inclusive: bool = True,
+    ) -> np.ndarray:
+        """震央が緯度経度の範囲内(inclusive=False で境界を含まない)"""
+        mask = np.zeros(len(self), dtype=bool)
+        candidates = self._candidates(lat_range, lon_range)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        if inclusive:
+            inside = (
+                (lat_range[0] <= lat)
+                & (lat <= lat_range[1])
+                & (lon_range[0] <= lon)
+                & (lon <= lon_range[1])
+            )
+        else:
+            inside = (
+                (lat_range[0] < lat)
+                & (lat < lat_range[1])
+                & (lon_range[0] < lon)
+                & (lon < lon_range[1])
+            )
+        mask[candidates[inside]] = True
+        return mask
+
+    def in_polygon(self, polygon: list[tuple[float, float]]) -> np.ndarray:
+        """
+        震央が多角形の内側
+
+        :param polygon: 頂点の (lat, lon) のリスト(閉じなくてよい)
+        """
+        vertices = np.asarray(polygon, dtype=np.float64)
+        mask = np.zeros(len(self), dtype=bool)
+        candidates = self._candidates(
+            (vertices[:, 0].min(), vertices[:, 0].max()),
+            (vertices[:, 1].min(), vertices[:, 1].max()),
+        )
+        lat, lon = self.lat[candidates], self.lon[candidates]
+
+        # 震央から東に伸ばした線が辺と交わる回数の偶奇で判定
+        inside = np.zeros(len(candidates), dtype=bool)
+        for (lat1, lon1), (lat2, lon2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+            if lat1 == lat2:
+                continue
+            crosses = (lat1 > lat) != (lat2 > lat)
+            lon_cross = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+            inside ^= crosses & (lon < lon_cross)
+
+        mask[candidates[inside]] = True
+        return mask
@@ -2,22 +2,23 @@
 ファイルから観測データの読み込み
 """
 
+import functools
 import importlib.resources as resources
 import json
 
 from asid_predict.config import TRAIN_DATA
 from asid_predict.dataclass import EarthquakeRecord
-from asid_predict.utils import is_pacific_plate_area
+from asid_predict.utils import load_package_point_set
+from .catalog_index import CatalogIndex
 
 __all__ = ["DataFileLoader"]
 
 
 class DataFileLoader:
     def __init__(self, eq_data_json_path: str = TRAIN_DATA):
-        # 地震データ
+        # 地震データ(EarthquakeRecordは使うときに作る)
         with open(eq_data_json_path if eq_data_json_path else TRAIN_DATA, "r") as f:
-            earthquake_dict = json.load(f)
-            self.earthquakes = [EarthquakeRecord(**d) for d in earthquake_dict]
+            self._earthquake_dicts = json.load(f)
 
         # 予測点データ
         with resources.open_text("asid_predict.data", "predict_points.json") as f:
@@ -27,45 +28,37 @@ class DataFileLoader:
         with resources.open_text("asid_predict.data", "coast_points.json") as f:
             self.coast_points = json.load(f)
 
-    def _is_target_earthquake(
+        # 距離計算用に事前計算した予測点・海岸点
+        self.predict_point_set = load_package_point_set("predict_points.json")
+        self.coast_point_set = load_package_point_set("coast_points.json")
+
+    @functools.cached_property
+    def catalog(self) -> CatalogIndex:
+        """地震データの索引"""
+        return CatalogIndex(self._earthquake_dicts)
+
+    @functools.cached_property
+    def earthquakes(self) -> list[EarthquakeRecord]:
+        """全ての地震データ"""
+        return list(self.catalog.records())
+
+    def get_filtered_earthquakes(
         self,
-        earthquake: EarthquakeRecord,
         target_is_pasific_plate: bool,
         min_depth: float = 120,
         min_lon: float = 120,
         max_lon: float = 150,
         min_lat: float = 20,
         max_lat: float = 50,
-    ) -> bool:
-        """学習対象の地震かどうかを判定"""
-
-        # どっちのプレート
-        is_pacific = is_pacific_plate_area(earthquake.lon, earthquake.lat)
-        target_plate = is_pacific if target_is_pasific_plate else not is_pacific
-
-        # 震源位置
-        area = (
-            min_lon < earthquake.lon
-            and earthquake.lon < max_lon
-            and min_lat < earthquake.lat
-            and earthquake.lat < max_lat
-        )
-
-        # 深さ
-        depth = earthquake.depth > min_depth
-
-        return target_plate and area and depth
-
-    def get_filtered_earthquakes(
-        self, target_is_pasific_plate: bool, min_depth: float = 120
-    ):
+    ) -> list[EarthquakeRecord]:
         """学習対象の地震のみを取得"""
-        filtered_earthquake_records: list[EarthquakeRecord] = filter(
-            lambda earthquake: self._is_target_earthquake(
-                earthquake,
-                target_is_pasific_plate,
-                min_depth,
-            ),
-            self.earthquakes,
+        catalog = self.catalog
+        mask = (
+            # どっちのプレート
+            catalog.pacific_plate(target_is_pasific_plate)
+            # 震源位置
+            & catalog.in_box((min_lat, max_lat), (min_lon, max_lon), inclusive=False)
+            # 深さ
+            & (catalog.depth > min_depth)
         )
-        return list(filtered_earthquake_records)
+        return list(catalog.records(mask))
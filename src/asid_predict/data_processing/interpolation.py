@@ -2,17 +2,28 @@
 補間の実装
 """
 
+import time
+
 import numpy as np
-from pykrige.ok import OrdinaryKriging
 
 from asid_predict.dataclass import TrainingRecord
-from asid_predict.utils import calc_distance, calculate_pgv400
+from asid_predict.utils import AttenuationTable, calc_distance_array, lookup_pgv400
+from .interpolators import Interpolator, get_interpolator
+
+__all__ = ["interpolate_train_records", "compare_interpolators"]
 
 
 def interpolate_train_records(
     records: list[TrainingRecord],
     predict_points: list,
+    attenuation_table: AttenuationTable = None,
+    interpolator: str | Interpolator = None,
 ) -> list[TrainingRecord]:
+    """
+    観測点の増幅率を予測点に補間する
+
+    :param interpolator: 補間方法 "kriging"(既定) / "idw" / "rbf" または Interpolator
+    """
     if len(records) < 3:
         # 3点未満なら補間しない
         return []
@@ -22,27 +33,32 @@ def interpolate_train_records(
 
     predict_x = np.array([[p["lon"], p["lat"]] for p in predict_points])
 
-    try:
-        # nuggetパラメータを追加して数値的安定性を向上
-        ok = OrdinaryKriging(
-            x[:, 0],
-            x[:, 1],
-            y,
-            variogram_model="spherical",
-        )
-        zvalues, sigmasq = ok.execute("points", predict_x[:, 0], predict_x[:, 1])
-    except Exception as e:
-        print(f"補間エラー: {str(e)}")
-        print(f"入力データ数: {len(records)}")
-        raise
+    zvalues = get_interpolator(interpolator).interpolate(
+        x[:, 0], x[:, 1], y, predict_x[:, 0], predict_x[:, 1]
+    )
 
-    # 結果をTrainingRecordに変換
+    # 震源と予測点の距離から、距離減衰式のPGV400をまとめて計算
     reference_record = records[0]
+    distance = calc_distance_array(
+        reference_record.hypocenter_lat,
+        reference_record.hypocenter_lon,
+        predict_x[:, 1],
+        predict_x[:, 0],
+    )
+    base_pgv400 = lookup_pgv400(
+        distance,
+        reference_record.magnitude,
+        reference_record.depth,
+        attenuation_table,
+    )
+
+    # 結果をTrainingRecordに変換
     return [
         _create_interpolated_record(
             reference_record=reference_record,
             predict_point=predict_x[i],
             interpolated_value=zvalues[i],
+            base_pgv400=base_pgv400[i],
         )
         for i in range(len(predict_x))
     ]
@@ -52,24 +68,12 @@ def _create_interpolated_record(
     reference_record: TrainingRecord,
     predict_point: np.ndarray,
     interpolated_value: float,
+    base_pgv400: float,
 ) -> TrainingRecord:
     """補間された地点のTrainingRecordを作成"""
     station_lon, station_lat = predict_point[0], predict_point[1]
 
-    # 震源と観測点の距離を計算
-    distance = calc_distance(
-        reference_record.hypocenter_lat,
-        reference_record.hypocenter_lon,
-        station_lat,
-        station_lon,
-    )
-
-    # 距離減衰式でPGV400を計算し、補間された倍率を適用
-    base_pgv400 = calculate_pgv400(
-        distance=distance,
-        magnitude=reference_record.magnitude,
-        depth=reference_record.depth,
-    )
+    # 距離減衰式のPGV400に補間された倍率を適用
     interpolated_pgv400 = base_pgv400 * interpolated_value
 
     return TrainingRecord(
@@ -82,3 +86,69 @@ def _create_interpolated_record(
         pgv400=interpolated_pgv400,
         amplification_factor=interpolated_value,
     )
+
+
+def compare_interpolators(
+    records_per_earthquake: list[list[TrainingRecord]],
+    interpolators: tuple[str | Interpolator, ...] = ("kriging", "idw", "rbf"),
+    holdout_rate: float = 0.2,
+    seed: int = 0,
+) -> dict[str, dict]:
+    """
+    地震ごとに観測点の一部を除いて補間し、除いた観測点の増幅率との差で補間方法を比べる
+
+    :param records_per_earthquake: 地震ごとの観測データ(TrainingRecordGenerator._create_raw_records の結果など)
+    :param holdout_rate: 補間に使わず答え合わせに使う観測点の割合
+    :return: {補間方法: {"mae", "rmse", "ms_per_earthquake", "failures", "n_earthquakes"}}
+    """
+    rng = np.random.default_rng(seed)
+
+    # 全ての補間方法で同じ観測点を除く
+    splits = []
+    for records in records_per_earthquake:
+        n_holdout = int(len(records) * holdout_rate)
+        if n_holdout == 0 or len(records) - n_holdout < 3:
+            continue
+        order = rng.permutation(len(records))
+        splits.append(
+            (
+                [records[i] for i in order[n_holdout:]],
+                [records[i] for i in order[:n_holdout]],
+            )
+        )
+
+    report = {}
+    for interpolator in interpolators:
+        implementation = get_interpolator(interpolator)
+        errors = []
+        failures = 0
+        seconds = 0.0
+        for train, test in splits:
+            start = time.perf_counter()
+            try:
+                predicted = implementation.interpolate(
+                    np.array([r.station_lon for r in train]),
+                    np.array([r.station_lat for r in train]),
+                    np.array([[r.amplification_factor] for r in train]),
+                    np.array([r.station_lon for r in test]),
+                    np.array([r.station_lat for r in test]),
+                )
+            except Exception:
+                failures += 1
+                continue
+            finally:
+                seconds += time.perf_counter() - start
+            errors.append(
+                np.ravel(predicted) - np.array([r.amplification_factor for r in test])
+            )
+
+        errors = np.concatenate(errors) if errors else np.array([np.nan])
+        report[getattr(interpolator, "name", interpolator)] = {
+            "mae": float(np.mean(np.abs(errors))),
+            "rmse": float(np.sqrt(np.mean(errors**2))),
+            "ms_per_earthquake": seconds / max(len(splits), 1) * 1e3,
+            "failures": failures,
+            "n_earthquakes": len(splits),
+        }
+
+    return report
@@ -0,0 +1,184 @@
+"""
+補間データの作成に使う空間補間の実装(クリギング / IDW / コンパクトサポートRBF)
+"""
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+from scipy.spatial import cKDTree
+
+from asid_predict.utils import PointSet
+
+__all__ = [
+    "Interpolator",
+    "KrigingInterpolator",
+    "IDWInterpolator",
+    "CompactRBFInterpolator",
+    "INTERPOLATORS",
+    "get_interpolator",
+]
+
+# 地球の半径[km] (単位ベクトル間の弦の長さを距離にする)
+EARTH_RADIUS = 6371.0
+
+
+class Interpolator(ABC):
+    """観測点の値から予測点の値を補間する"""
+
+    name = "base"
+
+    @abstractmethod
+    def interpolate(
+        self,
+        lon: np.ndarray,
+        lat: np.ndarray,
+        values: np.ndarray,
+        target_lon: np.ndarray,
+        target_lat: np.ndarray,
+    ) -> np.ndarray:
+        """観測点 (lon, lat) の values から予測点 (target_lon, target_lat) の値を補間"""
+
+
+class KrigingInterpolator(Interpolator):
+    """通常クリギング(pykrige) 従来の補間"""
+
+    name = "kriging"
+
+    def __init__(self, variogram_model: str = "spherical"):
+        self.variogram_model = variogram_model
+
+    def interpolate(self, lon, lat, values, target_lon, target_lat):
+        from pykrige.ok import OrdinaryKriging
+
+        try:
+            ok = OrdinaryKriging(
+                lon,
+                lat,
+                values,
+                variogram_model=self.variogram_model,
+            )
+            zvalues, sigmasq = ok.execute("points", target_lon, target_lat)
+        except Exception as e:
+            print(f"補間エラー: {str(e)}")
+            print(f"入力データ数: {len(values)}")
+            raise
+
+        return np.asarray(zvalues)
+
+
+def _tree_and_targets(lon, lat, target_lon, target_lat):
+    """観測点の単位ベクトルのkd木と、予測点の単位ベクトル"""
+    stations = PointSet(lat, lon)
+    targets = PointSet(target_lat, target_lon)
+    return cKDTree(stations.unit_vectors), targets.unit_vectors
+
+
+class IDWInterpolator(Interpolator):
+    """
+    近いk点の距離の逆数の重み付き平均
+
+    :param k: 使う観測点の数
+    :param power: 距離の何乗で重みを小さくするか
+    :param max_distance: これより遠い観測点は使わない[km] (近くに1点もなければ全体の平均)
+    """
+
+    name = "idw"
+
+    def __init__(self, k: int = 8, power: float = 2.0, max_distance: float = None):
+        self.k = k
+        self.power = power
+        self.max_distance = max_distance
+
+    def interpolate(self, lon, lat, values, target_lon, target_lat):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        tree, targets = _tree_and_targets(lon, lat, target_lon, target_lat)
+        k = min(self.k, len(values))
+        upper = (
+            self.max_distance / EARTH_RADIUS if self.max_distance is not None else np.inf
+        )
+
+        chord, index = tree.query(targets, k=k, distance_upper_bound=upper)
+        chord, index = chord.reshape(len(targets), k), index.reshape(len(targets), k)
+        found = np.isfinite(chord)
+        index = np.where(found, index, 0)
+        distance = chord * EARTH_RADIUS
+
+        # 観測点と同じ位置なら、その値をそのまま使う
+        with np.errstate(divide="ignore"):
+            weights = np.where(found, 1.0 / np.maximum(distance, 1e-9) ** self.power, 0.0)
+        total = weights.sum(axis=1)
+
+        result = np.full(len(targets), values.mean())
+        has = total > 0
+        result[has] = (weights[has] * values[index[has]]).sum(axis=1) / total[has]
+        return result
+
+
+def _wendland(r: np.ndarray) -> np.ndarray:
+    """Wendland C2 関数 (r = 距離 / 半径、1以上で0)"""
+    r = np.clip(r, 0, 1)
+    return (1 - r) ** 4 * (4 * r + 1)
+
+
+class CompactRBFInterpolator(Interpolator):
+    """
+    コンパクトサポートの動径基底関数(Wendland C2)による補間
+
+    半径内の観測点同士だけが影響しあうので、疎行列の連立方程式を解く。
+    平均値からのずれを補間し、半径内に観測点がない予測点は平均値になる。
+
+    :param radius: 影響半径[km]
+    :param smoothing: 対角に足す値(大きいほど観測値を通らずなめらかになる)
+    """
+
+    name = "rbf"
+
+    def __init__(self, radius: float = 150.0, smoothing: float = 1e-3):
+        self.radius = radius
+        self.smoothing = smoothing
+
+    def interpolate(self, lon, lat, values, target_lon, target_lat):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        tree, targets = _tree_and_targets(lon, lat, target_lon, target_lat)
+        chord_radius = self.radius / EARTH_RADIUS
+        mean = values.mean()
+
+        # 観測点同士の半径内の組(自分自身を含む)だけで疎行列を作る
+        pairs = tree.sparse_distance_matrix(tree, chord_radius, output_type="coo_matrix")
+        matrix = sparse.coo_matrix(
+            (_wendland(pairs.data / chord_radius), (pairs.row, pairs.col)),
+            shape=(len(values), len(values)),
+        ).tocsc() + sparse.identity(len(values), format="csc") * self.smoothing
+        coefficients = spsolve(matrix, values - mean)
+
+        target_tree = cKDTree(targets)
+        cross = target_tree.sparse_distance_matrix(
+            tree, chord_radius, output_type="coo_matrix"
+        )
+        result = np.full(len(targets), mean)
+        np.add.at(
+            result,
+            cross.row,
+            _wendland(cross.data / chord_radius) * coefficients[cross.col],
+        )
+        return result
+
+
+INTERPOLATORS = {
+    KrigingInterpolator.name: KrigingInterpolator,
+    IDWInterpolator.name: IDWInterpolator,
+    CompactRBFInterpolator.name: CompactRBFInterpolator,
+}
+
+
+def get_interpolator(interpolator: str | Interpolator = None) -> Interpolator:
+    """名前("kriging" / "idw" / "rbf")か Interpolator から補間の実装を得る(既定はクリギング)"""
+    if interpolator is None:
+        return KrigingInterpolator()
+    if isinstance(interpolator, Interpolator):
+        return interpolator
+    if interpolator not in INTERPOLATORS:
+        raise ValueError(f"未対応の補間方法です: {interpolator}")
+    return INTERPOLATORS[interpolator]()
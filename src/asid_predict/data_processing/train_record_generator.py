@@ -2,17 +2,23 @@
 観測データの補間や水増で学習データTrainingRecordを生成するクラス
 """
 
-import random
+import zlib
+
+import numpy as np
 
 from asid_predict.dataclass import EarthquakeRecord, TrainingRecord
 from asid_predict.utils import (
-    calc_amplification_factor_from_pgv400,
-    calculate_intensity,
+    AttenuationTable,
+    PointSet,
+    calc_max_distance,
     convert_intensity_to_pgv,
-    convert_pgv_to_intensity,
+    convert_pgv_to_intensity_array,
     calc_distance,
+    calc_distance_array,
+    lookup_pgv400,
 )
 from .interpolation import interpolate_train_records
+from .interpolators import Interpolator
 
 # 補間多すぎるとつらいから割合を決める
 
@@ -20,50 +26,158 @@ INTERPOLATE_RATE = 0.3
 INTERPOLATE_RATE_FAR = 0.3
 KYORI_GENSUI_RATE = 0.02
 
+# 地震ごとの乱数を段階ごとに分ける(段階を飛ばしても他の段階の乱数は変わらない)
+_STAGES = ("duplicate", "coast", "instant", "interpolate", "sample")
+
 
 class TrainingRecordGenerator:
-    def __init__(self, predict_points: dict, coast_points: dict):
+    def __init__(
+        self,
+        predict_points: dict,
+        coast_points: dict,
+        attenuation_table: AttenuationTable = None,
+        predict_point_set: PointSet = None,
+        coast_point_set: PointSet = None,
+        interpolator: str | Interpolator = None,
+        seed: int = None,
+    ):
+        """
+        :param interpolator: 補間データの作成に使う補間方法 "kriging"(既定) / "idw" / "rbf"
+        :param seed: 乱数のシード 地震ごとにシードと地震の内容から乱数を作るので、
+            同じシードなら地震の順番や並列処理に関係なく同じ結果になる(Noneなら毎回変わる)
+        """
+        self._seed = np.random.SeedSequence(seed).entropy
         self.predict_points = predict_points
         self.coast_points = coast_points
+        self.attenuation_table = attenuation_table
+        self.interpolator = interpolator
+
+        # 距離計算用に事前計算した値(DataFileLoaderのものを渡せば再計算しない)
+        self.predict_point_set = (
+            predict_point_set
+            if predict_point_set is not None
+            else PointSet.from_points(predict_points)
+        )
+        self.coast_point_set = (
+            coast_point_set
+            if coast_point_set is not None
+            else PointSet.from_points(coast_points)
+        )
+
+    def _event_rngs(self, earthuake: EarthquakeRecord) -> dict[str, np.random.Generator]:
+        """地震ごと・段階ごとの乱数"""
+        key = zlib.crc32(
+            repr(
+                (
+                    earthuake.name,
+                    earthuake.lat,
+                    earthuake.lon,
+                    earthuake.depth,
+                    earthuake.magnitude,
+                    len(earthuake.stations),
+                )
+            ).encode("utf-8")
+        )
+        sequences = np.random.SeedSequence([self._seed, key]).spawn(len(_STAGES))
+        return {
+            stage: np.random.default_rng(sequence)
+            for stage, sequence in zip(_STAGES, sequences)
+        }
 
     def from_earthquake(self, earthuake: EarthquakeRecord) -> list[TrainingRecord]:
         """学習用データ作成"""
+        rngs = self._event_rngs(earthuake)
 
         # 各種データの作成
         records_raw = self._create_raw_records(earthuake)
-        records_dup = self._create_duplicate_records(earthuake, records_raw)
-        records_coast = self._create_coast_records(earthuake, records_raw)
-        records_simple_i = self._create_instant_records(earthuake, records_raw)
+        records_dup = self._create_duplicate_records(
+            earthuake, records_raw, rngs["duplicate"]
+        )
+        records_coast = self._create_coast_records(earthuake, records_raw, rngs["coast"])
+        records_simple_i = self._create_instant_records(
+            earthuake, records_raw, rngs["instant"]
+        )
         records_interpolate = self._create_interpolate_records(
-            earthuake, records_raw, records_coast, records_simple_i
+            earthuake, records_raw, records_coast, records_simple_i, rngs["interpolate"]
         )
 
-        return (
+        return [
             # 実測データ
-            records_raw
+            *records_raw,
             # 実測の複製水増ししデータ
-            + records_dup
+            *records_dup,
+            *self._sample_interpolated_records(
+                len(records_raw) + len(records_dup),
+                records_interpolate,
+                records_coast,
+                records_simple_i,
+                rngs["sample"],
+            ),
+        ]
+
+    def from_earthquake_weighted(
+        self, earthuake: EarthquakeRecord
+    ) -> tuple[list[TrainingRecord], list[int]]:
+        """
+        複製水増しデータを作らずに学習用データ作成
+
+        実測データには複製水増しする回数を付けて返す(それ以外は0)。
+        複製は学習時にバッチごとに作る(models.AugmentedRecordDataset)。
+        補間データなどの数は from_earthquake と同じく複製を含めた数から決める。
+        """
+        rngs = self._event_rngs(earthuake)
+        records_raw = self._create_raw_records(earthuake)
+        dup_counts = [self._duplicate_count(record) for record in records_raw]
+        records_coast = self._create_coast_records(earthuake, records_raw, rngs["coast"])
+        records_simple_i = self._create_instant_records(
+            earthuake, records_raw, rngs["instant"]
+        )
+        records_interpolate = self._create_interpolate_records(
+            earthuake, records_raw, records_coast, records_simple_i, rngs["interpolate"]
+        )
+
+        records_others = self._sample_interpolated_records(
+            len(records_raw) + sum(dup_counts),
+            records_interpolate,
+            records_coast,
+            records_simple_i,
+            rngs["sample"],
+        )
+
+        return (
+            records_raw + records_others,
+            dup_counts + [0] * len(records_others),
+        )
+
+    def _sample_interpolated_records(
+        self,
+        n_observed: int,
+        records_interpolate: list[TrainingRecord],
+        records_coast: list[TrainingRecord],
+        records_simple_i: list[TrainingRecord],
+        rng: np.random.Generator,
+    ) -> list[TrainingRecord]:
+        """実測データ(複製含む)の数に合わせて補間データを選ぶ"""
+        return [
             # 補間データ
-            + random.sample(
+            *_sample(
+                rng,
                 records_interpolate,
-                min(len(records_interpolate), int(len(records_raw + records_dup) * 20)),
-            )
+                min(len(records_interpolate), int(n_observed * 20)),
+            ),
             # 揺れない場所データもちょっと入れよう
-            + random.sample(
+            *_sample(
+                rng,
                 records_coast,
-                int(min(len(records_coast) * 0.1, len(records_raw + records_dup) * 10)),
-            )
+                int(min(len(records_coast) * 0.1, n_observed * 10)),
+            ),
             # 簡易補間データもちょっとだけ入れよう
-            + random.sample(
+            *_sample(
+                rng,
                 records_simple_i,
-                int(
-                    min(
-                        len(records_simple_i) * 0.05,
-                        len(records_raw + records_dup) * 10,
-                    )
-                ),
-            )
-        )
+                int(min(len(records_simple_i) * 0.05, n_observed * 10)),
+            ),
+        ]
 
     def _create_raw_records(self, earthuake: EarthquakeRecord) -> list[TrainingRecord]:
         """実測データの作成"""
@@ -97,27 +211,30 @@ class TrainingRecordGenerator:
         return records_raw
 
     def _create_coast_records(
-        self, earthuake: EarthquakeRecord, records_raw: list[TrainingRecord]
+        self,
+        earthuake: EarthquakeRecord,
+        records_raw: list[TrainingRecord],
+        rng: np.random.Generator,
     ) -> list[TrainingRecord]:
         """揺れない場所データ(補間用)の作成"""
         records_coast = self._gen_instant_interpolate_points(
-            earthuake, records_raw, self.coast_points, self._coast_pick_rate
+            earthuake, records_raw, self.coast_point_set, self._coast_pick_rate, rng
         )
         self._calc_amplification_factor(earthuake, records_coast)
         return records_coast
 
     def _create_instant_records(
-        self, earthuake: EarthquakeRecord, records_raw: list[TrainingRecord]
+        self,
+        earthuake: EarthquakeRecord,
+        records_raw: list[TrainingRecord],
+        rng: np.random.Generator,
     ) -> list[TrainingRecord]:
         """ちょっと水増しデータ(補間用)の作成"""
-        records_instant: list[TrainingRecord] = []
-        for record in self._gen_instant_interpolate_points(
-            earthuake, records_raw, self.predict_points, self._instant_pick_rate
-        ):
-            if self._can_add_station(records_raw, record, 80, 0):
-                continue
-
-            records_instant.append(record)
+        records = self._gen_instant_interpolate_points(
+            earthuake, records_raw, self.predict_point_set, self._instant_pick_rate, rng
+        )
+        excluded = self._has_stronger_neighbor(records_raw, records, 80, 0)
+        records_instant = [r for r, e in zip(records, excluded) if not e]
         self._calc_amplification_factor(earthuake, records_instant)
         return records_instant
 
@@ -127,30 +244,32 @@ class TrainingRecordGenerator:
         records_raw: list[TrainingRecord],
         records_coast: list[TrainingRecord],
         records_instant: list[TrainingRecord],
+        rng: np.random.Generator,
     ) -> list[TrainingRecord]:
         """補間データの作成"""
         max_distance = self._calc_max_distance(earthuake)
         records_interpolate: list[TrainingRecord] = []
-        random_predict_points = random.sample(
-            self.predict_points, int(len(self.predict_points) * 0.1)
+        random_predict_points = _sample(
+            rng, self.predict_points, int(len(self.predict_points) * 0.1)
         )
 
-        for record in interpolate_train_records(
-            records_raw + records_coast + records_instant,
+        records = interpolate_train_records(
+            [*records_raw, *records_coast, *records_instant],
             random_predict_points,
-        ):
-            # そもそも減衰式の範囲外なら除外
-            distance = calc_distance(
-                earthuake.lat,
-                earthuake.lon,
-                record.station_lat,
-                record.station_lon,
-            )
-            if distance > max_distance:
-                continue
+            self.attenuation_table,
+            self.interpolator,
+        )
+        if not records:
+            return records_interpolate
+
+        # そもそも減衰式の範囲外なら除外
+        distance = _point_set_of(records).distances_from(earthuake.lat, earthuake.lon)
+
+        # 周囲100km以内に自分より3倍以上PGV400が高い観測点があれば除外
+        excluded = self._has_stronger_neighbor(records_raw, records, 100, 3)
 
-            # 周囲100km以内に自分より3倍以上PGV400が高い観測点があれば除外
-            if self._can_add_station(records_raw, record, 100, 3):
+        for record, d, e in zip(records, distance, excluded):
+            if d > max_distance or e:
                 continue
 
             records_interpolate.append(record)
@@ -158,44 +277,43 @@ class TrainingRecordGenerator:
         return records_interpolate
 
     def _create_duplicate_records(
-        self, earthquake: EarthquakeRecord, records_raw: list[TrainingRecord]
+        self,
+        earthquake: EarthquakeRecord,
+        records_raw: list[TrainingRecord],
+        rng: np.random.Generator,
     ) -> list[TrainingRecord]:
         """生データの水増しデータを作成"""
-        records_dup = []
-
-        for record in records_raw:
-            if record.pgv400 <= convert_intensity_to_pgv(0.0):
-                continue
-
-            # pgv400の値に基づいて水増し回数を決定（最大300回）
-            dup_count = int(record.pgv400**0.6 * 10)
-
-            for _ in range(dup_count):
-                # 緯度経度を±0.1°の範囲でランダムに変更
-                new_lat = record.station_lat + random.uniform(-0.1, 0.1)
-                new_lon = record.station_lon + random.uniform(-0.1, 0.1)
-
-                # pgv400とamplification_factorに0.9-1.1の乱数をかける
-                amplification_factor = random.uniform(0.9, 1.1)
-                new_pgv400 = record.pgv400 * amplification_factor
-                new_amplification_factor = (
-                    record.amplification_factor * amplification_factor
-                )
+        counts = [self._duplicate_count(record) for record in records_raw]
+        sources = np.repeat(np.arange(len(records_raw)), counts)
+
+        # 緯度経度を±0.1°の範囲でランダムに変更
+        d_lat = rng.uniform(-0.1, 0.1, len(sources))
+        d_lon = rng.uniform(-0.1, 0.1, len(sources))
+
+        # pgv400とamplification_factorに0.9-1.1の乱数をかける
+        factors = rng.uniform(0.9, 1.1, len(sources))
+
+        return [
+            TrainingRecord(
+                magnitude=record.magnitude,
+                depth=record.depth,
+                hypocenter_lat=record.hypocenter_lat,
+                hypocenter_lon=record.hypocenter_lon,
+                station_lat=record.station_lat + float(d_lat[i]),
+                station_lon=record.station_lon + float(d_lon[i]),
+                pgv400=record.pgv400 * float(factors[i]),
+                amplification_factor=record.amplification_factor * float(factors[i]),
+            )
+            for i, record in enumerate(records_raw[j] for j in sources)
+        ]
 
-                # 新しいレコードを作成
-                new_record = TrainingRecord(
-                    magnitude=record.magnitude,
-                    depth=record.depth,
-                    hypocenter_lat=record.hypocenter_lat,
-                    hypocenter_lon=record.hypocenter_lon,
-                    station_lat=new_lat,
-                    station_lon=new_lon,
-                    pgv400=new_pgv400,
-                    amplification_factor=new_amplification_factor,
-                )
-                records_dup.append(new_record)
+    def _duplicate_count(self, record: TrainingRecord) -> int:
+        """実測データを複製水増しする回数"""
+        if record.pgv400 <= convert_intensity_to_pgv(0.0):
+            return 0
 
-        return records_dup
+        # pgv400の値に基づいて水増し回数を決定（最大300回）
+        return int(record.pgv400**0.6 * 10)
 
     def _can_add_station(
         self,
@@ -214,105 +332,150 @@ class TrainingRecordGenerator:
 
         return False
 
+    def _has_stronger_neighbor(
+        self,
+        existing: list[TrainingRecord],
+        records: list[TrainingRecord],
+        neighbor_range: float = 20,
+        neighbor_threshold: float = 2,
+    ) -> np.ndarray:
+        """_can_add_stationをrecordsについてまとめて判定"""
+        if not existing or not records:
+            return np.zeros(len(records), dtype=bool)
+
+        distances = _point_set_of(records).distance_matrix(_point_set_of(existing))
+        existing_pgv400 = np.array([r.pgv400 for r in existing])
+        pgv400 = np.array([r.pgv400 for r in records])
+
+        return np.any(
+            (distances < neighbor_range)
+            & (existing_pgv400[None, :] * neighbor_threshold > pgv400[:, None]),
+            axis=1,
+        )
+
     def _calc_amplification_factor(
         self, earthuake: EarthquakeRecord, records: list[TrainingRecord]
     ):
         """TrainingRecordリストのamplification_factorを計算して入れる"""
+        if not records:
+            return
+
+        distance = calc_distance_array(
+            earthuake.lat,
+            earthuake.lon,
+            np.array([r.station_lat for r in records]),
+            np.array([r.station_lon for r in records]),
+        )
+        calc_pgv400 = lookup_pgv400(
+            distance, earthuake.magnitude, earthuake.depth, self.attenuation_table
+        )
 
-        for i in range(len(records)):
-            records[i].amplification_factor = calc_amplification_factor_from_pgv400(
-                earthuake,
-                records[i],
-            )
+        # 倍率 (calc_amplification_factor_from_pgv400と同じ変換)
+        pgv400 = np.array([r.pgv400 for r in records])
+        amplification_factors = (pgv400 / calc_pgv400 / 20) ** (1 / 4)
+
+        for record, amplification_factor in zip(records, amplification_factors):
+            record.amplification_factor = float(amplification_factor)
 
     def _gen_instant_interpolate_points(
         self,
         earthuake: EarthquakeRecord,
         records_raw: list[TrainingRecord],
-        predict_points: dict,
+        point_set: PointSet,
         joken,
+        rng: np.random.Generator,
     ) -> list[TrainingRecord]:
         """一番近い観測点から簡易的に補間"""
 
-        records_interpolate: list[TrainingRecord] = []
-        for point in predict_points:
-
-            # 一定確率で除外
-            if random.random() > INTERPOLATE_RATE:
-                continue
-
-            LAT = point["lat"]
-            LON = point["lon"]
+        # 一定確率で除外 (残った地点だけ距離を計算する)
+        candidates = np.flatnonzero(rng.random(len(point_set)) <= INTERPOLATE_RATE)
+        if not records_raw or len(candidates) == 0:
+            return []
 
-            # 最も近い震度データがある点を求める
-            nearest_distance = 999999
-            nearest_record = None
-            for record_raw in records_raw:
-                distance = calc_distance(
-                    LAT, LON, record_raw.station_lat, record_raw.station_lon
-                )
-                if distance < nearest_distance:
-                    nearest_distance = distance
-                    nearest_record = record_raw
-
-            # 距離の条件を満たす場合に計算
-            if nearest_record is None or not joken(LAT, LON, nearest_record):
-                continue
+        # 最も近い震度データがある点を求める
+        points = point_set.subset(candidates)
+        raw_point_set = _point_set_of(records_raw)
+        nearest_index, nearest_distance = points.nearest(raw_point_set)
+        nearest_lon = raw_point_set.lon[nearest_index]
 
-            for_calc_distance = calc_distance(
-                LAT,
-                LON,
-                nearest_record.station_lat,
-                LON + (nearest_record.station_lon - LON) * 2.5,
-            )
+        # 距離の条件を満たす地点だけ計算
+        picked = np.flatnonzero(
+            joken(points.lat, points.lon, nearest_lon, nearest_distance, rng)
+        )
+        lat, lon = points.lat[picked], points.lon[picked]
+        nearest_index = nearest_index[picked]
+
+        # 経度方向の差を2.5倍にした距離
+        for_calc_distance = calc_distance_array(
+            lat,
+            lon,
+            raw_point_set.lat[nearest_index],
+            lon + (nearest_lon[picked] - lon) * 2.5,
+        )
 
-            # 最も近いPGV400からの距離減衰
-            PGV400 = convert_intensity_to_pgv(
-                convert_pgv_to_intensity(nearest_record.pgv400)
-                - KYORI_GENSUI_RATE * for_calc_distance
-            )
+        # 最も近いPGV400からの距離減衰
+        raw_pgv400 = np.array([r.pgv400 for r in records_raw])
+        pgv400 = convert_intensity_to_pgv(
+            convert_pgv_to_intensity_array(raw_pgv400[nearest_index])
+            - KYORI_GENSUI_RATE * for_calc_distance
+        )
 
-            records_interpolate.append(
-                TrainingRecord(
-                    magnitude=earthuake.magnitude,
-                    depth=earthuake.depth,
-                    hypocenter_lat=earthuake.lat,
-                    hypocenter_lon=earthuake.lon,
-                    station_lat=LAT,
-                    station_lon=LON,
-                    pgv400=PGV400,
-                    amplification_factor=None,
-                )
+        return [
+            TrainingRecord(
+                magnitude=earthuake.magnitude,
+                depth=earthuake.depth,
+                hypocenter_lat=earthuake.lat,
+                hypocenter_lon=earthuake.lon,
+                station_lat=float(lat[i]),
+                station_lon=float(lon[i]),
+                pgv400=float(pgv400[i]),
+                amplification_factor=None,
             )
+            for i in range(len(picked))
+        ]
 
-        return records_interpolate
-
-    def _coast_pick_rate(self, lat: float, lon: float, record: TrainingRecord) -> bool:
-        distance = calc_distance(lat, lon, record.station_lat, record.station_lon)
-        return (
-            80 < distance and distance < 300
-        ) or random.random() < INTERPOLATE_RATE_FAR
+    def _coast_pick_rate(
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        nearest_lon: np.ndarray,
+        distance: np.ndarray,
+        rng: np.random.Generator,
+    ) -> np.ndarray:
+        return ((80 < distance) & (distance < 300)) | (
+            rng.random(len(distance)) < INTERPOLATE_RATE_FAR
+        )
 
     def _instant_pick_rate(
-        self, lat: float, lon: float, record: TrainingRecord
-    ) -> bool:
-        # 西に経度2度分遠ければ揺れないでしょう
-        if lon < record.station_lon - 2:
-            return random.random() < INTERPOLATE_RATE_FAR
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        nearest_lon: np.ndarray,
+        distance: np.ndarray,
+        rng: np.random.Generator,
+    ) -> np.ndarray:
+        lucky = rng.random(len(distance)) < INTERPOLATE_RATE_FAR
 
-        distance = calc_distance(lat, lon, record.station_lat, record.station_lon)
-        return (
-            30 < distance and distance < 100 and random.random() < INTERPOLATE_RATE_FAR
+        # 西に経度2度分遠ければ揺れないでしょう
+        return np.where(
+            lon < nearest_lon - 2,
+            lucky,
+            (30 < distance) & (distance < 100) & lucky,
         )
 
     def _calc_max_distance(self, earthuake: EarthquakeRecord) -> float:
         """学習データの最大距離を計算(従来法震度-3以上)"""
-        # 範囲制限計算(100kmごとに計算)
-        for distance in range(500, 2500, 100):
-            intensity = calculate_intensity(
-                distance, earthuake.magnitude, earthuake.depth
-            )
-            if intensity < -3:
-                return distance
+        return calc_max_distance(earthuake.magnitude, earthuake.depth)
+
+
+def _sample(rng: np.random.Generator, population: list, k: int) -> list:
+    """random.sample と同じく重複なしでk個選ぶ"""
+    return [population[i] for i in rng.choice(len(population), k, replace=False)]
+
 
-        return 2500
+def _point_set_of(records: list[TrainingRecord]) -> PointSet:
+    """TrainingRecordの観測点位置のPointSet"""
+    return PointSet(
+        np.array([r.station_lat for r in records]),
+        np.array([r.station_lon for r in records]),
+    )
@@ -0,0 +1,258 @@
+"""
+予測処理の計測(段階ごとの処理時間・バッチサイズ・モデルの初回呼び出し数)
+
+既定では無効で、無効の間は計測しない(フラグの確認だけ)。
+
+    from asid_predict.metrics import REGISTRY
+
+    REGISTRY.enable()
+    ...
+    print(REGISTRY.to_prometheus())
+"""
+
+import bisect
+import json
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+
+__all__ = [
+    "LATENCY_BUCKETS",
+    "BATCH_SIZE_BUCKETS",
+    "Histogram",
+    "MetricsRegistry",
+    "REGISTRY",
+]
+
+# 処理時間[s]の区切り
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# バッチサイズ(行数)の区切り
+BATCH_SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# パーセンタイルの計算に使う直近の値の数
+RECENT_SIZE = 1024
+
+
+class Histogram:
+    """区切りごとの度数と、パーセンタイル計算用の直近の値"""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は区切りより大きい値
+        self.sum = 0.0
+        self.count = 0
+        self._recent = np.zeros(RECENT_SIZE)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._recent[self.count % RECENT_SIZE] = value
+        self.sum += value
+        self.count += 1
+
+    def percentiles(self, qs: tuple[float, ...] = (50, 95, 99)) -> dict[str, float]:
+        """直近の値の p50, p95, p99"""
+        recent = self._recent[: min(self.count, RECENT_SIZE)]
+        if len(recent) == 0:
+            return {f"p{q}": None for q in qs}
+        return {f"p{q}": float(v) for q, v in zip(qs, np.percentile(recent, qs))}
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+            **self.percentiles(),
+        }
+
+
+class _NullTimer:
+    """無効時のタイマー(何もしない)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _label_key(labels: dict[str, str]) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict[str, str] = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class MetricsRegistry:
+    """プロセス内の計測値の置き場"""
+
+    def __init__(self, prefix: str = "asid"):
+        self.prefix = prefix
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._buckets: dict[str, tuple[float, ...]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._help: dict[str, str] = {}
+        self._warm_models = weakref.WeakSet()
+        self._warm_model_ids: set[int] = set()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """計測値を消す"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._warm_models = weakref.WeakSet()
+            self._warm_model_ids.clear()
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        help: str = "",
+        **labels: str,
+    ):
+        """ヒストグラムに値を追加"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            self._help.setdefault(name, help)
+            histograms = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in histograms:
+                histograms[key] = Histogram(self._buckets[name])
+            histograms[key].observe(value)
+
+    def increment(self, name: str, value: float = 1, help: str = "", **labels: str):
+        """カウンタを増やす"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._help.setdefault(name, help)
+            counters = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            counters[key] = counters.get(key, 0) + value
+
+    def timer(self, name: str, help: str = "", **labels: str):
+        """with文の中の処理時間をヒストグラムに追加"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(name, help, labels)
+
+    @contextmanager
+    def _timer(self, name: str, help: str, labels: dict[str, str]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help=help, **labels)
+
+    def record_model_call(self, model):
+        """モデルの呼び出しを初回(cold)と2回目以降(warm)に分けて数える"""
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                cold = model not in self._warm_models
+                self._warm_models.add(model)
+            except TypeError:
+                # 弱参照できないモデルはidで区別する
+                cold = id(model) not in self._warm_model_ids
+                self._warm_model_ids.add(id(model))
+        self.increment(
+            "model_calls_total",
+            help="モデルの呼び出し回数(cold: そのモデルの初回)",
+            state="cold" if cold else "warm",
+        )
+
+    def to_dict(self) -> dict:
+        """計測値の辞書"""
+        with self._lock:
+            return {
+                "histograms": {
+                    name: [
+                        {"labels": dict(key), **histogram.to_dict()}
+                        for key, histogram in histograms.items()
+                    ]
+                    for name, histograms in self._histograms.items()
+                },
+                "counters": {
+                    name: [
+                        {"labels": dict(key), "value": value}
+                        for key, value in counters.items()
+                    ]
+                    for name, counters in self._counters.items()
+                },
+            }
+
+    def to_json(self) -> str:
+        """計測値のJSON"""
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """計測値のPrometheusのテキスト形式"""
+        lines = []
+        with self._lock:
+            for name, histograms in self._histograms.items():
+                full_name = f"{self.prefix}_{name}"
+                if self._help.get(name):
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, histogram in histograms.items():
+                    cumulative = 0
+                    for bound, count in zip(
+                        [*map(str, histogram.buckets), "+Inf"], histogram.counts
+                    ):
+                        cumulative += count
+                        labels = _format_labels(key, {"le": bound})
+                        lines.append(f"{full_name}_bucket{labels} {cumulative}")
+                    labels = _format_labels(key)
+                    lines.append(f"{full_name}_sum{labels} {histogram.sum}")
+                    lines.append(f"{full_name}_count{labels} {histogram.count}")
+
+            for name, counters in self._counters.items():
+                full_name = f"{self.prefix}_{name}"
+                if self._help.get(name):
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in counters.items():
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+# パッケージ全体で使う計測値の置き場
+REGISTRY = MetricsRegistry()
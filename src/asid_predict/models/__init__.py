@@ -3,17 +3,49 @@
 """
 
 from .predict_model import PredictModel
+from .distillation import StudentModel, distill_model
+from .quantization import QuantizedModel
+from .augmented_dataset import AugmentedRecordDataset
+from .plate_router import PlateModelRouter
+from .compiled_inference import (
+    CompiledModel,
+    benchmark_backends,
+    benchmark_compiled_inference,
+)
+from .model_store import MappedModel, ModelStore, SwappableModel
+from .fused_inference import FusedStationModel, benchmark_fused_inference
 from .normalization import (
+    INPUT_ENDS,
+    INPUT_STARTS,
     normalize_input,
+    normalize_input_array,
     normalize_output,
     reverse_normalize_input,
+    reverse_normalize_input_array,
     reverse_normalize_output,
 )
 
 __all__ = [
     "PredictModel",
+    "StudentModel",
+    "distill_model",
+    "QuantizedModel",
+    "AugmentedRecordDataset",
+    "PlateModelRouter",
+    "CompiledModel",
+    "benchmark_compiled_inference",
+    "benchmark_backends",
+    "MappedModel",
+    "ModelStore",
+    "SwappableModel",
+    "FusedStationModel",
+    "benchmark_fused_inference",
+    "INPUT_STARTS",
+    "INPUT_ENDS",
     "normalize_input",
+    "normalize_input_array",
     "normalize_output",
     "reverse_normalize_input",
+    "reverse_normalize_input_array",
     "reverse_normalize_output",
 ]
@@ -0,0 +1,109 @@
+"""
+複製水増しデータを学習中にバッチごとに作るデータセット
+"""
+
+import math
+
+import numpy as np
+import keras
+
+from asid_predict.dataclass import TrainingRecord
+from .normalization import normalize_input_array
+
+__all__ = ["AugmentedRecordDataset"]
+
+# TrainingRecordGenerator._create_duplicate_records と同じ揺らし幅
+JITTER_DEGREES = 0.1
+JITTER_FACTOR = 0.1
+
+
+class AugmentedRecordDataset(keras.utils.PyDataset):
+    """
+    元のデータと複製回数だけを持ち、複製水増しデータはバッチごとに乱数で作る
+
+    1エポックは元のデータ全部と、各データを複製回数分揺らしたものからなる。
+    エポックごとに並び順と揺らし方が変わる。
+    """
+
+    def __init__(
+        self,
+        records: list[TrainingRecord],
+        dup_counts: list[int],
+        batch_size: int = 16,
+        seed: int = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.batch_size = batch_size
+
+        # [magnitude, depth, hypocenter_lat, hypocenter_lon, station_lat, station_lon]
+        self.inputs = np.array(
+            [
+                [
+                    r.magnitude,
+                    r.depth,
+                    r.hypocenter_lat,
+                    r.hypocenter_lon,
+                    r.station_lat,
+                    r.station_lon,
+                ]
+                for r in records
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 6)
+        self.amplification_factors = np.array(
+            [r.amplification_factor for r in records], dtype=np.float64
+        )
+        self.dup_counts = np.asarray(dup_counts, dtype=np.int64)
+
+        # 1エポック分のデータの番号 元のデータの後に複製分を並べる
+        self._sources = np.concatenate(
+            [
+                np.arange(len(records)),
+                np.repeat(np.arange(len(records)), self.dup_counts),
+            ]
+        ).astype(np.int32)
+        self._seed = np.random.SeedSequence(seed).entropy
+        self._epoch = 0
+        self._order = self._shuffled_order()
+
+    @property
+    def num_samples(self) -> int:
+        """1エポックのデータ数(複製を含む)"""
+        return len(self._sources)
+
+    def __len__(self) -> int:
+        return math.ceil(self.num_samples / self.batch_size)
+
+    def __getitem__(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        positions = self._order[index * self.batch_size : (index + 1) * self.batch_size]
+        sources = self._sources[positions]
+        is_duplicate = positions >= len(self.inputs)
+
+        # バッチごとに別の乱数 (並列に読み込んでも結果は同じ)
+        rng = np.random.default_rng([self._seed, self._epoch, index])
+        n = len(sources)
+
+        inputs = self.inputs[sources]
+        inputs[:, 4:6] += np.where(
+            is_duplicate[:, None],
+            rng.uniform(-JITTER_DEGREES, JITTER_DEGREES, (n, 2)),
+            0.0,
+        )
+        amplification_factors = self.amplification_factors[sources] * np.where(
+            is_duplicate, rng.uniform(1 - JITTER_FACTOR, 1 + JITTER_FACTOR, n), 1.0
+        )
+
+        # normalize_input, normalize_output と同じ変換
+        return (
+            normalize_input_array(inputs),
+            np.clip(amplification_factors, 0, 1)[:, None],
+        )
+
+    def on_epoch_end(self):
+        self._epoch += 1
+        self._order = self._shuffled_order()
+
+    def _shuffled_order(self) -> np.ndarray:
+        rng = np.random.default_rng([self._seed, self._epoch])
+        return rng.permutation(self.num_samples).astype(np.int32)
@@ -0,0 +1,267 @@
+"""
+バッチサイズを決まった大きさに揃えて、コンパイル済みの推論を使い回す
+
+kerasのバックエンドは環境変数 KERAS_BACKEND (jax / tensorflow / torch / numpy) で選ぶ。
+コンパイルするのは jax (jax.jit) と tensorflow (XLA) だけで、どちらもCPUで計算する。
+torch と numpy はコンパイルせずにそのまま呼び出す(mode が "eager" になる)。
+各バックエンドの速度は benchmark_backends() で別プロセスを起動して測る。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import keras
+
+from asid_predict.config import INPUT_DIMS, OUTPUT_DIMS
+from .predict_model import PredictModel
+
+__all__ = ["CompiledModel", "benchmark_compiled_inference", "benchmark_backends"]
+
+# 入力の行数をこのどれかに0埋めで揃える(最大より大きい入力は最大の大きさごとに分ける)
+DEFAULT_BUCKETS = tuple(2**i for i in range(3, 14))  # 8 ~ 8192
+
+BACKENDS = ("jax", "tensorflow", "torch", "numpy")
+
+
+def _build_forward(keras_model: keras.Model, backend: str):
+    """
+    バックエンドごとの順伝播 (np.ndarray -> np.ndarray)
+
+    :return: (順伝播, "jit" / "xla" / "eager")
+    """
+    if backend == "jax":
+        import jax
+
+        # 重みと入力をCPUに置くと、jitしたものもCPUで実行される
+        cpu = jax.devices("cpu")[0]
+
+        # 作成時の重みを固定して使う(predict_on_batchなどで元の値が破棄されても困らないように複製)
+        trainable = [
+            jax.device_put(np.asarray(v), cpu) for v in keras_model.trainable_variables
+        ]
+        non_trainable = [
+            jax.device_put(np.asarray(v), cpu) for v in keras_model.non_trainable_variables
+        ]
+
+        @jax.jit
+        def forward(x):
+            y, _ = keras_model.stateless_call(trainable, non_trainable, x, training=False)
+            return y
+
+        return lambda x: np.asarray(forward(jax.device_put(x, cpu))), "jit"
+
+    if backend == "tensorflow":
+        import tensorflow as tf
+
+        compiled = tf.function(
+            lambda x: keras_model(x, training=False), jit_compile=True, reduce_retracing=False
+        )
+
+        def forward(x):
+            with tf.device("/CPU:0"):
+                return compiled(tf.constant(x)).numpy()
+
+        return forward, "xla"
+
+    if backend == "torch":
+        import torch
+
+        # コンパイルはしない(torch.no_grad で勾配の記録だけ止める)
+        def eager_forward(x):
+            with torch.no_grad():
+                return keras.ops.convert_to_numpy(keras_model(x, training=False))
+
+        return eager_forward, "eager"
+
+    return lambda x: keras.ops.convert_to_numpy(keras_model(x, training=False)), "eager"
+
+
+class CompiledModel:
+    """
+    入力の行数を buckets のどれかに0埋めで揃え、大きさごとに1度だけコンパイルした推論を使い回す
+
+    コンパイルされるのは jax と tensorflow だけで、mode にその方法が入る("eager" はコンパイルなし)。
+
+    既定の buckets は2倍ごとなので、0埋めで余分に計算するのは元の行数より少ない。
+
+    model.predict のようなバッチごとのPythonの処理がないので、小さいバッチでも計算の時間が大半になる。
+    作成時の重みを使うので、学習し直した場合は作り直す。
+    predict() を持つので predict_intensities などにそのまま渡せる。
+    """
+
+    def __init__(
+        self,
+        model: PredictModel,
+        buckets: tuple[int, ...] = DEFAULT_BUCKETS,
+        warm_up: bool = True,
+    ):
+        self.backend = keras.backend.backend()
+        self.buckets = tuple(sorted(buckets))
+        self._forward, self.mode = _build_forward(model.model, self.backend)
+
+        # 全ての大きさを事前にコンパイルしておく
+        if warm_up:
+            for bucket in self.buckets:
+                self._forward(np.zeros((bucket, INPUT_DIMS), dtype=np.float32))
+
+    def _chunks(self, n: int) -> list[int]:
+        """n行を分ける塊の大きさ"""
+        largest = self.buckets[-1]
+        chunks = [largest] * (n // largest)
+        remaining = n % largest
+        if remaining:
+            chunks.append(next(b for b in self.buckets if b >= remaining))
+        return chunks
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """予測 (batch_size は無視して buckets の大きさで計算する)"""
+        x = np.asarray(x, dtype=np.float32)
+        y = np.empty((len(x), OUTPUT_DIMS), dtype=np.float32)
+
+        start = 0
+        for bucket in self._chunks(len(x)):
+            chunk = x[start : start + bucket]
+            if len(chunk) < bucket:
+                chunk = np.concatenate(
+                    [chunk, np.zeros((bucket - len(chunk), x.shape[1]), dtype=np.float32)]
+                )
+            n = min(bucket, len(x) - start)
+            y[start : start + n] = self._forward(chunk)[:n]
+            start += n
+
+        return y
+
+
+def _median_seconds(func, repeat: int) -> float:
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def benchmark_compiled_inference(
+    model: PredictModel,
+    sizes: tuple[int, ...] = (1, 64, 1000, 8192),
+    repeat: int = 20,
+    buckets: tuple[int, ...] = DEFAULT_BUCKETS,
+    seed: int = 0,
+) -> dict:
+    """
+    今のバックエンドで model.predict と CompiledModel の1回あたりの時間(中央値)を比べる
+
+    mode が "eager" のバックエンドでは compiled_ms はコンパイルしていない推論の時間になる。
+
+    :return: {"backend", "mode", "compile_seconds", "sizes": {行数: {"predict_ms", "compiled_ms", "max_diff"}}}
+    """
+    rng = np.random.default_rng(seed)
+
+    start = time.perf_counter()
+    compiled = CompiledModel(model, buckets)
+    compile_seconds = time.perf_counter() - start
+
+    report = {}
+    for n in sizes:
+        x = rng.random((n, INPUT_DIMS)).astype(np.float32)
+        predict_seconds = _median_seconds(lambda: model.predict(x, batch_size=n), repeat)
+        compiled_seconds = _median_seconds(lambda: compiled.predict(x), repeat)
+        max_diff = np.max(
+            np.abs(np.asarray(model.predict(x, batch_size=n)) - compiled.predict(x))
+        )
+        report[n] = {
+            "predict_ms": predict_seconds * 1e3,
+            "compiled_ms": compiled_seconds * 1e3,
+            "max_diff": float(max_diff),
+        }
+
+    return {
+        "backend": compiled.backend,
+        "mode": compiled.mode,
+        "compile_seconds": compile_seconds,
+        "sizes": report,
+    }
+
+
+def benchmark_backends(
+    weights_path: str,
+    backends: tuple[str, ...] = BACKENDS,
+    model_type: str = "full",
+    sizes: tuple[int, ...] = (1, 64, 1000, 8192),
+    repeat: int = 20,
+    timeout: float = 600,
+) -> dict[str, dict]:
+    """
+    バックエンドごとに別プロセスで benchmark_compiled_inference を実行
+
+    kerasのバックエンドはプロセスごとに1つなので、KERAS_BACKENDを変えて起動する。
+    使えないバックエンドは {"error": ...} になる。
+    """
+    results: dict[str, dict] = {}
+    for backend in backends:
+        command = [
+            sys.executable,
+            "-m",
+            __name__,
+            "--weights",
+            weights_path,
+            "--model-type",
+            model_type,
+            "--sizes",
+            *map(str, sizes),
+            "--repeat",
+            str(repeat),
+        ]
+        env = {**os.environ, "KERAS_BACKEND": backend}
+        try:
+            process = subprocess.run(
+                command, env=env, capture_output=True, text=True, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            results[backend] = {"error": "timeout"}
+            continue
+
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()
+            results[backend] = {"error": error[-1] if error else "failed"}
+            continue
+
+        results[backend] = json.loads(process.stdout.strip().splitlines()[-1])
+
+    return results
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="今のkerasのバックエンドで推論速度を測る")
+    parser.add_argument("--weights", required=True)
+    parser.add_argument("--model-type", choices=["full", "student"], default="full")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 64, 1000, 8192])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # 標準出力は結果のJSON専用にする
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        if args.model_type == "student":
+            from .distillation import StudentModel
+
+            model = StudentModel()
+        else:
+            model = PredictModel()
+        model.load_weight(args.weights)
+        report = benchmark_compiled_inference(model, tuple(args.sizes), args.repeat)
+    finally:
+        sys.stdout = stdout
+
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    _main()
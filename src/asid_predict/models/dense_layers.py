@@ -0,0 +1,66 @@
+"""
+学習済みモデルのDense層をnumpyで扱うための共通処理
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import keras
+
+__all__ = [
+    "DenseLayer",
+    "extract_dense_layers",
+    "apply_activation",
+    "forward_dense_layers",
+]
+
+
+@dataclass
+class DenseLayer:
+    """Dense層1つ分の重み"""
+
+    kernel: np.ndarray  # (入力数, 出力数)
+    bias: np.ndarray  # (出力数,)
+    activation: str  # "linear" or "sigmoid"
+
+
+def extract_dense_layers(model: keras.Model) -> list[DenseLayer]:
+    """kerasモデルからDense層の重みを取り出す(Dropoutは推論時は何もしないので無視)"""
+    layers: list[DenseLayer] = []
+    for layer in model.layers:
+        if not isinstance(layer, keras.layers.Dense):
+            continue
+
+        kernel, bias = layer.get_weights()
+        activation = layer.get_config()["activation"]
+        if activation not in ("linear", "sigmoid"):
+            raise ValueError(f"未対応の活性化関数です: {activation}")
+
+        layers.append(
+            DenseLayer(
+                kernel=kernel.astype(np.float32),
+                bias=bias.astype(np.float32),
+                activation=activation,
+            )
+        )
+
+    return layers
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    """シグモイド関数(オーバーフローしないように範囲を制限)"""
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -60, 60)))
+
+
+def apply_activation(x: np.ndarray, activation: str) -> np.ndarray:
+    """活性化関数を適用"""
+    return _sigmoid(x) if activation == "sigmoid" else x
+
+
+def forward_dense_layers(layers: list[DenseLayer], x: np.ndarray) -> np.ndarray:
+    """Dense層を順に計算"""
+    h = np.asarray(x, dtype=np.float32)
+    for layer in layers:
+        h = apply_activation(h @ layer.kernel + layer.bias, layer.activation)
+
+    return h
@@ -0,0 +1,120 @@
+"""
+学習済みモデル(教師)の出力から小型モデル(生徒)を学習する蒸留
+"""
+
+import time
+
+import numpy as np
+import keras
+
+from asid_predict.config import (
+    INPUT_DIMS,
+    OUTPUT_DIMS,
+    STUDENT_DENSE_UNITS,
+    STUDENT_HIDDEN_LAYERS,
+)
+from .predict_model import PredictModel
+
+__all__ = ["StudentModel", "distill_model"]
+
+
+def _build_student_model() -> keras.Model:
+    """生徒モデルの構造を作成"""
+    layers = [keras.Input(shape=(INPUT_DIMS,), name="input")]
+    for _ in range(STUDENT_HIDDEN_LAYERS):
+        layers.append(keras.layers.Dense(STUDENT_DENSE_UNITS, activation="sigmoid"))
+    layers.append(keras.layers.Dense(OUTPUT_DIMS, name="output"))
+
+    return keras.Sequential(layers)
+
+
+class StudentModel(PredictModel):
+    """蒸留した小型モデル PredictModelと同じく predict_intensities で使える"""
+
+    FILE_PREFIX = "asid_student"
+
+    def __init__(self):
+        self.model = _build_student_model()
+        self.compile_model()
+
+
+def _intensity_offset(y: np.ndarray) -> np.ndarray:
+    """
+    増幅率の予測値を震度の差分に変換
+
+    震度 = 2.54 + 1.82 * log10(af^4 * 20 * pgv400 * arv400) なので、
+    同じ震源・地点での震度差は増幅率afだけで決まる
+    """
+    return 1.82 * 4 * np.log10(np.maximum(np.abs(y), 1e-12))
+
+
+def _measure_latency(model: PredictModel, x: np.ndarray, repeat: int = 5) -> float:
+    """1回の予測にかかる時間[s]の中央値"""
+    model.predict(x, batch_size=len(x))  # ウォームアップ
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict(x, batch_size=len(x))
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def distill_model(
+    teacher: PredictModel,
+    n_samples: int = 200000,
+    epochs: int = 20,
+    batch_size: int = 1024,
+    x_samples: np.ndarray = None,
+    validation_samples: int = 20000,
+    benchmark_size: int = 2000,
+    seed: int = None,
+) -> tuple[StudentModel, dict]:
+    """
+    教師モデルの出力を正解として生徒モデルを学習
+
+    :param teacher: 学習済みの教師モデル
+    :param n_samples: 正規化済み入力空間から一様に生成するサンプル数
+    :param x_samples: 生成の代わりに使う正規化済み入力(学習データなど)
+    :param validation_samples: 精度評価用のサンプル数
+    :param benchmark_size: 速度計測に使う1地震あたりの地点数
+    :return: 生徒モデルと、震度単位の精度低下・速度向上のレポート
+    """
+    rng = np.random.default_rng(seed)
+
+    # 入力空間全体から一様にサンプリング
+    if x_samples is None:
+        x_samples = rng.random((n_samples, INPUT_DIMS))
+    x_valid = rng.random((validation_samples, INPUT_DIMS))
+
+    # 教師モデルの出力を正解にする
+    y_samples = teacher.predict(x_samples, batch_size=batch_size)
+    y_teacher = teacher.predict(x_valid, batch_size=batch_size)
+
+    student = StudentModel()
+    student.model.fit(x_samples, y_samples, epochs=epochs, batch_size=batch_size)
+    y_student = student.predict(x_valid, batch_size=batch_size)
+
+    # 震度単位の誤差
+    error = _intensity_offset(y_student) - _intensity_offset(y_teacher)
+
+    # 1地震分(震源は同じで地点だけ異なる)の入力で速度を比較
+    x_bench = rng.random((benchmark_size, INPUT_DIMS))
+    x_bench[:, :4] = x_bench[0, :4]
+    teacher_latency = _measure_latency(teacher, x_bench)
+    student_latency = _measure_latency(student, x_bench)
+
+    report = {
+        "intensity_bias": float(np.mean(error)),
+        "intensity_mae": float(np.mean(np.abs(error))),
+        "intensity_rmse": float(np.sqrt(np.mean(error**2))),
+        "intensity_p99": float(np.percentile(np.abs(error), 99)),
+        "intensity_max_error": float(np.max(np.abs(error))),
+        "teacher_params": teacher.model.count_params(),
+        "student_params": student.model.count_params(),
+        "teacher_latency": teacher_latency,
+        "student_latency": student_latency,
+        "speedup": teacher_latency / student_latency,
+    }
+
+    return student, report
@@ -0,0 +1,150 @@
+"""
+1層目のDenseを2層目に畳み込み、固定した地点の寄与を事前計算する推論
+"""
+
+import time
+
+import numpy as np
+
+from .dense_layers import apply_activation, extract_dense_layers, forward_dense_layers
+from .normalization import normalize_input_array
+from .predict_model import PredictModel
+
+__all__ = ["FusedStationModel", "benchmark_fused_inference"]
+
+# 入力のうち震源側[magnitude, depth, hypocenter_lat, hypocenter_lon]の列数
+_SOURCE_DIMS = 4
+
+
+class FusedStationModel:
+    """
+    学習済みモデルから作る推論専用モデル
+
+    1層目のDenseは活性化関数がないので、2層目と合わせて1つのアフィン変換 x @ (W1 W2) + (b1 W2 + b2) にできる。
+    さらにこの変換は震源の4列と地点の2列の和に分けられるので、地点側を固定した地点について事前計算しておけば、
+    地震ごとには震源側の4列分だけ計算すればよい。
+    predict() を持つので predict_intensities にそのまま渡せる。
+    """
+
+    def __init__(
+        self,
+        model: PredictModel,
+        station_lat: np.ndarray = None,
+        station_lon: np.ndarray = None,
+    ):
+        first, second, *rest = extract_dense_layers(model.model)
+        if first.activation != "linear":
+            raise ValueError("1層目に活性化関数があるので畳み込めません")
+
+        kernel1 = first.kernel.astype(np.float64)
+        kernel2 = second.kernel.astype(np.float64)
+        self.kernel = (kernel1 @ kernel2).astype(np.float32)
+        self.bias = (first.bias @ kernel2 + second.bias).astype(np.float32)
+        self.activation = second.activation
+        self.rest = rest
+
+        self._station_x: np.ndarray | None = None
+        self._station_term: np.ndarray | None = None
+        if station_lat is not None and station_lon is not None:
+            self.set_stations(station_lat, station_lon)
+
+    def set_stations(self, station_lat: np.ndarray, station_lon: np.ndarray):
+        """固定する地点を設定し、地点側の寄与を事前計算"""
+        n = len(station_lat)
+        raw = np.zeros((n, 6))
+        raw[:, 4] = station_lat
+        raw[:, 5] = station_lon
+        station_x = normalize_input_array(raw)[:, _SOURCE_DIMS:].astype(np.float32)
+
+        self._station_x = station_x
+        self._station_term = station_x @ self.kernel[_SOURCE_DIMS:]
+
+    def _forward_rest(self, h: np.ndarray) -> np.ndarray:
+        return forward_dense_layers(self.rest, apply_activation(h, self.activation))
+
+    def predict_source(self, source_x: np.ndarray) -> np.ndarray:
+        """
+        正規化済みの震源4列(1地震分)から、固定した全地点の出力を計算
+
+        :param source_x: [magnitude, depth, hypocenter_lat, hypocenter_lon] 正規化済み
+        """
+        if self._station_term is None:
+            raise ValueError("set_stations() で地点を設定してください")
+
+        source_term = (
+            np.asarray(source_x, dtype=np.float32) @ self.kernel[:_SOURCE_DIMS]
+            + self.bias
+        )
+        return self._forward_rest(self._station_term + source_term)
+
+    def _uses_fixed_stations(self, x: np.ndarray) -> bool:
+        """入力が1地震分かつ固定した地点と同じ並びか"""
+        return (
+            self._station_x is not None
+            and len(x) == len(self._station_x)
+            and len(x) > 0
+            and np.all(x[:, :_SOURCE_DIMS] == x[0, :_SOURCE_DIMS])
+            and np.allclose(x[:, _SOURCE_DIMS:], self._station_x, atol=1e-6)
+        )
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """予測(正規化済み入力 固定した地点の入力なら事前計算を使う)"""
+        x = np.asarray(x, dtype=np.float32)
+        if self._uses_fixed_stations(x):
+            return self.predict_source(x[0, :_SOURCE_DIMS])
+
+        return self._forward_rest(x @ self.kernel + self.bias)
+
+
+def _median_time(func, repeat: int) -> float:
+    func()  # ウォームアップ
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def benchmark_fused_inference(
+    model: PredictModel,
+    station_lat: np.ndarray,
+    station_lon: np.ndarray,
+    n_events: int = 20,
+    repeat: int = 5,
+    seed: int = None,
+) -> dict:
+    """元のモデルと畳み込んだモデルの1地震あたりの予測時間と出力の差を比較"""
+    rng = np.random.default_rng(seed)
+    fused = FusedStationModel(model, station_lat, station_lon)
+
+    # 正規化済みのランダムな震源
+    sources = rng.random((n_events, _SOURCE_DIMS)).astype(np.float32)
+    inputs = [
+        np.hstack([np.tile(source, (len(station_lat), 1)), fused._station_x])
+        for source in sources
+    ]
+
+    max_diff = max(
+        float(
+            np.max(
+                np.abs(fused.predict_source(source) - model.predict(x, batch_size=len(x)))
+            )
+        )
+        for source, x in zip(sources, inputs)
+    )
+
+    original_time = _median_time(
+        lambda: [model.predict(x, batch_size=len(x)) for x in inputs], repeat
+    )
+    fused_time = _median_time(
+        lambda: [fused.predict_source(source) for source in sources], repeat
+    )
+
+    return {
+        "max_abs_diff": max_diff,
+        "original_latency": original_time / n_events,
+        "fused_latency": fused_time / n_events,
+        "speedup": original_time / fused_time,
+    }
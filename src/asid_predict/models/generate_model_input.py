@@ -1,3 +1,9 @@
+import os
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
 from typing import Callable
 import numpy as np
 
@@ -5,7 +11,11 @@ from tqdm.auto import tqdm
 
 from asid_predict.dataclass import EarthquakeRecord, TrainingRecord
 
-from .normalization import normalize_input, normalize_output
+from .normalization import normalize_input, normalize_input_array, normalize_output
+
+# 1行 = 正規化済みの入力6列 + 教師1列 (float32)
+_ROW_COLUMNS = 7
+_ROW_BYTES = _ROW_COLUMNS * np.dtype(np.float32).itemsize
 
 
 def generate_training_and_test_data(
@@ -57,3 +67,224 @@ def _normalize_data(data: list[TrainingRecord]) -> tuple[np.ndarray, np.ndarray]
     normalized_output = [normalize_output(d.amplification_factor) for d in data]
 
     return np.array(normalized_input), np.array(normalized_output)
+
+
+def generate_augmented_training_and_test_data(
+    earthquakes: list[EarthquakeRecord],
+    weighted_records_from_earthquake: Callable[
+        [EarthquakeRecord], tuple[list[TrainingRecord], list[int]]
+    ],
+    test_ratio: float = 0.1,
+) -> tuple[
+    tuple[list[TrainingRecord], list[int]],
+    tuple[np.ndarray, np.ndarray],
+    list[list[TrainingRecord]],
+]:
+    """
+    複製水増しデータを作らずに学習用・テスト用データを生成
+
+    学習用は(元のデータ, 複製回数)のまま返す(AugmentedRecordDatasetに渡す)。
+    テスト用は元のデータだけを正規化する。
+    """
+
+    train_records_all: list[TrainingRecord] = []
+    dup_counts_all: list[int] = []
+    train_records_earthquakes: list[list[TrainingRecord]] = []
+
+    for earthquake in tqdm(earthquakes, total=len(earthquakes)):
+        train_records, dup_counts = weighted_records_from_earthquake(earthquake)
+        train_records_earthquakes.append(train_records)
+        train_records_all.extend(train_records)
+        dup_counts_all.extend(dup_counts)
+
+    # ランダム振り分け
+    order = np.random.permutation(len(train_records_all))
+
+    num_test = int(len(train_records_all) * test_ratio)
+    num_train = len(train_records_all) - num_test
+
+    train_data = [train_records_all[i] for i in order[:num_train]]
+    train_dup_counts = [dup_counts_all[i] for i in order[:num_train]]
+    test_data = [train_records_all[i] for i in order[num_train:]]
+
+    test_input, test_output = _normalize_data(test_data)
+
+    return (
+        (train_data, train_dup_counts),
+        (np.array(test_input), np.array(test_output)),
+        train_records_earthquakes,
+    )
+
+
+@dataclass
+class DatasetBuildReport:
+    """generate_training_and_test_data_bounded で作ったデータの行数と段階ごとの計測結果"""
+
+    num_train: int
+    num_test: int
+    in_memory: bool  # Falseなら出力の配列は memmap_dir の .npy のメモリマップ
+    # 段階("generate" / "shuffle")ごとの {"seconds"} (measure_memory=True なら "peak_rss_mb" も)
+    stages: dict[str, dict[str, float]] = field(default_factory=dict)
+
+
+def _peak_rss_mb() -> float:
+    """プロセスの最大メモリ使用量[MB] (Linuxでは _reset_peak_rss() からの最大、取れなければ nan)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    try:
+        # Windowsにはない
+        import resource
+    except ImportError:
+        return float("nan")
+    # ru_maxrss は Linux では KB、macOS では byte
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _reset_peak_rss():
+    """
+    最大メモリ使用量の記録を今の使用量に戻す(Linuxのみ、できなければ何もしない)
+
+    プロセス全体の記録(VmHWM)を戻すので、他で測っている最大メモリ使用量も変わる。
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _records_to_rows(records: list[TrainingRecord]) -> np.ndarray:
+    """TrainingRecordを正規化済みの行 (n, 7) にまとめて変換"""
+    raw = np.array(
+        [
+            [
+                r.magnitude,
+                r.depth,
+                r.hypocenter_lat,
+                r.hypocenter_lon,
+                r.station_lat,
+                r.station_lon,
+                r.amplification_factor,
+            ]
+            for r in records
+        ],
+        dtype=np.float64,
+    ).reshape(-1, _ROW_COLUMNS)
+    rows = np.empty((len(raw), _ROW_COLUMNS), dtype=np.float32)
+    rows[:, :6] = normalize_input_array(raw[:, :6])
+    rows[:, 6] = np.clip(raw[:, 6], 0, 1)  # normalize_output と同じ
+    return rows
+
+
+def _allocate(shape: tuple[int, int], in_memory: bool, directory: str, name: str):
+    """出力の配列 メモリに収まらない場合は directory の .npy をメモリマップする"""
+    if in_memory:
+        return np.empty(shape, dtype=np.float32)
+    path = os.path.join(directory, f"{name}_{uuid.uuid4().hex[:8]}.npy")
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+
+def generate_training_and_test_data_bounded(
+    earthquakes: list[EarthquakeRecord],
+    train_records_from_earthquake: Callable[[EarthquakeRecord], list[TrainingRecord]],
+    test_ratio: float = 0.1,
+    memory_budget_mb: float = 1024,
+    memmap_dir: str = None,
+    keep_earthquake_records: bool = False,
+    measure_memory: bool = False,
+) -> tuple[
+    tuple[np.ndarray, np.ndarray],
+    tuple[np.ndarray, np.ndarray],
+    list[list[TrainingRecord]],
+    DatasetBuildReport,
+]:
+    """
+    メモリ使用量を抑えて学習用・テスト用データを生成 (generate_training_and_test_data と同じ分け方)
+
+    地震ごとに正規化済みのfloat32の行にしてすぐ一時ファイルに書き、TrainingRecordは残さない。
+    行数が決まってから出力の配列を確保し、一時ファイルを少しずつ読んで
+    ランダムな並び順の位置に書き込む(TrainingRecordのリストのシャッフルやコピーをしない)。
+
+    :param memory_budget_mb: 出力の配列がこれより大きければ memmap_dir の .npy にメモリマップする。
+        一時ファイルを読む単位もこれで決める
+    :param memmap_dir: 一時ファイルとメモリマップの置き場所(既定は一時ディレクトリ)
+        メモリマップした .npy は残るので、不要になったら削除する
+    :param keep_earthquake_records: 地震ごとのTrainingRecord(プロット用)も返す
+    :param measure_memory: 段階ごとの最大メモリ使用量も測る。
+        Linuxでは段階の始めにプロセス全体の最大メモリ使用量の記録(VmHWM)を今の使用量に戻すので、
+        他で測っている最大メモリ使用量も変わる
+    :return: (学習用, テスト用, 地震ごとのデータ(keep_earthquake_records=Falseなら空), DatasetBuildReport)
+    """
+    memmap_dir = memmap_dir or tempfile.gettempdir()
+    os.makedirs(memmap_dir, exist_ok=True)
+    stages: dict[str, dict[str, float]] = {}
+    train_records_earthquakes: list[list[TrainingRecord]] = []
+
+    def start_stage() -> float:
+        if measure_memory:
+            _reset_peak_rss()
+        return time.perf_counter()
+
+    def end_stage(name: str, start: float):
+        stages[name] = {"seconds": time.perf_counter() - start}
+        if measure_memory:
+            stages[name]["peak_rss_mb"] = _peak_rss_mb()
+
+    # 1. 地震ごとに正規化して一時ファイルに追記
+    start = start_stage()
+    staging_path = os.path.join(memmap_dir, f"staging_{uuid.uuid4().hex[:8]}.bin")
+    n_rows = 0
+    try:
+        with open(staging_path, "wb") as f:
+            for earthquake in tqdm(earthquakes, total=len(earthquakes)):
+                train_records = train_records_from_earthquake(earthquake)
+                if keep_earthquake_records:
+                    train_records_earthquakes.append(train_records)
+                rows = _records_to_rows(train_records)
+                f.write(rows.tobytes())
+                n_rows += len(rows)
+        end_stage("generate", start)
+
+        # 2. 並び順を決めて出力の配列に直接書き込む
+        start = start_stage()
+        num_test = int(n_rows * test_ratio)
+        num_train = n_rows - num_test
+        position = np.random.permutation(n_rows)  # 各行の並べ替え後の位置
+
+        in_memory = n_rows * _ROW_BYTES <= memory_budget_mb * 1024 * 1024
+        x_train = _allocate((num_train, 6), in_memory, memmap_dir, "x_train")
+        y_train = _allocate((num_train, 1), in_memory, memmap_dir, "y_train")
+        x_test = _allocate((num_test, 6), in_memory, memmap_dir, "x_test")
+        y_test = _allocate((num_test, 1), in_memory, memmap_dir, "y_test")
+
+        # 予算の1/8ずつ読む
+        block_rows = max(int(memory_budget_mb * 1024 * 1024 / 8 / _ROW_BYTES), 1024)
+        with open(staging_path, "rb") as f:
+            for block_start in range(0, n_rows, block_rows):
+                rows = np.fromfile(
+                    f, dtype=np.float32, count=block_rows * _ROW_COLUMNS
+                ).reshape(-1, _ROW_COLUMNS)
+                dest = position[block_start : block_start + len(rows)]
+                is_train = dest < num_train
+                x_train[dest[is_train]] = rows[is_train, :6]
+                y_train[dest[is_train]] = rows[is_train, 6:]
+                x_test[dest[~is_train] - num_train] = rows[~is_train, :6]
+                y_test[dest[~is_train] - num_train] = rows[~is_train, 6:]
+        end_stage("shuffle", start)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    return (
+        (x_train, y_train),
+        (x_test, y_test),
+        train_records_earthquakes,
+        DatasetBuildReport(num_train, num_test, in_memory, stages),
+    )
@@ -0,0 +1,319 @@
+"""
+学習済みモデルをバージョン・プレート・学習データ・評価値つきで保存し、メモリマップで読み込むモデル置き場
+
+    store = ModelStore("out/store")
+    store.save(model, plate="pacific", data_path="data/train_data.json", metrics={"test_loss": 0.01})
+    model = store.load_latest_good("pacific")  # kerasを使わずにすぐ読み込める
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (プロセス間のロックはしない)
+    fcntl = None
+
+import numpy as np
+import keras
+
+from asid_predict.config import VERSION
+from .dense_layers import DenseLayer, extract_dense_layers, forward_dense_layers
+from .predict_model import PredictModel
+
+__all__ = [
+    "ModelEntry",
+    "MappedModel",
+    "ModelStore",
+    "SwappableModel",
+    "hash_training_data",
+]
+
+INDEX_FILE = "index.json"
+INDEX_LOCK_FILE = "index.lock"
+WEIGHTS_FILE = "weights.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def hash_training_data(filepath: str) -> str:
+    """学習データのファイルのハッシュ(sha256)"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class ModelEntry:
+    """モデル置き場の1モデル分の情報"""
+
+    model_id: str
+    version: float
+    plate: str  # "pacific" / "philippine_sea" など
+    kind: str  # PredictModel.FILE_PREFIX ("asid" / "asid_student")
+    data_hash: str | None
+    metrics: dict[str, float] = field(default_factory=dict)
+    created_at: float = 0.0
+    good: bool = True  # mark() で使わないモデルにできる
+
+
+class MappedModel:
+    """
+    メモリマップした重みでnumpyだけで推論するモデル
+
+    重みはファイルのまま参照するので(コピーしない)、読み込みは一瞬で、複数プロセスでメモリを共有できる。
+    predict() を持つので predict_intensities などにそのまま渡せる。
+    """
+
+    def __init__(self, layers: list[DenseLayer], entry: ModelEntry = None):
+        self.layers = layers
+        self.entry = entry
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """予測"""
+        if batch_size is None or len(x) <= batch_size:
+            return forward_dense_layers(self.layers, x)
+
+        return np.concatenate(
+            [
+                forward_dense_layers(self.layers, x[i : i + batch_size])
+                for i in range(0, len(x), batch_size)
+            ]
+        )
+
+
+class SwappableModel:
+    """
+    動いている予測処理のモデルを入れ替えられるようにするラッパー
+
+    predict() は呼び出した時点のモデルだけを使うので、途中で swap() しても1回の予測の中で
+    モデルが混ざることはない。
+    """
+
+    def __init__(self, model):
+        self._model = model
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return self._model
+
+    def swap(self, model):
+        """モデルを入れ替えて、前のモデルを返す"""
+        with self._lock:
+            previous, self._model = self._model, model
+        return previous
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        model = self._model
+        if batch_size is None:
+            return model.predict(x)
+        return model.predict(x, batch_size=batch_size)
+
+
+class ModelStore:
+    """
+    モデルをディレクトリごとに保存し、index.json で一覧を管理する
+
+    重みは全Dense層を1つのfloat32の.npyにつなげて保存し、読み込み時はメモリマップして各層の形に切り出す。
+    index.json や各モデルのディレクトリは一時ファイルに書いてから置き換えるので、書き込み途中の状態は見えない。
+    index.json の読み込みから書き込みまでは index.lock のファイルロック(fcntl.flock)で順番に行うので、
+    同じディレクトリを複数のプロセスや ModelStore で使っても一覧の更新は失われない(Windowsでは同じ ModelStore の中だけ)。
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.root, INDEX_FILE)
+
+    def entries(self) -> list[ModelEntry]:
+        """保存されているモデルの一覧(古い順)"""
+        if not os.path.exists(self._index_path()):
+            return []
+        with open(self._index_path(), "r") as f:
+            return [ModelEntry(**d) for d in json.load(f)]
+
+    def _write_index(self, entries: list[ModelEntry]):
+        tmp_path = f"{self._index_path()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([asdict(e) for e in entries], f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._index_path())
+
+    @contextmanager
+    def _index_lock(self):
+        """index.json の更新をスレッド間・プロセス間で1つずつにする"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, INDEX_LOCK_FILE), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _update_index(self, update: Callable[[list[ModelEntry]], list[ModelEntry]]):
+        """ロックした状態で index.json を読み込み、update の結果で置き換える"""
+        with self._index_lock():
+            self._write_index(update(self.entries()))
+
+    def get(self, model_id: str) -> ModelEntry:
+        for entry in self.entries():
+            if entry.model_id == model_id:
+                return entry
+        raise KeyError(model_id)
+
+    def save(
+        self,
+        model: PredictModel,
+        plate: str,
+        data_path: str = None,
+        metrics: dict[str, float] = None,
+        version: float = VERSION,
+    ) -> ModelEntry:
+        """モデルの重みを保存して一覧に追加"""
+        layers = extract_dense_layers(model.model)
+        created_at = time.time()
+        entry = ModelEntry(
+            model_id=(
+                f"{model.FILE_PREFIX}_{version}_{plate}_"
+                f"{time.strftime('%Y%m%d%H%M%S', time.localtime(created_at))}_"
+                f"{uuid.uuid4().hex[:6]}"
+            ),
+            version=version,
+            plate=plate,
+            kind=model.FILE_PREFIX,
+            data_hash=hash_training_data(data_path) if data_path else None,
+            metrics={k: float(v) for k, v in (metrics or {}).items()},
+            created_at=created_at,
+        )
+
+        # 全層の重みを1つの配列につなげ、各層の位置を manifest に書く
+        manifest = []
+        offset = 0
+        for layer in layers:
+            item = {"activation": layer.activation}
+            for name in ("kernel", "bias"):
+                array = getattr(layer, name)
+                item[name] = {"offset": offset, "shape": list(array.shape)}
+                offset += array.size
+            manifest.append(item)
+        weights = np.concatenate(
+            [np.ravel(getattr(l, name)) for l in layers for name in ("kernel", "bias")]
+        ).astype(np.float32)
+
+        tmp_dir = os.path.join(self.root, f".{entry.model_id}.tmp")
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, WEIGHTS_FILE), weights)
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump({"entry": asdict(entry), "layers": manifest}, f, indent=2)
+        os.replace(tmp_dir, os.path.join(self.root, entry.model_id))
+
+        self._update_index(lambda entries: entries + [entry])
+
+        return entry
+
+    def mark(self, model_id: str, good: bool):
+        """モデルを使う・使わないに設定"""
+
+        def update(entries: list[ModelEntry]) -> list[ModelEntry]:
+            for entry in entries:
+                if entry.model_id == model_id:
+                    entry.good = good
+            return entries
+
+        self._update_index(update)
+
+    def remove(self, model_id: str):
+        """モデルを一覧とディレクトリから削除"""
+        self._update_index(lambda entries: [e for e in entries if e.model_id != model_id])
+        shutil.rmtree(os.path.join(self.root, model_id), ignore_errors=True)
+
+    def latest_good(
+        self,
+        plate: str,
+        version: float = None,
+        metric: str = None,
+        max_value: float = None,
+    ) -> ModelEntry | None:
+        """
+        プレートの使えるモデルのうち最新のもの
+
+        :param metric: max_value と合わせて指定すると、その評価値が max_value 以下のものだけにする
+        """
+        candidates = [
+            e
+            for e in self.entries()
+            if e.plate == plate
+            and e.good
+            and (version is None or e.version == version)
+            and (
+                metric is None
+                or max_value is None
+                or e.metrics.get(metric, np.inf) <= max_value
+            )
+        ]
+        return max(candidates, key=lambda e: e.created_at, default=None)
+
+    def load(self, model_id: str) -> MappedModel:
+        """重みをメモリマップして読み込む(コピーしない)"""
+        directory = os.path.join(self.root, model_id)
+        with open(os.path.join(directory, MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+        weights = np.load(os.path.join(directory, WEIGHTS_FILE), mmap_mode="r")
+
+        def view(item: dict) -> np.ndarray:
+            size = int(np.prod(item["shape"]))
+            return weights[item["offset"] : item["offset"] + size].reshape(item["shape"])
+
+        layers = [
+            DenseLayer(
+                kernel=view(item["kernel"]),
+                bias=view(item["bias"]),
+                activation=item["activation"],
+            )
+            for item in manifest["layers"]
+        ]
+        return MappedModel(layers, ModelEntry(**manifest["entry"]))
+
+    def load_latest_good(self, plate: str, **conditions) -> MappedModel:
+        """プレートの使える最新のモデルを読み込む"""
+        entry = self.latest_good(plate, **conditions)
+        if entry is None:
+            raise LookupError(f"{plate} の使えるモデルがありません")
+        return self.load(entry.model_id)
+
+    def load_keras(self, model_id: str) -> PredictModel:
+        """kerasのモデルとして読み込む(追加の学習用 重みはコピーされる)"""
+        from .distillation import StudentModel
+
+        mapped = self.load(model_id)
+        model = (
+            StudentModel()
+            if mapped.entry.kind == StudentModel.FILE_PREFIX
+            else PredictModel()
+        )
+
+        dense_layers = [
+            layer
+            for layer in model.model.layers
+            if isinstance(layer, keras.layers.Dense)
+        ]
+        for keras_layer, layer in zip(dense_layers, mapped.layers):
+            keras_layer.set_weights([np.array(layer.kernel), np.array(layer.bias)])
+
+        return model
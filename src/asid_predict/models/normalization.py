@@ -2,16 +2,27 @@
 学習データの正規化など
 """
 
+import numpy as np
+
 from asid_predict.dataclass import TrainingRecord
 
 __all__ = [
+    "INPUT_STARTS",
+    "INPUT_ENDS",
     "normalize_input",
+    "normalize_input_array",
     "normalize_output",
     "reverse_normalize_input",
+    "reverse_normalize_input_array",
     "reverse_normalize_output",
 ]
 
 
+# 入力値の範囲 [magnitude, depth, hypocenter_lat, hypocenter_lon, station_lat, station_lon]
+INPUT_STARTS = np.array([2.0, 0, 20.0, 120.0, 20.0, 120.0])
+INPUT_ENDS = np.array([9.0, 800, 50.0, 150.0, 50.0, 150.0])
+
+
 def _normalize_range(value: float, start: float, end: float) -> float:
     """指定した範囲内で正規化"""
     return (value - start) / (end - start)
@@ -34,6 +45,18 @@ def normalize_input(record: TrainingRecord) -> list[float]:
     ]
 
 
+def normalize_input_array(values: np.ndarray) -> np.ndarray:
+    """入力データの正規化(normalize_inputの配列版 values: (n, 6))"""
+    return (np.asarray(values, dtype=np.float64) - INPUT_STARTS) / (
+        INPUT_ENDS - INPUT_STARTS
+    )
+
+
+def reverse_normalize_input_array(values: np.ndarray) -> np.ndarray:
+    """入力データの逆正規化(normalize_input_arrayの逆 values: (n, 6))"""
+    return np.asarray(values, dtype=np.float64) * (INPUT_ENDS - INPUT_STARTS) + INPUT_STARTS
+
+
 def normalize_output(amplification_factor: float) -> list[float]:
     """出力データの正規化"""
     return [max(min(amplification_factor, 1), 0)]  # 0 ~ 1
@@ -0,0 +1,101 @@
+"""
+震源のプレートに合わせて太平洋プレート・フィリピン海プレートのモデルを使い分ける
+"""
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake
+from asid_predict.utils import is_pacific_plate_area
+from .normalization import normalize_input_array, reverse_normalize_input_array
+from .predict_model import PredictModel
+
+__all__ = ["PlateModelRouter"]
+
+PACIFIC = "pacific"
+PHILIPPINE_SEA = "philippine_sea"
+SHALLOW = "shallow"
+
+
+class PlateModelRouter:
+    """
+    太平洋プレートとフィリピン海プレートのモデルを持ち、震源ごとに振り分けて予測する
+
+    学習時(DataFileLoader.get_filtered_earthquakes)と同じく is_pacific_plate_area でプレートを判定する。
+    深さが min_depth 以下の震源はどちらのモデルの学習範囲でもないので、shallow_model があればそれを使い、
+    なければ出力を NaN にする(震度に変換すると -99)。
+    predict() を持つので predict_intensities などにそのまま渡せる。
+    行ごとに振り分け、モデルごとに1回ずつまとめて推論し、入力の順番で返す。
+    predict_intensity_array は正規化前の入力を predict_raw に渡すので、route() と同じく元の震源の値で振り分ける。
+    """
+
+    def __init__(
+        self,
+        pacific_model: PredictModel,
+        philippine_sea_model: PredictModel,
+        min_depth: float = 120,
+        shallow_model: PredictModel = None,
+        warm_up: bool = True,
+    ):
+        self.models = {PACIFIC: pacific_model, PHILIPPINE_SEA: philippine_sea_model}
+        if shallow_model is not None:
+            self.models[SHALLOW] = shallow_model
+        self.min_depth = min_depth
+
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self):
+        """各モデルを1度呼び出して、初回の準備を済ませておく"""
+        x = normalize_input_array(np.array([[6.0, 300.0, 35.0, 140.0, 35.0, 140.0]]))
+        for model in self.models.values():
+            model.predict(x)
+
+    def route(self, eq: Earthquake) -> str:
+        """震源がどのモデルの対象か ("pacific" / "philippine_sea" / "shallow")"""
+        return str(self._route_array(eq.depth, eq.lat, eq.lon))
+
+    def model_for(self, eq: Earthquake) -> PredictModel | None:
+        """震源に使うモデル(対象のモデルがなければNone)"""
+        return self.models.get(self.route(eq))
+
+    def _route_array(
+        self, depth: np.ndarray, lat: np.ndarray, lon: np.ndarray
+    ) -> np.ndarray:
+        return np.where(
+            np.asarray(depth) > self.min_depth,
+            np.where(is_pacific_plate_area(lon, lat), PACIFIC, PHILIPPINE_SEA),
+            SHALLOW,
+        )
+
+    def predict_raw(self, raw: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """正規化前の入力 (n, 6) を元の震源の値で振り分けて予測"""
+        raw = np.asarray(raw, dtype=np.float64)
+        routes = self._route_array(raw[:, 1], raw[:, 2], raw[:, 3])
+        return self._predict_routed(normalize_input_array(raw), routes, batch_size)
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """
+        正規化済みの入力を震源ごとに振り分けて予測
+
+        正規化を戻した深さで振り分けるので、深さがちょうど min_depth の震源は丸め誤差でずれることがある。
+        元の値があるときは predict_raw を使う。
+        """
+        x = np.asarray(x)
+        source = reverse_normalize_input_array(x)
+        routes = self._route_array(source[:, 1], source[:, 2], source[:, 3])
+        return self._predict_routed(x, routes, batch_size)
+
+    def _predict_routed(
+        self, x: np.ndarray, routes: np.ndarray, batch_size: int = None
+    ) -> np.ndarray:
+        y = np.full((len(x), 1), np.nan, dtype=np.float32)
+        for name, model in self.models.items():
+            rows = np.flatnonzero(routes == name)
+            if len(rows) == 0:
+                continue
+            if batch_size is None:
+                y[rows] = model.predict(x[rows])
+            else:
+                y[rows] = model.predict(x[rows], batch_size=batch_size)
+
+        return y
@@ -17,7 +17,12 @@ from asid_predict.config import (
 )
 from asid_predict.data_processing.train_record_generator import TrainingRecordGenerator
 from asid_predict.dataclass import EarthquakeRecord
-from .generate_model_input import generate_training_and_test_data
+from .augmented_dataset import AugmentedRecordDataset
+from .generate_model_input import (
+    generate_augmented_training_and_test_data,
+    generate_training_and_test_data,
+    generate_training_and_test_data_bounded,
+)
 
 __all__ = ["PredictModel"]
 
@@ -44,6 +49,9 @@ def _build_model() -> keras.Model:
 
 
 class PredictModel:
+    # 保存ファイル名の接頭辞
+    FILE_PREFIX = "asid"
+
     def __init__(self):
         self.model = _build_model()
         self.compile_model()
@@ -53,16 +61,62 @@ class PredictModel:
         earthquakes: list[EarthquakeRecord],
         train_data_generator: TrainingRecordGenerator,
         test_ratio: float = 0.1,
+        augment_on_the_fly: bool = False,
+        memory_budget_mb: float = None,
+        memmap_dir: str = None,
+        keep_earthquake_records: bool = False,
+        measure_memory: bool = False,
     ) -> list[list[EarthquakeRecord]]:
-        """学習用データセットを初期化"""
-        (train_input, train_output), test_data, train_records_earthquakes = (
-            generate_training_and_test_data(
-                earthquakes, train_data_generator, test_ratio
+        """
+        学習用データセットを初期化
+
+        augment_on_the_fly=True の場合、train_data_generator には
+        TrainingRecordGenerator.from_earthquake_weighted を渡す。
+        複製水増しデータは作らず、学習時にバッチごとに作る。
+
+        memory_budget_mb を指定すると generate_training_and_test_data_bounded で
+        メモリ使用量を抑えて作成し、行数と段階ごとの時間を self.build_report (DatasetBuildReport) に残す。
+        measure_memory=True なら段階ごとの最大メモリ使用量も測る(プロセス全体の最大メモリ使用量の記録が戻る)。
+        この場合、地震ごとのデータは keep_earthquake_records=True のときだけ返す。
+        """
+        self.build_report = None
+        if augment_on_the_fly:
+            train_records, test_data, train_records_earthquakes = (
+                generate_augmented_training_and_test_data(
+                    earthquakes, train_data_generator, test_ratio
+                )
             )
-        )
+            self.x_train = None
+            self.y_train = None
+            self.train_records = train_records
+        elif memory_budget_mb is not None:
+            (
+                (train_input, train_output),
+                test_data,
+                train_records_earthquakes,
+                self.build_report,
+            ) = generate_training_and_test_data_bounded(
+                earthquakes,
+                train_data_generator,
+                test_ratio,
+                memory_budget_mb,
+                memmap_dir,
+                keep_earthquake_records,
+                measure_memory,
+            )
+            self.x_train = train_input
+            self.y_train = train_output
+            self.train_records = None
+        else:
+            (train_input, train_output), test_data, train_records_earthquakes = (
+                generate_training_and_test_data(
+                    earthquakes, train_data_generator, test_ratio
+                )
+            )
+            self.x_train = train_input
+            self.y_train = train_output
+            self.train_records = None
 
-        self.x_train = train_input
-        self.y_train = train_output
         self.test_data = test_data
 
         return train_records_earthquakes
@@ -77,20 +131,31 @@ class PredictModel:
         y_train: np.ndarray = None,
         epochs: int = 10,
         batch_size: int = 16,
+        callbacks: list[keras.callbacks.Callback] = None,
     ) -> keras.callbacks.History:
         """学習を実行"""
+        if x_train is None and getattr(self, "train_records", None) is not None:
+            # 複製水増しデータをバッチごとに作りながら学習
+            records, dup_counts = self.train_records
+            return self.model.fit(
+                AugmentedRecordDataset(records, dup_counts, batch_size=batch_size),
+                epochs=epochs,
+                callbacks=callbacks,
+            )
+
         return self.model.fit(
-            x_train if x_train else self.x_train,
-            y_train if y_train else self.y_train,
+            x_train if x_train is not None else self.x_train,
+            y_train if y_train is not None else self.y_train,
             epochs=epochs,
             batch_size=batch_size,
+            callbacks=callbacks,
         )
 
-    def evaluate(self, x_test: np.ndarray = None, y_test: np.ndarray = None):
-        """精度の確認"""
+    def evaluate(self, x_test: np.ndarray = None, y_test: np.ndarray = None) -> float:
+        """精度の確認(テストデータの損失を返す)"""
         if x_test is None or y_test is None:
             x_test, y_test = self.test_data
-        self.model.evaluate(x_test, y_test)
+        return self.model.evaluate(x_test, y_test)
 
     def _generate_filename(self, file_extension: str) -> str:
         """ファイル名を生成"""
@@ -105,7 +170,7 @@ class PredictModel:
         loss = history["loss"][-1] if history else 0
 
         # ファイル名を生成
-        return f"asid_{VERSION}_n{n_layers}_e{epochs}_b{batch_size}_l{loss:.5f}.{file_extension}"
+        return f"{self.FILE_PREFIX}_{VERSION}_n{n_layers}_e{epochs}_b{batch_size}_l{loss:.5f}.{file_extension}"
 
     def save(self, save_dir: str):
         """モデルを保存"""
@@ -127,6 +192,6 @@ class PredictModel:
         """保存されたモデルの重みを読み込む"""
         self.model.load_weights(filepath)
 
-    def predict(self, x: np.ndarray) -> np.ndarray:
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
         """予測"""
-        return self.model.predict(x)
+        return self.model.predict(x, batch_size=batch_size)
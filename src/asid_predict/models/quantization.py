@@ -0,0 +1,133 @@
+"""
+Dense層の重みをfloat16 / int8に量子化して推論するモデル
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from .dense_layers import apply_activation, extract_dense_layers
+from .predict_model import PredictModel
+
+__all__ = ["QUANTIZATION_MODES", "QuantizedModel"]
+
+QUANTIZATION_MODES = ("float16", "int8")
+
+
+@dataclass
+class QuantizedDenseLayer:
+    """量子化したDense層1つ分の重み"""
+
+    kernel: np.ndarray  # float16 or int8
+    scale: np.ndarray | None  # int8のときの出力チャネルごとのスケール
+    bias: np.ndarray  # float32のまま
+    activation: str
+
+
+def _quantize_kernel(
+    kernel: np.ndarray, mode: str
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """重み行列を量子化"""
+    if mode == "float16":
+        return kernel.astype(np.float16), None
+
+    # 出力チャネル(列)ごとに最大絶対値が127になるようにスケーリング
+    max_abs = np.max(np.abs(kernel), axis=0)
+    scale = np.where(max_abs > 0, max_abs / 127, 1.0).astype(np.float32)
+    quantized = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+
+    return quantized, scale
+
+
+class QuantizedModel:
+    """
+    量子化した重みで推論するモデル predict_intensities で使える
+
+    量子化するのは重みだけで、計算自体はfloat32で行う
+    """
+
+    def __init__(self, layers: list[QuantizedDenseLayer], mode: str):
+        self.layers = layers
+        self.mode = mode
+
+    @classmethod
+    def from_model(cls, model: PredictModel, mode: str = "int8") -> "QuantizedModel":
+        """学習済みモデルから量子化モデルを作成"""
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"未対応の量子化モードです: {mode}")
+
+        layers: list[QuantizedDenseLayer] = []
+        for layer in extract_dense_layers(model.model):
+            kernel, scale = _quantize_kernel(layer.kernel, mode)
+            layers.append(
+                QuantizedDenseLayer(
+                    kernel=kernel,
+                    scale=scale,
+                    bias=layer.bias,
+                    activation=layer.activation,
+                )
+            )
+
+        return cls(layers, mode)
+
+    def save(self, filepath: str):
+        """量子化した重みを.npzで保存"""
+        arrays = {}
+        for i, layer in enumerate(self.layers):
+            arrays[f"kernel_{i}"] = layer.kernel
+            arrays[f"bias_{i}"] = layer.bias
+            if layer.scale is not None:
+                arrays[f"scale_{i}"] = layer.scale
+
+        np.savez(
+            filepath,
+            mode=np.array(self.mode),
+            activations=np.array([layer.activation for layer in self.layers]),
+            **arrays,
+        )
+
+    @classmethod
+    def load(cls, filepath: str) -> "QuantizedModel":
+        """保存された量子化モデルを読み込む"""
+        with np.load(filepath) as data:
+            activations = [str(a) for a in data["activations"]]
+            layers = [
+                QuantizedDenseLayer(
+                    kernel=data[f"kernel_{i}"],
+                    scale=data[f"scale_{i}"] if f"scale_{i}" in data else None,
+                    bias=data[f"bias_{i}"],
+                    activation=activation,
+                )
+                for i, activation in enumerate(activations)
+            ]
+            mode = str(data["mode"])
+
+        return cls(layers, mode)
+
+    def nbytes(self) -> int:
+        """重みのバイト数"""
+        return sum(
+            layer.kernel.nbytes
+            + layer.bias.nbytes
+            + (layer.scale.nbytes if layer.scale is not None else 0)
+            for layer in self.layers
+        )
+
+    def _forward(self, x: np.ndarray) -> np.ndarray:
+        h = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            h = h @ layer.kernel.astype(np.float32)
+            if layer.scale is not None:
+                h *= layer.scale
+            h = apply_activation(h + layer.bias, layer.activation)
+
+        return h
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """予測"""
+        if batch_size is None or len(x) <= batch_size:
+            return self._forward(x)
+
+        return np.concatenate(
+            [self._forward(x[i : i + batch_size]) for i in range(0, len(x), batch_size)]
+        )
@@ -3,5 +3,39 @@
 """
 
 from .predictor import predict_intensities, predict_intensities_area
+from .calibration import calibrate_quantization
+from .stream import StreamPredictionResult, stream_predictions_area
+from .inference_pool import InferencePool
+from .backtest import BacktestReport, backtest
+from .raster import GridSpec, rasterize_intensity_map, read_raster_window
+from .adaptive_map import AdaptiveIntensityMap, adaptive_intensity_map, compare_with_dense
+from .inversion import SourceInversionResult, invert_source
+from .regional_result import (
+    RegionalIntensityResult,
+    RegionTargets,
+    predict_intensities_area_array,
+)
+from .station_metrics import StationMetricsCallback
 
-__all__ = ["predict_intensities", "predict_intensities_area"]
+__all__ = [
+    "predict_intensities",
+    "predict_intensities_area",
+    "calibrate_quantization",
+    "StreamPredictionResult",
+    "stream_predictions_area",
+    "InferencePool",
+    "BacktestReport",
+    "backtest",
+    "GridSpec",
+    "rasterize_intensity_map",
+    "read_raster_window",
+    "AdaptiveIntensityMap",
+    "adaptive_intensity_map",
+    "compare_with_dense",
+    "SourceInversionResult",
+    "invert_source",
+    "RegionalIntensityResult",
+    "RegionTargets",
+    "predict_intensities_area_array",
+    "StationMetricsCallback",
+]
@@ -0,0 +1,335 @@
+"""
+粗い格子で予測してから必要な所だけ細かくする、適応的な震度分布図の作成
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake
+from asid_predict.models import PredictModel
+from asid_predict.utils import calc_distance_array, calc_max_distance
+from .predictor import predict_intensity_array
+from .raster import Arv400Raster, GridSpec
+
+__all__ = ["AdaptiveIntensityMap", "adaptive_intensity_map", "compare_with_dense"]
+
+# 細かくするかを判断する震度の閾値(震度階級の境界)
+DEFAULT_THRESHOLDS = (0.5, 1.5, 2.5, 3.5, 4.5, 5.0, 5.5, 6.0, 6.5)
+
+# compare_with_dense で誤差の上限と比べるときに許す float32 の丸めの分
+_ROUNDING = 1e-5
+
+
+@dataclass
+class AdaptiveIntensityMap:
+    """
+    粗い格子と、細かくしたブロックからなる多重解像度の震度分布図
+
+    細かくしなかったブロックは四隅の値の双線形補間で、そのブロックの誤差の見積もり(block_bounds)は
+    tolerance 以下、四隅の値は閾値から margin 以上離れている。最大距離より遠いセルは予測せず NaN とする。
+
+    block_bounds は辺の中点と中心の予測値から求めた双線形補間の誤差の上限で、ブロックの中で震度が
+    2次式で表せる範囲では厳密な上限になる(adaptive_intensity_map を参照)。
+    error_bound は細かくしなかったブロックの block_bounds の最大。
+    """
+
+    grid: GridSpec
+    factor: int  # 粗い格子の間隔(細かい格子のセル数)
+    row_nodes: np.ndarray  # 粗い格子の行番号
+    col_nodes: np.ndarray  # 粗い格子の列番号
+    coarse_values: np.ndarray  # 粗い格子での震度(最大距離より遠い点は NaN)
+    refined_blocks: np.ndarray  # 細かくしたブロック (len(row_nodes)-1, len(col_nodes)-1)
+    block_bounds: np.ndarray  # ブロックごとの双線形補間の誤差の上限(求められなければ NaN)
+    values: np.ndarray  # 細かい格子に展開した震度
+    tolerance: float  # 細かくしないブロックの誤差の上限の許容値
+    error_bound: float  # 細かくしなかったブロックの誤差の上限の最大(tolerance 以下)
+    max_distance: float
+    evaluations: int  # モデルで予測したセル数
+    dense_evaluations: int  # 全セルを予測した場合のセル数
+
+    @property
+    def saved_ratio(self) -> float:
+        """全セルを予測する場合と比べて減らせた予測の割合"""
+        return 1 - self.evaluations / self.dense_evaluations
+
+
+def _nodes(n: int, factor: int) -> np.ndarray:
+    """粗い格子の位置(端を必ず含む)"""
+    nodes = np.arange(0, n, factor)
+    if nodes[-1] != n - 1:
+        nodes = np.append(nodes, n - 1)
+    return nodes
+
+
+def _midpoints(nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    各ブロックの中央のセルの位置と、ブロックの中での位置 t
+
+    間にセルがないブロックは t = 0 (中央のセルは端のセルと同じ)
+    """
+    mid = (nodes[:-1] + nodes[1:]) // 2
+    return mid, (mid - nodes[:-1]) / (nodes[1:] - nodes[:-1])
+
+
+def _curvature_scale(t: np.ndarray) -> np.ndarray:
+    """位置 t での線形補間の誤差を、2次式の場合の区間の最大誤差に直す倍率 (t = 0 なら 0)"""
+    with np.errstate(divide="ignore"):
+        return np.where(t > 0, 1 / (4 * t * (1 - t)), 0.0)
+
+
+def _interpolate_axis(values: np.ndarray, nodes: np.ndarray, n: int, axis: int):
+    """粗い格子の値を1つの軸方向に線形補間して細かい格子に広げる"""
+    position = np.arange(n)
+    block = np.clip(np.searchsorted(nodes, position, side="right") - 1, 0, len(nodes) - 2)
+    t = (position - nodes[block]) / (nodes[block + 1] - nodes[block])
+
+    lower = np.take(values, block, axis=axis)
+    upper = np.take(values, block + 1, axis=axis)
+    shape = [1, 1]
+    shape[axis] = n
+    t = t.reshape(shape)
+    return (1 - t) * lower + t * upper
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """True のブロックとその周り8ブロックを True にする"""
+    padded = np.pad(mask, 1)
+    result = np.zeros_like(mask)
+    for dr in range(3):
+        for dc in range(3):
+            result |= padded[dr : dr + mask.shape[0], dc : dc + mask.shape[1]]
+    return result
+
+
+def _block_of(n: int, nodes: np.ndarray) -> np.ndarray:
+    """各行(列)が属するブロックの番号"""
+    return np.clip(np.searchsorted(nodes, np.arange(n), side="right") - 1, 0, len(nodes) - 2)
+
+
+def _near_mask(
+    eq: Earthquake, lats: np.ndarray, lons: np.ndarray, max_distance: float
+) -> np.ndarray:
+    """震央から max_distance 以内のセル (全セルの緯度経度の配列は作らず1行ずつ計算)"""
+    near = np.empty((len(lats), len(lons)), dtype=bool)
+    for i, lat in enumerate(lats):
+        near[i] = calc_distance_array(eq.lat, eq.lon, lat, lons) <= max_distance
+    return near
+
+
+def adaptive_intensity_map(
+    model: PredictModel,
+    eq: Earthquake,
+    grid: GridSpec = None,
+    arv400: Arv400Raster | float = 1.0,
+    factor: int = 8,
+    thresholds: tuple[float, ...] = DEFAULT_THRESHOLDS,
+    margin: float = 0.25,
+    gradient_limit: float = 0.25,
+    tolerance: float = 0.1,
+    batch_size: int = 16384,
+) -> AdaptiveIntensityMap:
+    """
+    粗い格子で予測し、閾値の近くや変化の大きいブロック、誤差の上限が tolerance を超えるブロックだけを
+    細かい格子で予測する
+
+    誤差の上限: ブロックの中で震度 f が2次式なら、双線形補間の誤差は
+    (辺の長さ)^2 / 8 * (|f_xx| + |f_yy|) 以下で、これは辺の中点での線形補間からのずれを
+    1 / (4t(1-t)) 倍したもの(中点なら t = 1/2 で1倍)に等しい。
+    そこで粗い格子に加えて各ブロックの辺の中点と中心も予測し、
+    上下の辺のずれの最大 + 左右の辺のずれの最大 + 中心での残差(辺のずれから見積もった値との差)を
+    ブロックの誤差の上限とする。中心の残差は2次式で表せない変化の分で、2次式なら0になる。
+    震央の近くのように2次式から大きく外れる所は中心の残差が大きくなって細かくされ、
+    震央のブロックとその周りは必ず細かくする。
+    予測点は粗い格子のおよそ4倍になる。
+
+    :param factor: 粗い格子の間隔(細かい格子のセル数)
+    :param thresholds: 細かくする震度の閾値
+    :param margin: 四隅の値がこの範囲で閾値に近ければ細かくする
+    :param gradient_limit: 四隅の値の差がこれより大きければ細かくする
+    :param tolerance: 誤差の上限がこれより大きいブロックは細かくする
+    """
+    grid = grid or GridSpec()
+    n_lat, n_lon = grid.shape
+    lats, lons = grid.lats(), grid.lons()
+
+    def site_values(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        if isinstance(arv400, Arv400Raster):
+            return arv400.sample(lat, lon)
+        return np.full(np.shape(lat), arv400, dtype=np.float64)
+
+    def predict(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        return predict_intensity_array(
+            model,
+            eq.magnitude,
+            eq.depth,
+            eq.lat,
+            eq.lon,
+            lat,
+            lon,
+            site_values(lat, lon),
+            batch_size=batch_size,
+        )
+
+    evaluations = 0
+
+    def predict_cells(rows: np.ndarray, cols: np.ndarray, use: np.ndarray) -> np.ndarray:
+        """rows x cols の格子のうち use のセルを予測 (それ以外は NaN)"""
+        nonlocal evaluations
+        rows, cols = np.broadcast_arrays(rows[:, None], cols[None, :])
+        use = use & near[rows, cols]
+        result = np.full(rows.shape, np.nan)
+        if np.any(use):
+            result[use] = predict(lats[rows[use]], lons[cols[use]])
+            evaluations += int(np.count_nonzero(use))
+        return result
+
+    # 学習データと同じ最大距離より遠いセルは予測しない
+    max_distance = calc_max_distance(eq.magnitude, eq.depth)
+    near = _near_mask(eq, lats, lons, max_distance)
+
+    # 粗い格子で予測
+    row_nodes, col_nodes = _nodes(n_lat, factor), _nodes(n_lon, factor)
+    coarse = predict_cells(row_nodes, col_nodes, np.array(True))
+
+    # 辺の中点と中心を予測し、線形補間からのずれを求める
+    row_mid, row_t = _midpoints(row_nodes)
+    col_mid, col_t = _midpoints(col_nodes)
+    top_left, top_right = coarse[:-1, :-1], coarse[:-1, 1:]
+    bottom_left, bottom_right = coarse[1:, :-1], coarse[1:, 1:]
+    tu, tv = col_t[None, :], row_t[:, None]
+
+    # 横の辺 (粗い格子の行 x 列のブロック)
+    edge_x = predict_cells(
+        row_nodes, col_mid, np.broadcast_to(tu > 0, (len(row_nodes), len(col_mid)))
+    )
+    dev_x = np.where(tu > 0, edge_x - ((1 - tu) * coarse[:, :-1] + tu * coarse[:, 1:]), 0.0)
+    # 縦の辺 (行のブロック x 粗い格子の列)
+    edge_y = predict_cells(
+        row_mid, col_nodes, np.broadcast_to(tv > 0, (len(row_mid), len(col_nodes)))
+    )
+    dev_y = np.where(tv > 0, edge_y - ((1 - tv) * coarse[:-1] + tv * coarse[1:]), 0.0)
+    # 中心
+    has_center = (tu > 0) & (tv > 0)
+    center = predict_cells(row_mid, col_mid, has_center)
+    bilinear = (1 - tv) * ((1 - tu) * top_left + tu * top_right) + tv * (
+        (1 - tu) * bottom_left + tu * bottom_right
+    )
+    expected = (1 - tv) * dev_x[:-1] + tv * dev_x[1:]
+    expected += (1 - tu) * dev_y[:, :-1] + tu * dev_y[:, 1:]
+    residual = np.where(has_center, center - bilinear - expected, 0.0)
+
+    block_bounds = (
+        _curvature_scale(tu) * np.maximum(np.abs(dev_x[:-1]), np.abs(dev_x[1:]))
+        + _curvature_scale(tv) * np.maximum(np.abs(dev_y[:, :-1]), np.abs(dev_y[:, 1:]))
+        + np.abs(residual)
+    )
+    # 四隅や中点が最大距離の外にあるブロックは補間できないので NaN (細かくする)
+    block_bounds[np.isnan(bilinear)] = np.nan
+
+    # 細かくするブロックを決める
+    corners = np.stack([top_left, top_right, bottom_left, bottom_right])
+    with np.errstate(invalid="ignore"):
+        low, high = corners.min(axis=0), corners.max(axis=0)
+        spread = high - low
+        refine = ~(block_bounds <= tolerance) | (spread > gradient_limit)
+        for threshold in thresholds:
+            refine |= (low - margin <= threshold) & (threshold <= high + margin)
+
+    # 震央を含むブロックと、変化が最も大きいブロックは周りのブロックも含めて細かくする
+    must_refine = np.zeros_like(refine)
+    if grid.lat_min <= eq.lat <= grid.lat_max and grid.lon_min <= eq.lon <= grid.lon_max:
+        must_refine[
+            _block_of(n_lat, row_nodes)[np.argmin(np.abs(lats - eq.lat))],
+            _block_of(n_lon, col_nodes)[np.argmin(np.abs(lons - eq.lon))],
+        ] = True
+    if np.any(np.isfinite(spread)) and np.nanmax(spread) > gradient_limit:
+        must_refine[np.unravel_index(np.nanargmax(spread), spread.shape)] = True
+    refine |= _dilate(must_refine)
+
+    # 補間した値を基本にして、予測済みの点を入れ、細かくするブロックのセルだけ予測し直す
+    values = _interpolate_axis(
+        _interpolate_axis(coarse, row_nodes, n_lat, 0), col_nodes, n_lon, 1
+    )
+    known = np.zeros((n_lat, n_lon), dtype=bool)
+    for rows, cols, sampled in (
+        (row_nodes, col_nodes, coarse),
+        (row_nodes, col_mid, edge_x),
+        (row_mid, col_nodes, edge_y),
+        (row_mid, col_mid, center),
+    ):
+        index = np.ix_(rows, cols)
+        values[index] = np.where(np.isfinite(sampled), sampled, values[index])
+        known[index] |= np.isfinite(sampled)
+
+    row_block, col_block = _block_of(n_lat, row_nodes), _block_of(n_lon, col_nodes)
+    targets = refine[row_block[:, None], col_block[None, :]] & near & ~known
+    target_rows, target_cols = np.nonzero(targets)
+    if len(target_rows):
+        values[target_rows, target_cols] = predict(lats[target_rows], lons[target_cols])
+        evaluations += len(target_rows)
+
+    values[~near] = np.nan
+
+    # 最大距離内のセルを含み、細かくしなかったブロックの上限の最大
+    block_near = np.logical_or.reduceat(
+        np.logical_or.reduceat(near, row_nodes[:-1], axis=0), col_nodes[:-1], axis=1
+    )
+    interpolated = ~refine & block_near
+    error_bound = float(np.max(block_bounds[interpolated])) if np.any(interpolated) else 0.0
+
+    return AdaptiveIntensityMap(
+        grid=grid,
+        factor=factor,
+        row_nodes=row_nodes,
+        col_nodes=col_nodes,
+        coarse_values=coarse,
+        refined_blocks=refine,
+        block_bounds=block_bounds,
+        values=values.astype(np.float32),
+        tolerance=tolerance,
+        error_bound=error_bound,
+        max_distance=max_distance,
+        evaluations=evaluations,
+        dense_evaluations=n_lat * n_lon,
+    )
+
+
+def compare_with_dense(
+    model: PredictModel,
+    eq: Earthquake,
+    adaptive: AdaptiveIntensityMap,
+    arv400: Arv400Raster | float = 1.0,
+    batch_size: int = 16384,
+) -> dict:
+    """全セルを予測した場合と比べた実際の誤差(最大距離内のセル)と、事前に求めた誤差の上限"""
+    rows, cols = np.nonzero(np.isfinite(adaptive.values))
+    lat, lon = adaptive.grid.lats()[rows], adaptive.grid.lons()[cols]
+    site = (
+        arv400.sample(lat, lon)
+        if isinstance(arv400, Arv400Raster)
+        else np.full(len(rows), arv400, dtype=np.float64)
+    )
+    dense = predict_intensity_array(
+        model,
+        eq.magnitude,
+        eq.depth,
+        eq.lat,
+        eq.lon,
+        lat,
+        lon,
+        site,
+        batch_size=batch_size,
+    )
+    # 比べる値は同じ float32 にする
+    errors = np.abs(adaptive.values[rows, cols] - dense.astype(np.float32))
+    max_error = float(np.max(errors)) if len(errors) else 0.0
+
+    return {
+        "max_error": max_error,
+        "mean_error": float(np.mean(errors)) if len(errors) else 0.0,
+        "error_bound": adaptive.error_bound,
+        "tolerance": adaptive.tolerance,
+        "within_bound": max_error <= adaptive.error_bound + _ROUNDING,
+        "saved_ratio": adaptive.saved_ratio,
+    }
@@ -0,0 +1,160 @@
+"""
+観測された地震データ全体に対して予測し、実際の震度との残差を確認するバックテスト
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from asid_predict.dataclass import EarthquakeRecord
+from asid_predict.models import PredictModel
+from asid_predict.utils import AttenuationTable
+from .predictor import predict_intensity_array
+
+__all__ = [
+    "EventResidual",
+    "BacktestReport",
+    "residual_statistics",
+    "station_columns",
+    "backtest",
+]
+
+
+@dataclass
+class EventResidual:
+    """地震ごとの残差(予測震度 - 観測震度)の統計"""
+
+    name: str
+    magnitude: float
+    depth: float
+    n_stations: int
+    bias: float
+    rmse: float
+    mae: float
+    hit_rate: float  # 残差が±tolerance以内の割合
+
+
+@dataclass
+class BacktestReport:
+    """バックテストの結果"""
+
+    events: list[EventResidual]
+    n_stations: int
+    bias: float
+    rmse: float
+    mae: float
+    hit_rate: float
+    residuals: np.ndarray  # 全観測点の残差
+    event_index: np.ndarray  # 各残差がどの地震のものか
+    elapsed: float  # 処理時間[s]
+
+
+def residual_statistics(residuals: np.ndarray, tolerance: float = 0.5) -> dict:
+    """残差の統計 (bias, rmse, mae, hit_rate)"""
+    residuals = np.asarray(residuals, dtype=np.float64)
+    if len(residuals) == 0:
+        return {"bias": np.nan, "rmse": np.nan, "mae": np.nan, "hit_rate": np.nan}
+
+    return {
+        "bias": float(np.mean(residuals)),
+        "rmse": float(np.sqrt(np.mean(residuals**2))),
+        "mae": float(np.mean(np.abs(residuals))),
+        "hit_rate": float(np.mean(np.abs(residuals) <= tolerance)),
+    }
+
+
+def station_columns(
+    earthquakes: list[EarthquakeRecord],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    全地震の全観測点の [magnitude, depth, lat, lon, 観測点lat, 観測点lon, arv400, 観測震度]
+
+    :return: (列の配列 (観測点数, 8), 各行がどの地震のものか)
+    """
+    counts = np.array([len(eq.stations) for eq in earthquakes], dtype=np.int64)
+    event_index = np.repeat(np.arange(len(earthquakes)), counts)
+
+    # 震源の値は地震ごとの配列から、観測点の値は全観測点を1度に並べて作る
+    hypocenters = np.array(
+        [[eq.magnitude, eq.depth, eq.lat, eq.lon] for eq in earthquakes],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    stations = np.array(
+        [
+            (s.lat, s.lon, s.arv400, s.intensity)
+            for eq in earthquakes
+            for s in eq.stations
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+
+    columns = np.empty((len(event_index), 8))
+    columns[:, :4] = hypocenters[event_index]
+    columns[:, 4:] = stations
+    return columns, event_index
+
+
+def backtest(
+    model: PredictModel,
+    earthquakes: list[EarthquakeRecord],
+    batch_size: int = 65536,
+    tolerance: float = 0.5,
+    attenuation_table: AttenuationTable = None,
+) -> BacktestReport:
+    """
+    全地震の全観測点をまとめて予測し、観測震度との残差を地震ごと・全体で集計
+
+    入力は全観測点を1度に配列にし、推論は batch_size ごとに行う。
+    複数コアで推論したい場合は model に InferencePool を渡す。
+    """
+    start = time.perf_counter()
+
+    # 全地震の入力をまとめて作成
+    columns, event_index = station_columns(earthquakes)
+    counts = np.bincount(event_index, minlength=len(earthquakes))
+
+    # 全観測点を大きなバッチで予測
+    predicted = np.empty(len(columns))
+    for i in range(0, len(columns), batch_size):
+        chunk = columns[i : i + batch_size]
+        predicted[i : i + batch_size] = predict_intensity_array(
+            model,
+            *chunk[:, :7].T,
+            attenuation_table=attenuation_table,
+            batch_size=batch_size,
+        )
+
+    residuals = predicted - columns[:, 7]
+
+    # 地震ごとの統計をまとめて計算
+    n = np.maximum(counts, 1)
+    bias = np.bincount(event_index, residuals, len(earthquakes)) / n
+    mse = np.bincount(event_index, residuals**2, len(earthquakes)) / n
+    mae = np.bincount(event_index, np.abs(residuals), len(earthquakes)) / n
+    hits = (
+        np.bincount(event_index, np.abs(residuals) <= tolerance, len(earthquakes)) / n
+    )
+
+    events = [
+        EventResidual(
+            name=eq.name,
+            magnitude=eq.magnitude,
+            depth=eq.depth,
+            n_stations=int(counts[i]),
+            bias=float(bias[i]) if counts[i] else np.nan,
+            rmse=float(np.sqrt(mse[i])) if counts[i] else np.nan,
+            mae=float(mae[i]) if counts[i] else np.nan,
+            hit_rate=float(hits[i]) if counts[i] else np.nan,
+        )
+        for i, eq in enumerate(earthquakes)
+    ]
+
+    return BacktestReport(
+        events=events,
+        n_stations=len(residuals),
+        residuals=residuals,
+        event_index=event_index,
+        elapsed=time.perf_counter() - start,
+        **residual_statistics(residuals, tolerance),
+    )
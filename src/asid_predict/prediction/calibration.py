@@ -0,0 +1,42 @@
+"""
+量子化モデルの震度誤差を確認するキャリブレーション
+"""
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake, ObservationPoint
+from asid_predict.models import PredictModel
+from asid_predict.models.quantization import QUANTIZATION_MODES, QuantizedModel
+from .predictor import predict_intensities
+
+
+def calibrate_quantization(
+    model: PredictModel,
+    targets: list[ObservationPoint],
+    earthquakes: list[Earthquake],
+    modes: tuple[str, ...] = QUANTIZATION_MODES,
+) -> dict[str, dict]:
+    """
+    量子化モードごとに、元のモデルとの地点ごとの震度差を計算
+
+    :return: モードごとの {"errors": 地震x地点の震度差, "mae", "rmse", "max_error", "nbytes"}
+    """
+    reference = np.array([predict_intensities(model, targets, eq) for eq in earthquakes])
+
+    report: dict[str, dict] = {}
+    for mode in modes:
+        quantized = QuantizedModel.from_model(model, mode)
+        intensities = np.array(
+            [predict_intensities(quantized, targets, eq) for eq in earthquakes]
+        )
+        errors = intensities - reference
+
+        report[mode] = {
+            "errors": errors,
+            "mae": float(np.mean(np.abs(errors))),
+            "rmse": float(np.sqrt(np.mean(errors**2))),
+            "max_error": float(np.max(np.abs(errors))),
+            "nbytes": quantized.nbytes(),
+        }
+
+    return report
@@ -0,0 +1,340 @@
+"""
+共有メモリに置いた重みを複数プロセスで使う推論ワーカープール
+"""
+
+import itertools
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection, wait
+
+import numpy as np
+
+from asid_predict.models import PredictModel
+from asid_predict.models.dense_layers import (
+    DenseLayer,
+    extract_dense_layers,
+    forward_dense_layers,
+)
+
+__all__ = ["InferencePool"]
+
+# ワーカー内のBLASスレッド数を決める環境変数
+_THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+)
+
+_PING = "ping"
+
+
+def _create_shared_weights(
+    layers: list[DenseLayer],
+) -> tuple[shared_memory.SharedMemory, dict]:
+    """重みを1つの共有メモリにまとめてコピーし、ワーカーが参照するための情報を返す"""
+    arrays = [a for layer in layers for a in (layer.kernel, layer.bias)]
+    total = sum(a.nbytes for a in arrays)
+    shm = shared_memory.SharedMemory(create=True, size=total)
+
+    offset = 0
+    entries = []
+    for a in arrays:
+        view = np.ndarray(a.shape, dtype=np.float32, buffer=shm.buf, offset=offset)
+        view[...] = a
+        entries.append((offset, a.shape))
+        offset += a.nbytes
+
+    spec = {
+        "name": shm.name,
+        "entries": entries,
+        "activations": [layer.activation for layer in layers],
+    }
+    return shm, spec
+
+
+def _attach_shared_weights(
+    spec: dict,
+) -> tuple[shared_memory.SharedMemory, list[DenseLayer]]:
+    """共有メモリの重みをコピーせずに参照する"""
+    try:
+        shm = shared_memory.SharedMemory(name=spec["name"], track=False)
+    except TypeError:
+        # Python 3.12以前(resource_trackerは親プロセスと共有なので解放は親が行う)
+        shm = shared_memory.SharedMemory(name=spec["name"])
+
+    views = [
+        np.ndarray(shape, dtype=np.float32, buffer=shm.buf, offset=offset)
+        for offset, shape in spec["entries"]
+    ]
+    layers = [
+        DenseLayer(kernel=views[2 * i], bias=views[2 * i + 1], activation=activation)
+        for i, activation in enumerate(spec["activations"])
+    ]
+    return shm, layers
+
+
+def _worker_main(
+    spec: dict,
+    requests: mp.Queue,
+    results: Connection,
+    cpus: list[int] | None,
+):
+    """ワーカープロセスの処理"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    shm, layers = _attach_shared_weights(spec)
+    try:
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+
+            request_id, x = message
+            if isinstance(x, str) and x == _PING:
+                results.send((request_id, os.getpid(), None))
+                continue
+
+            try:
+                results.send((request_id, forward_dense_layers(layers, x), None))
+            except Exception as e:
+                results.send((request_id, None, repr(e)))
+    finally:
+        del layers
+        shm.close()
+        results.close()
+
+
+class _Worker:
+    def __init__(self, process: mp.Process, requests: mp.Queue):
+        self.process = process
+        self.requests = requests
+        self.pending: set[int] = set()
+
+
+class InferencePool:
+    """
+    重みを共有メモリに1度だけ読み込み、複数のワーカープロセスで推論する
+
+    ワーカーが落ちた場合は共有メモリから再接続して再起動し、処理中だったリクエストを再送する。
+    結果はワーカーごとのパイプで受け取るので、書き込み中に落ちたワーカーが他のワーカーの結果を止めることはない。
+    predict() を持つので predict_intensities などにそのまま渡せる。
+    """
+
+    def __init__(
+        self,
+        model: PredictModel,
+        n_workers: int = None,
+        threads_per_worker: int = 1,
+        pin_cpus: bool = False,
+        max_retries: int = 2,
+        ready_timeout: float = 120.0,
+    ):
+        self.n_workers = n_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.threads_per_worker = threads_per_worker
+        self.pin_cpus = pin_cpus
+        self.max_retries = max_retries
+
+        self._shm, self._spec = _create_shared_weights(
+            extract_dense_layers(model.model)
+        )
+        self._context = mp.get_context("spawn")
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._round_robin = itertools.count()
+        self._requests: dict[int, tuple[int, object, Future, int]] = {}
+        self._workers: list[_Worker] = []
+        # 受信待ちのパイプ(再起動前のワーカーのものも、閉じられるまで残す)
+        self._readers: set[Connection] = set()
+        self._closed = False
+        self.restarts = 0
+
+        for i in range(self.n_workers):
+            self._workers.append(self._start_worker(i))
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+        # 全ワーカーの起動を待つ
+        for future in [self._submit_to(i, _PING) for i in range(self.n_workers)]:
+            future.result(timeout=ready_timeout)
+
+    def _worker_cpus(self, index: int) -> list[int] | None:
+        """ワーカーに割り当てるCPU"""
+        if not self.pin_cpus:
+            return None
+        n_cpus = os.cpu_count() or 1
+        start = index * self.threads_per_worker
+        return [(start + i) % n_cpus for i in range(self.threads_per_worker)]
+
+    def _start_worker(self, index: int) -> _Worker:
+        """ワーカープロセスを起動(スレッド数は環境変数で固定)"""
+        requests = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self._spec, requests, writer, self._worker_cpus(index)),
+            daemon=True,
+        )
+
+        saved = {name: os.environ.get(name) for name in _THREAD_ENV_VARS}
+        try:
+            for name in _THREAD_ENV_VARS:
+                os.environ[name] = str(self.threads_per_worker)
+            process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        # 親の書き込み側を閉じておくと、ワーカーが落ちたときに受信側が EOFError になる
+        writer.close()
+        self._readers.add(reader)
+        return _Worker(process, requests)
+
+    def _restart_worker(self, index: int):
+        """落ちたワーカーを再起動して処理中のリクエストを再送(ロック内で呼ぶ)"""
+        old = self._workers[index]
+        if old.process.is_alive():
+            old.process.terminate()
+        old.process.join(timeout=1)
+
+        worker = self._start_worker(index)
+        self._workers[index] = worker
+        self.restarts += 1
+
+        for request_id in sorted(old.pending):
+            _, payload, future, retries = self._requests[request_id]
+            if retries >= self.max_retries:
+                del self._requests[request_id]
+                future.set_exception(RuntimeError("推論ワーカーが繰り返し停止しました"))
+                continue
+            self._requests[request_id] = (index, payload, future, retries + 1)
+            worker.pending.add(request_id)
+            worker.requests.put((request_id, payload))
+
+    def _check_workers(self) -> list[bool]:
+        """停止したワーカーを再起動 (ワーカーごとに、確認したときに動いていたかを返す)"""
+        healthy: list[bool] = []
+        with self._lock:
+            if self._closed:
+                return healthy
+            for i, worker in enumerate(self._workers):
+                alive = worker.process.is_alive() and worker.process.exitcode is None
+                healthy.append(alive)
+                if not alive:
+                    self._restart_worker(i)
+
+        return healthy
+
+    def _collect(self):
+        """結果を受け取ってFutureに渡すスレッド"""
+        while not self._closed:
+            with self._lock:
+                readers = list(self._readers)
+            try:
+                ready = wait(readers, timeout=0.5)
+            except (OSError, ValueError):
+                # close() でパイプが閉じられた
+                continue
+            if not ready:
+                self._check_workers()
+                continue
+
+            for reader in ready:
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    # ワーカーが落ちた(または再起動で停止した)
+                    with self._lock:
+                        self._readers.discard(reader)
+                    reader.close()
+                    self._check_workers()
+                    continue
+                self._deliver(*message)
+
+    def _deliver(self, request_id: int, result, error: str | None):
+        """受け取った結果をFutureに渡す"""
+        with self._lock:
+            entry = self._requests.pop(request_id, None)
+            if entry is None:
+                # 再送したリクエストの2つ目の結果
+                return
+            index, _, future, _ = entry
+            self._workers[index].pending.discard(request_id)
+
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(result)
+
+    def _submit_to(self, index: int, payload) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("InferencePoolは終了しています")
+            request_id = next(self._ids)
+            self._requests[request_id] = (index, payload, future, 0)
+            worker = self._workers[index]
+            worker.pending.add(request_id)
+            worker.requests.put((request_id, payload))
+
+        return future
+
+    def submit(self, x: np.ndarray) -> Future:
+        """正規化済み入力の推論をワーカーに依頼"""
+        index = next(self._round_robin) % self.n_workers
+        return self._submit_to(index, np.asarray(x, dtype=np.float32))
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """予測 入力を分割して全ワーカーに振り分ける"""
+        if batch_size is None:
+            batch_size = max(1, -(-len(x) // self.n_workers))
+
+        futures = [self.submit(x[i : i + batch_size]) for i in range(0, len(x), batch_size)]
+        if not futures:
+            return np.zeros((0, self._spec["entries"][-1][1][0]), dtype=np.float32)
+
+        return np.concatenate([f.result() for f in futures])
+
+    def health_check(self) -> list[bool]:
+        """
+        各ワーカーのプロセスが動いているかを確認し、停止したワーカーは再起動する
+
+        応答の速さでは判断しないので、時間のかかるバッチを処理中のワーカーは再起動しない。
+        :return: ワーカーごとに、確認したときに動いていたか
+        """
+        if self._closed:
+            raise RuntimeError("InferencePoolは終了しています")
+        return self._check_workers()
+
+    def close(self):
+        """ワーカーを停止して共有メモリを解放"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for worker in self._workers:
+                worker.requests.put(None)
+
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        self._collector.join(timeout=1)
+        for reader in self._readers:
+            reader.close()
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self) -> "InferencePool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,196 @@
+"""
+観測された震度から震源(マグニチュード・深さ・震央)を推定する
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake, ObservationPoint
+from asid_predict.models import PredictModel
+from asid_predict.utils import AttenuationTable
+from .predictor import predict_intensity_array
+
+__all__ = ["SourceInversionResult", "invert_source"]
+
+# 探索するパラメータの順番
+PARAMETERS = ("magnitude", "depth", "lat", "lon")
+
+
+@dataclass
+class SourceInversionResult:
+    """震源推定の結果"""
+
+    earthquake: Earthquake  # 最も観測に合う震源
+    misfit: float  # そのときの残差のRMS(震度)
+    candidates: np.ndarray  # 評価した全候補 (n, 4) [magnitude, depth, lat, lon]
+    misfits: np.ndarray  # 各候補の残差のRMS
+    surface_magnitudes: np.ndarray  # 残差分布の軸(マグニチュード)
+    surface_depths: np.ndarray  # 残差分布の軸(深さ)
+    misfit_surface: np.ndarray  # 最適な震央でのマグニチュード x 深さ の残差のRMS
+    rounds: int
+    elapsed: float  # 処理時間[s]
+
+
+def _misfits(
+    model: PredictModel,
+    candidates: np.ndarray,
+    station_lat: np.ndarray,
+    station_lon: np.ndarray,
+    arv400: np.ndarray,
+    observed: np.ndarray,
+    attenuation_table: AttenuationTable,
+    batch_size: int,
+) -> np.ndarray:
+    """候補 x 観測点 をまとめて予測し、候補ごとの残差のRMSを返す"""
+    predicted = predict_intensity_array(
+        model,
+        candidates[:, 0:1],
+        candidates[:, 1:2],
+        candidates[:, 2:3],
+        candidates[:, 3:4],
+        station_lat[None, :],
+        station_lon[None, :],
+        arv400[None, :],
+        attenuation_table=attenuation_table,
+        batch_size=batch_size,
+    )
+    return np.sqrt(np.mean((predicted - observed[None, :]) ** 2, axis=1))
+
+
+def invert_source(
+    model: PredictModel,
+    points: list[ObservationPoint],
+    intensities: list[float],
+    magnitude_range: tuple[float, float] = (3.0, 8.5),
+    depth_range: tuple[float, float] = (0.0, 700.0),
+    lat_range: tuple[float, float] = None,
+    lon_range: tuple[float, float] = None,
+    population: int = 512,
+    elite: int = 32,
+    max_rounds: int = 8,
+    time_budget: float = 1.0,
+    tolerance: float = 0.01,
+    surface_size: int = 24,
+    seed: int = None,
+    batch_size: int = 65536,
+    attenuation_table: AttenuationTable = None,
+) -> SourceInversionResult:
+    """
+    観測点の震度に最も合う (magnitude, depth, lat, lon) を探索する
+
+    1回目は範囲内から一様に population 個の候補を選び、以降は残差の小さい elite 個の
+    平均・標準偏差の正規分布から選び直す(クロスエントロピー法)。
+    各回の候補は全観測点とまとめて1回で予測する。複数コアで推論したい場合は model に
+    InferencePool を渡す。
+
+    time_budget[s] を超えそうな場合は次の回を行わずに終了する。
+    最適な震央でのマグニチュード x 深さ の残差分布も返す。
+
+    :param lat_range: 震央の緯度の範囲(既定: 観測点の範囲を2°広げたもの)
+    :param lon_range: 震央の経度の範囲(既定: 観測点の範囲を2°広げたもの)
+    :param tolerance: 最良の残差がこれ以上改善しなければ終了
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    station_lat = np.array([p.lat for p in points], dtype=np.float64)
+    station_lon = np.array([p.lon for p in points], dtype=np.float64)
+    arv400 = np.array([p.arv400 for p in points], dtype=np.float64)
+    observed = np.asarray(intensities, dtype=np.float64)
+    if len(observed) != len(points):
+        raise ValueError("観測点と震度の数が一致しません")
+    if len(points) == 0:
+        raise ValueError("観測点がありません")
+
+    lat_range = lat_range or (station_lat.min() - 2, station_lat.max() + 2)
+    lon_range = lon_range or (station_lon.min() - 2, station_lon.max() + 2)
+    bounds = np.array([magnitude_range, depth_range, lat_range, lon_range])
+    lower, upper = bounds[:, 0], bounds[:, 1]
+
+    def evaluate(candidates: np.ndarray) -> np.ndarray:
+        return _misfits(
+            model,
+            candidates,
+            station_lat,
+            station_lon,
+            arv400,
+            observed,
+            attenuation_table,
+            batch_size,
+        )
+
+    # 1回目は範囲全体から一様に選ぶ
+    candidates = rng.uniform(lower, upper, (population, len(PARAMETERS)))
+    misfits = evaluate(candidates)
+    all_candidates, all_misfits = [candidates], [misfits]
+    best = float(misfits.min())
+    rounds = 1
+    round_time = time.perf_counter() - start
+
+    while rounds < max_rounds:
+        # 次の回が時間内に終わらなそうなら終了(残差分布の分も残す)
+        if time.perf_counter() - start + round_time * 2 > time_budget:
+            break
+
+        round_start = time.perf_counter()
+        candidates = np.concatenate(all_candidates)
+        misfits = np.concatenate(all_misfits)
+        elites = candidates[np.argsort(misfits)[:elite]]
+
+        # 上位の候補の分布から選び直す(広がりは範囲の1%より小さくしない)
+        mean = elites.mean(axis=0)
+        std = np.maximum(elites.std(axis=0), (upper - lower) * 0.01)
+        candidates = np.clip(
+            rng.normal(mean, std, (population, len(PARAMETERS))), lower, upper
+        )
+        misfits = evaluate(candidates)
+        all_candidates.append(candidates)
+        all_misfits.append(misfits)
+        rounds += 1
+        round_time = time.perf_counter() - round_start
+
+        improved = best - float(misfits.min())
+        best = min(best, float(misfits.min()))
+        if 0 <= improved < tolerance:
+            break
+
+    candidates = np.concatenate(all_candidates)
+    misfits = np.concatenate(all_misfits)
+    _, _, lat, lon = candidates[np.argmin(misfits)]
+
+    # 最適な震央での マグニチュード x 深さ の残差分布
+    surface_magnitudes = np.linspace(*magnitude_range, surface_size)
+    surface_depths = np.linspace(*depth_range, surface_size)
+    m_grid, d_grid = np.meshgrid(surface_magnitudes, surface_depths, indexing="ij")
+    surface_candidates = np.stack(
+        [
+            m_grid.ravel(),
+            d_grid.ravel(),
+            np.full(m_grid.size, lat),
+            np.full(m_grid.size, lon),
+        ],
+        axis=-1,
+    )
+    misfit_surface = evaluate(surface_candidates).reshape(m_grid.shape)
+
+    # 残差分布の格子点の方が合う場合もあるので候補に含める
+    candidates = np.concatenate([candidates, surface_candidates])
+    misfits = np.concatenate([misfits, misfit_surface.ravel()])
+    best_index = int(np.argmin(misfits))
+    magnitude, depth, lat, lon = candidates[best_index]
+
+    return SourceInversionResult(
+        earthquake=Earthquake(
+            lat=float(lat), lon=float(lon), depth=float(depth), magnitude=float(magnitude)
+        ),
+        misfit=float(misfits[best_index]),
+        candidates=candidates,
+        misfits=misfits,
+        surface_magnitudes=surface_magnitudes,
+        surface_depths=surface_depths,
+        misfit_surface=misfit_surface,
+        rounds=rounds,
+        elapsed=time.perf_counter() - start,
+    )
@@ -5,90 +5,145 @@
 import numpy as np
 
 from asid_predict.utils import (
-    calc_pgv400_from_amplification_factor,
-    convert_pgv_to_intensity,
+    AttenuationTable,
+    calc_distance_array,
+    convert_pgv_to_intensity_array,
+    lookup_pgv400,
 )
 
 from asid_predict.dataclass import (
-    TrainingRecord,
     Earthquake,
     ObservationPoint,
     RegionalObservationPoint,
 )
 
-from asid_predict.models import PredictModel, normalize_input
-from asid_predict.models import reverse_normalize_output
+from asid_predict.metrics import BATCH_SIZE_BUCKETS, REGISTRY
+from asid_predict.models import PredictModel, normalize_input_array
+
+_STAGE_SECONDS = "predict_stage_seconds"
+_STAGE_HELP = "震度予測の段階ごとの処理時間[s]"
+
+
+def predict_intensity_array(
+    model: PredictModel,
+    magnitude: np.ndarray,
+    depth: np.ndarray,
+    hypocenter_lat: np.ndarray,
+    hypocenter_lon: np.ndarray,
+    station_lat: np.ndarray,
+    station_lon: np.ndarray,
+    arv400: np.ndarray,
+    attenuation_table: AttenuationTable = None,
+    batch_size: int = None,
+) -> np.ndarray:
+    """
+    震源・地点の配列から震度をまとめて予測(ブロードキャスト可)
+
+    model が predict_raw を持つ場合(PlateModelRouter)は正規化前の入力を渡す。
+    """
+    with REGISTRY.timer(_STAGE_SECONDS, _STAGE_HELP, stage="total"):
+        with REGISTRY.timer(_STAGE_SECONDS, _STAGE_HELP, stage="input"):
+            columns = np.broadcast_arrays(
+                *[
+                    np.asarray(v, dtype=np.float64)
+                    for v in (
+                        magnitude,
+                        depth,
+                        hypocenter_lat,
+                        hypocenter_lon,
+                        station_lat,
+                        station_lon,
+                    )
+                ]
+            )
+            x = np.stack([c.ravel() for c in columns], axis=-1)
+            predict = getattr(model, "predict_raw", None)
+            if predict is None:
+                x = normalize_input_array(x)
+                predict = model.predict
+
+        # 予測実行
+        if REGISTRY.enabled:
+            REGISTRY.observe(
+                "predict_batch_rows",
+                len(x),
+                BATCH_SIZE_BUCKETS,
+                "1回の予測でモデルに渡した行数",
+            )
+            REGISTRY.record_model_call(model)
+        with REGISTRY.timer(_STAGE_SECONDS, _STAGE_HELP, stage="model"):
+            if batch_size is None:
+                y = predict(x)
+            else:
+                y = predict(x, batch_size=batch_size)
+            amplification_factor = np.asarray(y)[:, 0]
+
+        # 増幅率から計測震度に変換
+        with REGISTRY.timer(_STAGE_SECONDS, _STAGE_HELP, stage="postprocess"):
+            distance = calc_distance_array(*columns[2:]).ravel()
+            calc_pgv400 = lookup_pgv400(
+                distance,
+                magnitude if np.ndim(magnitude) == 0 else columns[0].ravel(),
+                depth if np.ndim(depth) == 0 else columns[1].ravel(),
+                attenuation_table,
+            )
+            pgv400 = amplification_factor.astype(np.float64) ** 4 * 20 * calc_pgv400
+            pgv = pgv400 * np.broadcast_to(arv400, columns[0].shape).ravel()
+
+            return convert_pgv_to_intensity_array(pgv).reshape(columns[0].shape)
 
 
 def predict_intensities(
     model: PredictModel,
     targets: list[ObservationPoint],
     eq: Earthquake,
+    attenuation_table: AttenuationTable = None,
 ) -> list[float]:
     """個別地点の震度予測"""
+    intensities = predict_intensity_array(
+        model,
+        eq.magnitude,
+        eq.depth,
+        eq.lat,
+        eq.lon,
+        np.array([p.lat for p in targets]),
+        np.array([p.lon for p in targets]),
+        np.array([p.arv400 for p in targets]),
+        attenuation_table,
+    )
 
-    # モデルに入力する値に変換
-    data: list[TrainingRecord] = [
-        TrainingRecord(
-            eq.magnitude,
-            eq.depth,
-            eq.lat,
-            eq.lon,
-            p.lat,
-            p.lon,
-            None,
-            None,
-        )
-        for p in targets
-    ]
-
-    # 予測実行
-    x = np.array([normalize_input(d) for d in data])
-    y = model.predict(x)
-
-    # 計測震度に変換
-    intensities: list[float] = []
-    for i in range(len(data)):
-        record = data[i]
-        record.amplification_factor = reverse_normalize_output(y[i])
-        record.pgv400 = calc_pgv400_from_amplification_factor(eq, record)
-
-        arv400 = targets[i].arv400
-        pgv = record.pgv400 * arv400
-        intensity = convert_pgv_to_intensity(pgv)
-
-        intensities.append(intensity)
-
-    return intensities
+    return intensities.tolist()
 
 
 def predict_intensities_area(
     model: PredictModel,
     targets: list[RegionalObservationPoint],
     eq: Earthquake,
+    attenuation_table: AttenuationTable = None,
 ) -> list[dict]:
     """細分区域ごとの震度予測"""
 
     points = [ObservationPoint(t.lat, t.lon, t.arv400) for t in targets]
-    result = predict_intensities(model, points, eq)
-
-    regions_dict = {}
-
-    for i in range(len(targets)):
-        intensity = result[i]
-        target = targets[i]
-
-        regions_dict[target.region] = max(
-            regions_dict.get(target.region, intensity), intensity
+    result = predict_intensities(model, points, eq, attenuation_table)
+
+    with REGISTRY.timer(_STAGE_SECONDS, _STAGE_HELP, stage="region"):
+        regions_dict = {}
+
+        for i in range(len(targets)):
+            intensity = result[i]
+            target = targets[i]
+
+            regions_dict[target.region] = max(
+                regions_dict.get(target.region, intensity), intensity
+            )
+
+        regions = sorted(
+            [
+                {"code": region, "maxInt": intensity}
+                for region, intensity in regions_dict.items()
+            ],
+            key=lambda x: x["maxInt"],
+            reverse=True,
         )
 
-    regions = sorted(
-        [
-            {"code": region, "maxInt": intensity}
-            for region, intensity in regions_dict.items()
-        ],
-        key=lambda x: x["maxInt"],
-        reverse=True,
-    )
-
     return regions
@@ -0,0 +1,208 @@
+"""
+緯度経度の等間隔格子で震度分布図を作成する
+"""
+
+import json
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake
+from asid_predict.models import PredictModel
+from asid_predict.utils import AttenuationTable
+from .predictor import predict_intensity_array
+
+__all__ = [
+    "GridSpec",
+    "Arv400Raster",
+    "rasterize_intensity_map",
+    "read_raster_window",
+]
+
+
+@dataclass
+class GridSpec:
+    """格子の範囲と解像度 各セルの値はセル中心の震度(0行目が南端)"""
+
+    lat_min: float = 20.0
+    lat_max: float = 50.0
+    lon_min: float = 120.0
+    lon_max: float = 150.0
+    resolution: float = 0.05
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (
+            int(round((self.lat_max - self.lat_min) / self.resolution)),
+            int(round((self.lon_max - self.lon_min) / self.resolution)),
+        )
+
+    def lats(self) -> np.ndarray:
+        """各行の中心の緯度"""
+        return self.lat_min + (np.arange(self.shape[0]) + 0.5) * self.resolution
+
+    def lons(self) -> np.ndarray:
+        """各列の中心の経度"""
+        return self.lon_min + (np.arange(self.shape[1]) + 0.5) * self.resolution
+
+    def window(
+        self, lat_range: tuple[float, float], lon_range: tuple[float, float]
+    ) -> tuple[slice, slice]:
+        """緯度経度の範囲に含まれる行・列"""
+        n_lat, n_lon = self.shape
+
+        def to_slice(value_range, origin, n):
+            start = int(np.floor((value_range[0] - origin) / self.resolution))
+            stop = int(np.ceil((value_range[1] - origin) / self.resolution))
+            return slice(max(start, 0), min(stop, n))
+
+        return (
+            to_slice(lat_range, self.lat_min, n_lat),
+            to_slice(lon_range, self.lon_min, n_lon),
+        )
+
+
+class Arv400Raster:
+    """格子状の地盤増幅率(arv400) 最も近いセルの値を返す"""
+
+    def __init__(self, values: np.ndarray, grid: GridSpec, default: float = 1.0):
+        self.values = values
+        self.grid = grid
+        self.default = default
+
+    @classmethod
+    def load(cls, filepath: str, grid: GridSpec, default: float = 1.0) -> "Arv400Raster":
+        """.npyファイルを読み込む(メモリマップ)"""
+        return cls(np.load(filepath, mmap_mode="r"), grid, default)
+
+    def sample(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """緯度経度の位置のarv400 範囲外や欠損値はdefault"""
+        n_lat, n_lon = self.values.shape
+        i = np.floor((lat - self.grid.lat_min) / self.grid.resolution).astype(np.int64)
+        j = np.floor((lon - self.grid.lon_min) / self.grid.resolution).astype(np.int64)
+        inside = (i >= 0) & (i < n_lat) & (j >= 0) & (j < n_lon)
+
+        result = np.full(np.shape(lat), self.default, dtype=np.float64)
+        result[inside] = self.values[i[inside], j[inside]]
+        return np.where(np.isfinite(result), result, self.default)
+
+
+def _metadata_path(filepath: str) -> str:
+    return filepath + ".json"
+
+
+class _LockedPredictor:
+    """
+    model.predict だけを順番に呼び出すラッパー (kerasのモデルはスレッドセーフではない)
+
+    入力の作成や震度への変換はロックの外で並列に行われる。
+    """
+
+    def __init__(self, model: PredictModel):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        with self.lock:
+            return self.model.predict(x, batch_size=batch_size)
+
+
+# 同じモデルを同時に複数の震度分布図で使っても推論が重ならないように、モデルごとに1つ
+_locked_predictors: "weakref.WeakKeyDictionary[PredictModel, _LockedPredictor]" = (
+    weakref.WeakKeyDictionary()
+)
+_locked_predictors_lock = threading.Lock()
+
+
+def _locked_predictor(model: PredictModel) -> _LockedPredictor:
+    with _locked_predictors_lock:
+        predictor = _locked_predictors.get(model)
+        if predictor is None:
+            predictor = _locked_predictors[model] = _LockedPredictor(model)
+        return predictor
+
+
+def rasterize_intensity_map(
+    model: PredictModel,
+    eq: Earthquake,
+    filepath: str,
+    grid: GridSpec = None,
+    arv400: Arv400Raster | float = 1.0,
+    tile_rows: int = 32,
+    workers: int = 1,
+    batch_size: int = 16384,
+    attenuation_table: AttenuationTable = None,
+) -> np.memmap:
+    """
+    格子の全セルの震度を予測し、.npyのメモリマップに書き出す
+
+    行方向にtile_rows行ずつのタイルに分けて処理するので、メモリ使用量はタイルの大きさで決まる。
+    タイルはworkers個のスレッドで並列に処理する。
+    PredictModelの推論(model.predict)だけはスレッド間で順番に行い、地盤増幅率の取得・距離減衰・震度への変換は並列に行う。
+    推論も並列にする場合は InferencePool を model に渡す。
+
+    :param arv400: 格子状の地盤増幅率、または全セル共通の値
+    :return: 書き出した震度(float32)のメモリマップ
+    """
+    grid = grid or GridSpec()
+    n_lat, n_lon = grid.shape
+    lats, lons = grid.lats(), grid.lons()
+
+    output = np.lib.format.open_memmap(
+        filepath, mode="w+", dtype=np.float32, shape=(n_lat, n_lon)
+    )
+    with open(_metadata_path(filepath), "w") as f:
+        json.dump({"grid": asdict(grid), "earthquake": asdict(eq)}, f)
+
+    # kerasのモデルはスレッドセーフではないので推論だけは順番に行う
+    predictor = _locked_predictor(model) if isinstance(model, PredictModel) else model
+
+    def process_tile(row_start: int):
+        rows = slice(row_start, min(row_start + tile_rows, n_lat))
+        lat, lon = np.meshgrid(lats[rows], lons, indexing="ij")
+        site = (
+            arv400.sample(lat, lon)
+            if isinstance(arv400, Arv400Raster)
+            else np.full(lat.shape, arv400)
+        )
+
+        output[rows] = predict_intensity_array(
+            predictor,
+            eq.magnitude,
+            eq.depth,
+            eq.lat,
+            eq.lon,
+            lat,
+            lon,
+            site,
+            attenuation_table=attenuation_table,
+            batch_size=batch_size,
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(process_tile, range(0, n_lat, tile_rows)))
+
+    output.flush()
+    return output
+
+
+def read_raster_window(
+    filepath: str,
+    lat_range: tuple[float, float],
+    lon_range: tuple[float, float],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    震度分布図の一部だけを読み込む(全体は読み込まない)
+
+    :return: (震度, 各行の緯度, 各列の経度)
+    """
+    with open(_metadata_path(filepath), "r") as f:
+        grid = GridSpec(**json.load(f)["grid"])
+
+    rows, cols = grid.window(lat_range, lon_range)
+    values = np.load(filepath, mmap_mode="r")
+
+    return np.array(values[rows, cols]), grid.lats()[rows], grid.lons()[cols]
@@ -0,0 +1,240 @@
+"""
+細分区域ごとの震度予測の結果を配列で持ち、小さい2進形式で送れるようにする
+
+    targets = RegionTargets.from_points(points)  # 区域の振り分けは最初に1度だけ
+    result = predict_intensities_area_array(model, targets, eq, event_id="20240101")
+    payload = result.to_bytes()  # JSONにせずそのまま送る
+    result = RegionalIntensityResult.from_bytes(payload)
+    result.regions  # 従来の [{"code", "maxInt"}] (必要になったときに作る)
+"""
+
+import json
+import struct
+from functools import cached_property
+
+import numpy as np
+
+from asid_predict.config import VERSION
+from asid_predict.dataclass import Earthquake, RegionalObservationPoint
+from asid_predict.metrics import REGISTRY
+from asid_predict.models import PredictModel
+from asid_predict.utils import AttenuationTable
+from .predictor import _STAGE_HELP, _STAGE_SECONDS, predict_intensity_array
+
+__all__ = [
+    "RegionTargets",
+    "RegionalIntensityResult",
+    "predict_intensities_area_array",
+]
+
+# 2進形式のマジックナンバーと形式の版
+MAGIC = b"ASIR"
+FORMAT_VERSION = 1
+
+# マジックナンバー, 形式の版, フラグ, モデルの版, 地震IDの長さ, 区域数
+_HEADER = struct.Struct("<4sBBdHI")
+
+# フラグ: 区域コードが全て数字なので uint32 で持つ
+_NUMERIC_CODES = 1
+
+
+def _encode_codes(codes: np.ndarray) -> tuple[int, bytes]:
+    """区域コードを2進形式にする (フラグ, バイト列)"""
+    codes = [str(c) for c in codes]
+    # 先頭が0のコードなどは数字に戻せないのでJSONにする
+    numeric = all(
+        c.isascii() and c.isdigit() and str(int(c)) == c and int(c) < 2**32
+        for c in codes
+    )
+    if numeric:
+        return _NUMERIC_CODES, np.array(codes, dtype=np.int64).astype("<u4").tobytes()
+
+    encoded = json.dumps(codes, ensure_ascii=False).encode("utf-8")
+    return 0, struct.pack("<I", len(encoded)) + encoded
+
+
+class RegionTargets:
+    """
+    予測地点の配列と細分区域への振り分け
+
+    区域は予測地点に最初に出てきた順に並べる(predict_intensities_area と同じ順番)。
+    """
+
+    def __init__(
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        arv400: np.ndarray,
+        regions: np.ndarray,
+    ):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.arv400 = np.asarray(arv400, dtype=np.float64)
+
+        codes, first, inverse = np.unique(
+            np.asarray(regions).astype(str), return_index=True, return_inverse=True
+        )
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        self.codes = codes[order]
+        self.inverse = rank[inverse.ravel()]
+
+    @cached_property
+    def encoded_codes(self) -> tuple[int, bytes]:
+        """2進形式の区域コード(結果ごとに作り直さないように持っておく)"""
+        return _encode_codes(self.codes)
+
+    @classmethod
+    def from_points(cls, targets: list[RegionalObservationPoint]) -> "RegionTargets":
+        return cls(
+            [t.lat for t in targets],
+            [t.lon for t in targets],
+            [t.arv400 for t in targets],
+            [t.region for t in targets],
+        )
+
+    def aggregate(self, intensities: np.ndarray) -> np.ndarray:
+        """地点ごとの震度 -> 区域ごとの最大震度"""
+        result = np.full(len(self.codes), -np.inf)
+        np.maximum.at(result, self.inverse, intensities)
+        return result
+
+
+class RegionalIntensityResult:
+    """
+    細分区域ごとの最大震度 (区域コードの配列と float32 の震度の配列)
+
+    intensities は buffer() でコピーせずに渡せる。
+    従来の [{"code", "maxInt"}] (震度の大きい順) は regions で初めて使うときに作る。
+    """
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        intensities: np.ndarray,
+        event_id: str = "",
+        model_version: float = VERSION,
+        encoded_codes: tuple[int, bytes] = None,
+    ):
+        """
+        :param encoded_codes: RegionTargets.encoded_codes (to_bytes で区域コードを変換しない)
+        """
+        self.codes = np.asarray(codes)
+        self.intensities = np.asarray(intensities, dtype=np.float32)
+        self.event_id = event_id
+        self.model_version = model_version
+        self._encoded_codes = encoded_codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def buffer(self) -> memoryview:
+        """震度の配列のメモリ(コピーしない)"""
+        return memoryview(self.intensities)
+
+    @cached_property
+    def regions(self) -> list[dict]:
+        """predict_intensities_area と同じ形の結果"""
+        order = np.argsort(-self.intensities, kind="stable")
+        return [
+            {"code": str(self.codes[i]), "maxInt": float(self.intensities[i])}
+            for i in order
+        ]
+
+    def to_bytes(self) -> bytes:
+        """
+        2進形式にする
+
+        ヘッダ(マジックナンバー "ASIR", 形式の版(uint8), フラグ(uint8), モデルの版(float64),
+        地震IDの長さ(uint16), 区域数(uint32)), 地震ID(UTF-8), 区域コード, 震度(float32 x 区域数)
+
+        区域コードは全て数字なら uint32 x 区域数、それ以外は長さ(uint32) + JSON
+        """
+        event_id = self.event_id.encode("utf-8")
+        if self._encoded_codes is None:
+            self._encoded_codes = _encode_codes(self.codes)
+        flags, code_bytes = self._encoded_codes
+
+        return b"".join(
+            [
+                _HEADER.pack(
+                    MAGIC,
+                    FORMAT_VERSION,
+                    flags,
+                    self.model_version,
+                    len(event_id),
+                    len(self.codes),
+                ),
+                event_id,
+                code_bytes,
+                self.intensities.astype("<f4", copy=False).tobytes(),
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RegionalIntensityResult":
+        """to_bytes の逆 (震度と数字の区域コードは data を参照し、コピーしない)"""
+        magic, version, flags, model_version, id_length, n_regions = _HEADER.unpack_from(
+            data
+        )
+        if magic != MAGIC:
+            raise ValueError("細分区域の震度の2進形式ではありません")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"未対応の形式の版です: {version}")
+
+        offset = _HEADER.size
+        event_id = bytes(data[offset : offset + id_length]).decode("utf-8")
+        offset += id_length
+
+        if flags & _NUMERIC_CODES:
+            codes = np.frombuffer(data, dtype="<u4", count=n_regions, offset=offset)
+            offset += codes.nbytes
+        else:
+            (length,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            codes = np.array(
+                json.loads(bytes(data[offset : offset + length]).decode("utf-8"))
+            )
+            offset += length
+
+        intensities = np.frombuffer(data, dtype="<f4", count=n_regions, offset=offset)
+        return cls(codes, intensities, event_id, model_version)
+
+
+def predict_intensities_area_array(
+    model: PredictModel,
+    targets: RegionTargets | list[RegionalObservationPoint],
+    eq: Earthquake,
+    attenuation_table: AttenuationTable = None,
+    event_id: str = "",
+    model_version: float = VERSION,
+) -> RegionalIntensityResult:
+    """
+    細分区域ごとの震度予測 (predict_intensities_area の配列版)
+
+    同じ予測地点で何度も予測する場合は RegionTargets を作って渡すと、区域の振り分けを毎回しない。
+    """
+    if not isinstance(targets, RegionTargets):
+        targets = RegionTargets.from_points(targets)
+
+    intensities = predict_intensity_array(
+        model,
+        eq.magnitude,
+        eq.depth,
+        eq.lat,
+        eq.lon,
+        targets.lat,
+        targets.lon,
+        targets.arv400,
+        attenuation_table,
+    )
+
+    with REGISTRY.timer(_STAGE_SECONDS, _STAGE_HELP, stage="region"):
+        return RegionalIntensityResult(
+            targets.codes,
+            targets.aggregate(intensities),
+            event_id,
+            model_version,
+            targets.encoded_codes,
+        )
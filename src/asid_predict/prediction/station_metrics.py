@@ -0,0 +1,101 @@
+"""
+学習中に実際の観測点の震度で予測を評価し、JSONLに書き出すkerasのコールバック
+"""
+
+import json
+import time
+
+import numpy as np
+import keras
+
+from asid_predict.dataclass import EarthquakeRecord
+from asid_predict.utils import AttenuationTable
+from .backtest import residual_statistics, station_columns
+from .predictor import predict_intensity_array
+
+__all__ = ["StationMetricsCallback"]
+
+
+class _KerasPredictor:
+    """学習中のkerasのモデルを predict_intensity_array に渡すためのラッパー"""
+
+    def __init__(self, model: keras.Model):
+        self.model = model
+
+    def predict(self, x: np.ndarray, batch_size: int = None) -> np.ndarray:
+        return self.model.predict(x, batch_size=batch_size, verbose=0)
+
+
+class StationMetricsCallback(keras.callbacks.Callback):
+    """
+    every エポックごとに、決まった地震の観測点の震度を1回でまとめて予測し、残差の統計をJSONLに追記する
+
+    統計(bias, rmse, mae, hit_rate)は logs にも "station_" を付けて入れるので、
+    このコールバックの後に EarlyStopping(monitor="station_rmse", mode="min") を置けば震度の誤差で学習を止められる。
+    (every が2以上だと評価しないエポックで EarlyStopping が警告を出すので、patience はその分長くする)
+
+        callback = StationMetricsCallback(test_earthquakes, "out/station_metrics.jsonl")
+        stop = keras.callbacks.EarlyStopping(monitor="station_rmse", mode="min", patience=5)
+        model.execute_training(epochs=100, callbacks=[callback, stop])
+    """
+
+    def __init__(
+        self,
+        earthquakes: list[EarthquakeRecord],
+        log_path: str = None,
+        every: int = 1,
+        batch_size: int = 65536,
+        tolerance: float = 0.5,
+        attenuation_table: AttenuationTable = None,
+    ):
+        """
+        :param earthquakes: 評価に使う地震(全観測点を使う) 学習に使っていない地震を渡す
+        :param log_path: 書き出すJSONLファイル(Noneなら書き出さず logs と history だけ)
+        :param every: 何エポックごとに評価するか
+        :param tolerance: hit_rate の残差の許容範囲[震度]
+        """
+        super().__init__()
+        self.columns, _ = station_columns(earthquakes)
+        self.log_path = log_path
+        self.every = every
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.attenuation_table = attenuation_table
+        self.history: list[dict] = []
+
+    def evaluate(self) -> dict:
+        """今のモデルで全観測点を予測して残差の統計を計算"""
+        start = time.perf_counter()
+        predicted = predict_intensity_array(
+            _KerasPredictor(self.model),
+            *self.columns[:, :7].T,
+            attenuation_table=self.attenuation_table,
+            batch_size=self.batch_size,
+        )
+        return {
+            **residual_statistics(predicted - self.columns[:, 7], self.tolerance),
+            "n_stations": len(self.columns),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def on_epoch_end(self, epoch: int, logs: dict = None):
+        if (epoch + 1) % self.every != 0:
+            return
+
+        metrics = self.evaluate()
+        entry = {
+            "epoch": epoch + 1,
+            "time": time.time(),
+            **{k: float(v) for k, v in (logs or {}).items()},
+            **metrics,
+        }
+        self.history.append(entry)
+
+        if logs is not None:
+            for name in ("bias", "rmse", "mae", "hit_rate"):
+                logs[f"station_{name}"] = metrics[name]
+
+        if self.log_path is not None:
+            # 学習中に tail -f などで見られるように1エポックごとに書き込む
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
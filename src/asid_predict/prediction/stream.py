@@ -0,0 +1,97 @@
+"""
+緊急地震速報の続報を受け取りながら、最新の版だけ震度予測する非同期ストリーム
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from asid_predict.dataclass import Earthquake, RegionalObservationPoint
+from asid_predict.models import PredictModel
+from .predictor import predict_intensities_area
+
+__all__ = ["StreamPredictionResult", "stream_predictions_area"]
+
+
+@dataclass
+class StreamPredictionResult:
+    """1つの版の予測結果"""
+
+    event_id: str
+    revision: int  # 受信順の版番号(0始まり)
+    earthquake: Earthquake
+    regions: list[dict]
+    latency: float  # 受信から予測結果が出るまでの時間[s]
+    skipped: int  # この結果までに飛ばした古い版の数(累計)
+
+
+async def stream_predictions_area(
+    model: PredictModel,
+    targets: list[RegionalObservationPoint],
+    event_id: str,
+    updates: AsyncIterator[Earthquake],
+) -> AsyncIterator[StreamPredictionResult]:
+    """
+    地震情報の続報ごとに細分区域の震度を予測して返す
+
+    計算を始める前に新しい版が届いた版は計算しない。
+    計算中に新しい版が届いた場合、その結果は古いので返さずに捨てる。
+    """
+    latest: tuple[int, Earthquake, float] | None = None
+    finished = False
+    skipped = 0
+    changed = asyncio.Event()
+
+    async def receive():
+        nonlocal latest, finished, skipped
+        revision = 0
+        try:
+            async for earthquake in updates:
+                if latest is not None:
+                    # 計算を始める前に次の版が来た
+                    skipped += 1
+                latest = (revision, earthquake, time.perf_counter())
+                revision += 1
+                changed.set()
+        finally:
+            finished = True
+            changed.set()
+
+    receiver = asyncio.create_task(receive())
+
+    try:
+        while True:
+            await changed.wait()
+            changed.clear()
+
+            if latest is None:
+                if finished:
+                    break
+                continue
+
+            revision, earthquake, received_at = latest
+            latest = None
+
+            regions = await asyncio.to_thread(
+                predict_intensities_area, model, targets, earthquake
+            )
+
+            if latest is not None:
+                # 計算中に新しい版が来たので捨てる
+                skipped += 1
+                continue
+
+            yield StreamPredictionResult(
+                event_id=event_id,
+                revision=revision,
+                earthquake=earthquake,
+                regions=regions,
+                latency=time.perf_counter() - received_at,
+                skipped=skipped,
+            )
+
+        # 受信側の例外はここで送出
+        await receiver
+    finally:
+        receiver.cancel()
@@ -2,9 +2,33 @@
 学習を行ってモデルを保存する1連の流れを行う関数
 """
 
+import numpy as np
+
+from asid_predict.config import TRAIN_DATA
 from asid_predict.data_processing.data_file_loader import DataFileLoader
 from asid_predict.data_processing.train_record_generator import TrainingRecordGenerator
+from asid_predict.models.model_store import ModelStore
 from asid_predict.models.predict_model import PredictModel
+from asid_predict.prediction.station_metrics import StationMetricsCallback
+
+
+def _split_holdout_earthquakes(
+    earthquakes: list, ratio: float, seed: int = None
+) -> tuple[list, list]:
+    """地震単位で ratio の割合(最低1つ)を取り分ける (学習に使う地震, 取り分けた地震)"""
+    if len(earthquakes) < 2:
+        raise ValueError(
+            "学習と評価に分けるには地震が2つ以上必要です"
+            f"(station_metrics_log を指定しない場合は不要): {len(earthquakes)}"
+        )
+    rng = np.random.default_rng(seed)
+    n_holdout = min(max(int(len(earthquakes) * ratio), 1), len(earthquakes) - 1)
+    is_holdout = np.zeros(len(earthquakes), dtype=bool)
+    is_holdout[rng.choice(len(earthquakes), n_holdout, replace=False)] = True
+    return (
+        [eq for eq, h in zip(earthquakes, is_holdout) if not h],
+        [eq for eq, h in zip(earthquakes, is_holdout) if h],
+    )
 
 
 def execute_training_process(
@@ -14,8 +38,29 @@ def execute_training_process(
     epochs: int = 30,
     batch_size: int = 64,
     save_path: str = None,
+    augment_on_the_fly: bool = False,
+    model_store: ModelStore = None,
+    interpolator: str = None,
+    memory_budget_mb: float = None,
+    memmap_dir: str = None,
+    measure_memory: bool = False,
+    seed: int = None,
+    station_metrics_log: str = None,
+    station_metrics_every: int = 1,
+    station_metrics_holdout: float = 0.1,
 ) -> PredictModel:
-    """学習"""
+    """
+    学習
+
+    augment_on_the_fly=True で、複製水増しデータを事前に作らず学習中にバッチごとに作る
+    model_store を指定すると、プレート・学習データのハッシュ・損失と一緒にモデル置き場にも保存する
+    interpolator で補間データの補間方法を選ぶ("kriging"(既定) / "idw" / "rbf")
+    memory_budget_mb を指定すると、学習データを予算内のメモリ(超える分は memmap_dir のメモリマップ)で作る
+    measure_memory=True で、その段階ごとの最大メモリ使用量も表示する(プロセス全体の最大メモリ使用量の記録が戻る)
+    seed を指定すると、地震ごとの学習用データ(補間・水増しの選び方)が毎回同じになる
+    station_metrics_log を指定すると、地震の station_metrics_holdout の割合を学習から除いておき、
+    station_metrics_every エポックごとにその地震の観測点の震度の残差(bias, rmse, mae, hit_rate)をJSONLに追記する
+    """
 
     # 地震データ, 予測点データの読み込み
     print("1/5 地震データと予測点データの読み込み")
@@ -23,10 +68,21 @@ def execute_training_process(
     train_earthquakes = data_loader.get_filtered_earthquakes(
         target_is_pasific_plate, min_depth
     )
+    metrics_earthquakes = None
+    if station_metrics_log is not None:
+        # 学習データの誤差にならないように、評価する地震は丸ごと学習から除く
+        train_earthquakes, metrics_earthquakes = _split_holdout_earthquakes(
+            train_earthquakes, station_metrics_holdout, seed
+        )
 
     # 学習用データ生成用クラス
     training_data_generator = TrainingRecordGenerator(
-        data_loader.predict_points, data_loader.coast_points
+        data_loader.predict_points,
+        data_loader.coast_points,
+        predict_point_set=data_loader.predict_point_set,
+        coast_point_set=data_loader.coast_point_set,
+        interpolator=interpolator,
+        seed=seed,
     )
 
     # 学習モデルの初期化
@@ -36,22 +92,53 @@ def execute_training_process(
     print("2/5 学習用データの作成")
     model.initialize_dataset_for_training(
         earthquakes=train_earthquakes,
-        train_data_generator=training_data_generator.from_earthquake,
+        train_data_generator=(
+            training_data_generator.from_earthquake_weighted
+            if augment_on_the_fly
+            else training_data_generator.from_earthquake
+        ),
+        augment_on_the_fly=augment_on_the_fly,
+        memory_budget_mb=memory_budget_mb,
+        memmap_dir=memmap_dir,
+        measure_memory=measure_memory,
     )
+    if model.build_report is not None:
+        report = model.build_report
+        print(
+            f"  rows: train={report.num_train} test={report.num_test}"
+            f" in_memory={report.in_memory}"
+        )
+        for stage, values in report.stages.items():
+            print(f"  {stage}: {values}")
 
     # 学習を実行
     print("3/5 モデルの学習")
-    model.execute_training(
+    callbacks = []
+    if metrics_earthquakes is not None:
+        callbacks.append(
+            StationMetricsCallback(
+                metrics_earthquakes, station_metrics_log, station_metrics_every
+            )
+        )
+    history = model.execute_training(
         epochs=epochs,
         batch_size=batch_size,
+        callbacks=callbacks,
     )
 
     # 精度の確認
     print("4/5 モデルの評価")
-    model.evaluate()
+    test_loss = model.evaluate()
 
     # 学習済みモデルを保存
     print("5/5 学習済みモデルの保存")
     model.save_weight(save_path)
+    if model_store is not None:
+        model_store.save(
+            model,
+            plate="pacific" if target_is_pasific_plate else "philippine_sea",
+            data_path=train_json_path or TRAIN_DATA,
+            metrics={"loss": history.history["loss"][-1], "test_loss": test_loss},
+        )
 
     return model
@@ -4,3 +4,5 @@
 
 from .earthquake import *
 from .geo import *
+from .attenuation_table import *
+from .point_set import *
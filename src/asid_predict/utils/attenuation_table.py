@@ -0,0 +1,157 @@
+"""
+距離減衰式(calculate_pgv400)の事前計算テーブル
+"""
+
+import numpy as np
+
+from .earthquake import calculate_pgv400_array
+
+__all__ = ["AttenuationTable", "lookup_pgv400"]
+
+
+class AttenuationTable:
+    """
+    (距離, マグニチュード, 深さ)の格子上でlog10(pgv400)を事前計算し、三線形補間で引く表
+
+    log10(pgv400)はどの軸にも滑らかなので、補間誤差は格子幅の2乗に比例する。
+    作成時にセル中心(線形補間の誤差が最大になりやすい点)とランダムな点で実際の式と比べた
+    最大誤差を error_bound[震度]として持つ。誤差は震源直上の浅い所(距離・深さとも数km)で
+    最も大きく、既定の格子では深さ100km以上なら約0.13、全体で約0.3。
+    範囲外の値は距離減衰式で直接計算する。
+    """
+
+    def __init__(
+        self,
+        distance_step: float = 5.0,
+        magnitude_step: float = 0.1,
+        depth_step: float = 10.0,
+        distance_range: tuple[float, float] = (0.0, 2500.0),
+        magnitude_range: tuple[float, float] = (2.0, 9.0),
+        depth_range: tuple[float, float] = (0.0, 800.0),
+        error_check_samples: int = 100000,
+        seed: int = 0,
+    ):
+        self.axes = [
+            _make_axis(distance_range, distance_step),
+            _make_axis(magnitude_range, magnitude_step),
+            _make_axis(depth_range, depth_step),
+        ]
+        self.steps = np.array([distance_step, magnitude_step, depth_step])
+        self.origins = np.array([axis[0] for axis in self.axes])
+        self.shape = np.array([len(axis) for axis in self.axes])
+
+        d, m, h = np.meshgrid(*self.axes, indexing="ij")
+        self.log_table = np.log10(calculate_pgv400_array(d, m, h)).astype(np.float32)
+
+        self.error_bound = self._estimate_error_bound(error_check_samples, seed)
+
+    def _estimate_error_bound(self, n_samples: int, seed: int) -> float:
+        """セル中心とランダムな点での最大誤差を震度単位で求める"""
+        rng = np.random.default_rng(seed)
+        cells = [rng.integers(0, n - 1, n_samples) for n in self.shape]
+        centers = np.stack(
+            [axis[cell] + step / 2 for axis, cell, step in zip(self.axes, cells, self.steps)],
+            axis=-1,
+        )
+        randoms = self.origins + rng.random((n_samples, 3)) * self.steps * (
+            self.shape - 1
+        )
+        points = np.concatenate([centers, randoms])
+
+        exact = np.log10(calculate_pgv400_array(points[:, 0], points[:, 1], points[:, 2]))
+        approx = self._interpolate(points)
+
+        # 震度 = 2.54 + 1.82 * log10(pgv)
+        return float(1.82 * np.max(np.abs(approx - exact)))
+
+    def _interpolate(self, points: np.ndarray) -> np.ndarray:
+        """範囲内の点について三線形補間でlog10(pgv400)を求める"""
+        position = (points - self.origins) / self.steps
+        index = np.clip(np.floor(position).astype(np.int64), 0, self.shape - 2)
+        t = position - index
+
+        result = np.zeros(len(points))
+        for corner in range(8):
+            offset = np.array([(corner >> axis) & 1 for axis in range(3)])
+            weight = np.prod(np.where(offset == 1, t, 1 - t), axis=-1)
+            i, j, k = (index + offset).T
+            result += weight * self.log_table[i, j, k]
+
+        return result
+
+    def _distance_profile(self, magnitude: float, depth: float) -> np.ndarray:
+        """マグニチュード・深さ方向だけ補間した、距離軸上のlog10(pgv400)"""
+        position = (np.array([magnitude, depth]) - self.origins[1:]) / self.steps[1:]
+        j, k = np.clip(np.floor(position).astype(np.int64), 0, self.shape[1:] - 2)
+        tm, th = position - np.array([j, k])
+
+        return (
+            (1 - tm) * (1 - th) * self.log_table[:, j, k]
+            + tm * (1 - th) * self.log_table[:, j + 1, k]
+            + (1 - tm) * th * self.log_table[:, j, k + 1]
+            + tm * th * self.log_table[:, j + 1, k + 1]
+        )
+
+    def _in_range(self, points: np.ndarray, axes: slice) -> np.ndarray:
+        upper = self.origins[axes] + self.steps[axes] * (self.shape[axes] - 1)
+        return np.all((points >= self.origins[axes]) & (points <= upper), axis=-1)
+
+    def pgv400(
+        self, distance: np.ndarray, magnitude: np.ndarray, depth: np.ndarray
+    ) -> np.ndarray:
+        """表からpgv400を求める(calculate_pgv400_arrayと同じ引数)"""
+        if np.ndim(magnitude) == 0 and np.ndim(depth) == 0:
+            # 1つの地震について多数の地点を計算する場合は距離方向の1次元補間だけで済む
+            source = np.array([magnitude, depth], dtype=np.float64)
+            if self._in_range(source, slice(1, 3)):
+                distance = np.asarray(distance, dtype=np.float64)
+                inside = self._in_range(distance[..., None], slice(0, 1))
+                profile = self._distance_profile(magnitude, depth)
+                position = (distance - self.origins[0]) / self.steps[0]
+                index = np.clip(position.astype(np.int64), 0, self.shape[0] - 2)
+                t = position - index
+                result = 10 ** ((1 - t) * profile[index] + t * profile[index + 1])
+                if not np.all(inside):
+                    result = np.where(
+                        inside, result, calculate_pgv400_array(distance, magnitude, depth)
+                    )
+                return result
+
+        distance, magnitude, depth = np.broadcast_arrays(
+            np.asarray(distance, dtype=np.float64),
+            np.asarray(magnitude, dtype=np.float64),
+            np.asarray(depth, dtype=np.float64),
+        )
+        points = np.stack([distance.ravel(), magnitude.ravel(), depth.ravel()], axis=-1)
+        inside = self._in_range(points, slice(0, 3))
+
+        result = np.empty(len(points))
+        result[inside] = 10 ** self._interpolate(points[inside])
+        if not np.all(inside):
+            # 範囲外は直接計算
+            outside = points[~inside]
+            result[~inside] = calculate_pgv400_array(
+                outside[:, 0], outside[:, 1], outside[:, 2]
+            )
+
+        return result.reshape(distance.shape)
+
+
+def lookup_pgv400(
+    distance: np.ndarray,
+    magnitude: np.ndarray,
+    depth: np.ndarray,
+    attenuation_table: AttenuationTable = None,
+) -> np.ndarray:
+    """表があれば表から、なければ距離減衰式でpgv400をまとめて求める"""
+    if attenuation_table is None:
+        return calculate_pgv400_array(distance, magnitude, depth)
+
+    return attenuation_table.pgv400(distance, magnitude, depth)
+
+
+def _make_axis(value_range: tuple[float, float], step: float) -> np.ndarray:
+    """範囲の終端を含む等間隔の軸"""
+    start, end = value_range
+    n = int(np.ceil((end - start) / step)) + 1
+    return start + step * np.arange(n)
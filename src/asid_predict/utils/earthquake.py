@@ -4,15 +4,21 @@
 
 import math
 
+import numpy as np
+
 from asid_predict.dataclass import EarthquakeRecord, TrainingRecord
 from .geo import calc_distance
 
 __all__ = [
     "is_pacific_plate_area",
     "calculate_pgv400",
+    "calculate_pgv400_array",
     "calculate_intensity",
+    "solve_max_distance",
+    "calc_max_distance",
     "convert_intensity_to_pgv",
     "convert_pgv_to_intensity",
+    "convert_pgv_to_intensity_array",
     "calc_amplification_factor_from_pgv400",
     "calc_pgv400_from_amplification_factor",
 ]
@@ -42,6 +48,28 @@ def calculate_pgv400(distance: float, magnitude: float, depth: float) -> float:
     return pgv400
 
 
+def calculate_pgv400_array(
+    distance: np.ndarray, magnitude: np.ndarray, depth: np.ndarray
+) -> np.ndarray:
+    """calculate_pgv400の配列版(ブロードキャスト可)"""
+    distance = np.asarray(distance, dtype=np.float64)
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+    depth = np.asarray(depth, dtype=np.float64)
+
+    mw = magnitude - 0.171
+    min_distance = np.sqrt(distance**2 + depth**2)
+    x = np.maximum(3, min_distance - (10 ** ((0.5 * mw) - 1.85)))
+
+    pgv600 = 10 ** (
+        (0.58 * mw)
+        + (0.0038 * depth)
+        - 1.29
+        - np.log10(x + (0.0028 * (10 ** (0.5 * mw))))
+        - (0.002 * x)
+    )
+    return pgv600 * 1.31
+
+
 def calculate_intensity(
     distance: float, mjma: float, depth: float, arv400: float = None
 ) -> float:
@@ -50,6 +78,49 @@ def calculate_intensity(
     return convert_pgv_to_intensity(pgv400 if arv400 == None else pgv400 * arv400)
 
 
+def solve_max_distance(
+    magnitude: float,
+    depth: float,
+    min_intensity: float = -3.0,
+    max_distance: float = 2500.0,
+    tolerance: float = 0.1,
+) -> float:
+    """
+    距離減衰式の震度がmin_intensityを下回る最短の距離を二分法で求める
+
+    震度は距離に対して単調減少なので二分法で解ける。
+    返す距離では必ず min_intensity 未満になっていて、真の境界との差は tolerance[km] 以内。
+    max_distance までに下回らなければ max_distance を返す。
+    """
+    if calculate_intensity(0.0, magnitude, depth) < min_intensity:
+        return 0.0
+    if calculate_intensity(max_distance, magnitude, depth) >= min_intensity:
+        return max_distance
+
+    low, high = 0.0, max_distance
+    while high - low > tolerance:
+        middle = (low + high) / 2
+        if calculate_intensity(middle, magnitude, depth) < min_intensity:
+            high = middle
+        else:
+            low = middle
+
+    return high
+
+
+def calc_max_distance(magnitude: float, depth: float) -> int:
+    """学習データ・予測範囲の最大距離を計算(従来法震度-3以上 500km~2500kmを100kmごと)"""
+    # 震度-3を下回る距離を二分法で求め、100kmごとに切り上げる
+    boundary = solve_max_distance(magnitude, depth, -3, 2500, tolerance=1.0)
+    distance = min(2500, max(500, 500 + 100 * math.ceil((boundary - 500) / 100)))
+
+    # 境界が許容誤差内でひとつ手前の区切りを越えていた場合
+    if distance > 500 and calculate_intensity(distance - 100, magnitude, depth) < -3:
+        distance -= 100
+
+    return distance
+
+
 def convert_intensity_to_pgv(intensity: float) -> float:
     """震度からPGVを計算"""
     return 10 ** ((intensity - 2.54) / 1.82)
@@ -63,6 +134,15 @@ def convert_pgv_to_intensity(pgv: float) -> float:
         return -99
 
 
+def convert_pgv_to_intensity_array(pgv: np.ndarray) -> np.ndarray:
+    """convert_pgv_to_intensityの配列版"""
+    pgv = np.asarray(pgv, dtype=np.float64)
+    positive = pgv > 0
+    return np.where(
+        positive, 2.54 + (1.82 * np.log10(np.where(positive, pgv, 1.0))), -99.0
+    )
+
+
 def calc_amplification_factor_from_pgv400(
     earthuake: EarthquakeRecord, record: TrainingRecord
 ) -> float:
@@ -4,7 +4,14 @@
 
 import math
 
-__all__ = ["calc_distance"]
+import numpy as np
+
+__all__ = [
+    "calc_distance",
+    "calc_distance_array",
+    "reduced_latitude_terms",
+    "distance_from_terms",
+]
 
 # 地球の赤道半径[km]
 EQUATORIAL_RADIUS = 6378.137
@@ -76,3 +83,68 @@ def calc_distance(
 
     # 距離[km]
     return EQUATORIAL_RADIUS * (spherical_distance + correction)
+
+
+def reduced_latitude_terms(latitude: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """緯度[度]から化成緯度のsin, cosを計算"""
+    reduced_lat = np.arctan(
+        (POLAR_RADIUS / EQUATORIAL_RADIUS) * np.tan(np.radians(latitude))
+    )
+    return np.sin(reduced_lat), np.cos(reduced_lat)
+
+
+def distance_from_terms(
+    sin_reduced_lat1: np.ndarray,
+    sin_reduced_lat2: np.ndarray,
+    cos_spherical_distance: np.ndarray,
+) -> np.ndarray:
+    """
+    化成緯度のsinと球面上の距離のcosから距離[km]を計算(calc_distanceと同じ式)
+
+    cos_spherical_distance = sin1 * sin2 + cos1 * cos2 * cos(経度差)
+    """
+    spherical_distance = np.arccos(np.clip(cos_spherical_distance, -1.0, 1.0))
+
+    # 扁平率
+    flattening = (EQUATORIAL_RADIUS - POLAR_RADIUS) / EQUATORIAL_RADIUS
+
+    # 0除算回避
+    zero = spherical_distance == 0.0
+    safe = np.where(zero, 1.0, spherical_distance)
+
+    # 距離補正量
+    correction = (
+        flattening
+        / 8.0
+        * (
+            (np.sin(safe) - safe)
+            * (sin_reduced_lat1 + sin_reduced_lat2) ** 2
+            / np.cos(safe / 2.0) ** 2
+            - (np.sin(safe) + safe)
+            * (sin_reduced_lat1 - sin_reduced_lat2) ** 2
+            / np.sin(safe / 2.0) ** 2
+        )
+    )
+
+    # 距離[km]
+    return np.where(zero, 0.0, EQUATORIAL_RADIUS * (safe + correction))
+
+
+def calc_distance_array(
+    latitude1: np.ndarray,
+    longitude1: np.ndarray,
+    latitude2: np.ndarray,
+    longitude2: np.ndarray,
+) -> np.ndarray:
+    """
+    2点間の距離をまとめて計算(calc_distanceの配列版 ブロードキャスト可)
+
+    :return: 2点間の距離[km]の配列
+    """
+    sin1, cos1 = reduced_latitude_terms(latitude1)
+    sin2, cos2 = reduced_latitude_terms(latitude2)
+    cos_spherical_distance = sin1 * sin2 + cos1 * cos2 * np.cos(
+        np.radians(longitude1) - np.radians(longitude2)
+    )
+
+    return distance_from_terms(sin1, sin2, cos_spherical_distance)
@@ -0,0 +1,131 @@
+"""
+固定された地点の集合について、距離計算に使う値を事前計算しておくPointSet
+"""
+
+import functools
+import importlib.resources as resources
+import json
+import os
+
+import numpy as np
+
+from .geo import distance_from_terms, reduced_latitude_terms
+
+__all__ = ["PointSet", "load_package_point_set"]
+
+
+class PointSet:
+    """
+    地点の座標と、calc_distanceで毎回計算していた化成緯度のsin, cos、地心の単位ベクトルをまとめて持つ
+
+    単位ベクトル同士の内積が球面上の距離のcosになるので、多数の地点同士の距離は行列積で求まる。
+    """
+
+    lat: np.ndarray
+    lon: np.ndarray
+    lon_rad: np.ndarray
+    sin_reduced_lat: np.ndarray
+    cos_reduced_lat: np.ndarray
+    unit_vectors: np.ndarray  # (n, 3)
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lon_rad = np.radians(self.lon)
+        self.sin_reduced_lat, self.cos_reduced_lat = reduced_latitude_terms(self.lat)
+        self.unit_vectors = np.stack(
+            [
+                self.cos_reduced_lat * np.cos(self.lon_rad),
+                self.cos_reduced_lat * np.sin(self.lon_rad),
+                self.sin_reduced_lat,
+            ],
+            axis=-1,
+        )
+
+    @classmethod
+    def from_points(cls, points: list[dict]) -> "PointSet":
+        """{"lat", "lon"}のリスト(予測点データなど)から作成"""
+        return cls(
+            np.array([p["lat"] for p in points]), np.array([p["lon"] for p in points])
+        )
+
+    @classmethod
+    def _from_arrays(cls, **arrays: np.ndarray) -> "PointSet":
+        """計算済みの値からそのまま作成"""
+        point_set = cls.__new__(cls)
+        for name, value in arrays.items():
+            setattr(point_set, name, value)
+        return point_set
+
+    def _arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "lat": self.lat,
+            "lon": self.lon,
+            "lon_rad": self.lon_rad,
+            "sin_reduced_lat": self.sin_reduced_lat,
+            "cos_reduced_lat": self.cos_reduced_lat,
+            "unit_vectors": self.unit_vectors,
+        }
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def subset(self, indices: np.ndarray) -> "PointSet":
+        """一部の地点だけのPointSet(再計算しない)"""
+        return self._from_arrays(**{k: v[indices] for k, v in self._arrays().items()})
+
+    def save(self, filepath: str):
+        """計算済みの値を.npzで保存"""
+        np.savez(filepath, **self._arrays())
+
+    @classmethod
+    def load(cls, filepath: str) -> "PointSet":
+        """保存したPointSetを読み込む"""
+        with np.load(filepath) as data:
+            return cls._from_arrays(**{k: data[k] for k in data.files})
+
+    def distances_from(self, lat: float, lon: float) -> np.ndarray:
+        """1地点(震源など)から全地点までの距離[km]"""
+        sin_lat, cos_lat = reduced_latitude_terms(lat)
+        cos_spherical_distance = self.sin_reduced_lat * sin_lat + (
+            self.cos_reduced_lat * cos_lat * np.cos(self.lon_rad - np.radians(lon))
+        )
+        return distance_from_terms(self.sin_reduced_lat, sin_lat, cos_spherical_distance)
+
+    def distance_matrix(self, other: "PointSet") -> np.ndarray:
+        """全地点と other の全地点との距離[km] (len(self), len(other))"""
+        cos_spherical_distance = self.unit_vectors @ other.unit_vectors.T
+        return distance_from_terms(
+            self.sin_reduced_lat[:, None],
+            other.sin_reduced_lat[None, :],
+            cos_spherical_distance,
+        )
+
+    def nearest(self, other: "PointSet") -> tuple[np.ndarray, np.ndarray]:
+        """各地点について other の中で最も近い地点の番号と距離[km]"""
+        distances = self.distance_matrix(other)
+        index = np.argmin(distances, axis=1)
+        return index, distances[np.arange(len(self)), index]
+
+
+@functools.lru_cache(maxsize=None)
+def load_package_point_set(resource_name: str, cache_dir: str = None) -> PointSet:
+    """
+    パッケージ内の地点データ(asid_predict.data)のPointSet プロセス内で1度だけ作成する
+
+    cache_dirを指定すると計算済みの値を.npzで保存し、次回からはそれを読み込む
+    """
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"{resource_name}.npz")
+        if os.path.exists(cache_path):
+            return PointSet.load(cache_path)
+
+    with resources.open_text("asid_predict.data", resource_name) as f:
+        point_set = PointSet.from_points(json.load(f))
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        point_set.save(cache_path)
+
+    return point_set
@@ -0,0 +1,60 @@
+import os
+
+os.environ.setdefault("KERAS_BACKEND", "jax")
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake
+from asid_predict.prediction import adaptive_intensity_map, compare_with_dense
+from asid_predict.prediction.raster import GridSpec
+from asid_predict.utils import calc_distance_array, calc_max_distance
+
+
+class _CountingModel:
+    """増幅率が震源からの位置でなめらかに変わるモデル (予測した行数を数える)"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def predict(self, x, batch_size=None):
+        self.rows += len(x)
+        return (0.4 + 0.1 * np.sin(3 * x[:, 4]) * np.cos(2 * x[:, 5]))[:, None]
+
+
+def _earthquake() -> Earthquake:
+    """最大距離が格子より狭い地震"""
+    return Earthquake(lat=33.0, lon=137.0, depth=20.0, magnitude=3.0)
+
+
+def _grid() -> GridSpec:
+    return GridSpec(lat_min=25, lat_max=45, lon_min=125, lon_max=150, resolution=0.1)
+
+
+def test_error_stays_within_reported_bound():
+    model = _CountingModel()
+    eq = Earthquake(lat=33.0, lon=137.0, depth=400.0, magnitude=6.0)
+    # 閾値では細かくせず、誤差の上限だけで決める
+    adaptive = adaptive_intensity_map(model, eq, _grid(), thresholds=(), tolerance=0.01)
+    result = compare_with_dense(model, eq, adaptive)
+
+    assert not np.all(adaptive.refined_blocks)
+    assert 0 < adaptive.error_bound <= adaptive.tolerance
+    assert result["within_bound"]
+    assert result["max_error"] <= adaptive.error_bound + 1e-5
+
+
+def test_predicts_only_cells_within_max_distance():
+    model = _CountingModel()
+    eq = _earthquake()
+    grid = _grid()
+    adaptive = adaptive_intensity_map(model, eq, grid)
+
+    lat, lon = np.meshgrid(grid.lats(), grid.lons(), indexing="ij")
+    near = calc_distance_array(eq.lat, eq.lon, lat, lon) <= calc_max_distance(
+        eq.magnitude, eq.depth
+    )
+    assert not np.all(near)
+    np.testing.assert_array_equal(np.isfinite(adaptive.values), near)
+    assert model.rows == adaptive.evaluations
+    assert adaptive.evaluations <= np.count_nonzero(near)
+    assert adaptive.saved_ratio > 0
@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import threading
+import time
+
+os.environ.setdefault("KERAS_BACKEND", "jax")
+
+import numpy as np
+
+from asid_predict.cli import run_pipeline
+
+
+class _ConstantModel:
+    def predict(self, x, batch_size=None):
+        return np.full((len(x), 1), 0.5, dtype=np.float32)
+
+
+class _SlowStream(io.BytesIO):
+    """書き出しが遅く、結果のキューが一杯のままになる出力"""
+
+    def write(self, data):
+        time.sleep(0.2)
+        return super().write(data)
+
+
+class _BrokenStream(io.BytesIO):
+    def write(self, data):
+        raise OSError("disk full")
+
+
+def _targets(n: int = 5) -> dict[str, np.ndarray]:
+    return {
+        "lat": np.linspace(34, 36, n),
+        "lon": np.linspace(138, 140, n),
+        "arv400": np.ones(n),
+    }
+
+
+def _events(n: int, malformed_at: int = None) -> io.StringIO:
+    lines = []
+    for i in range(n):
+        if i == malformed_at:
+            lines.append("{not json")
+            continue
+        lines.append(
+            json.dumps({"id": i, "lat": 35, "lon": 139, "depth": 300, "magnitude": 6})
+        )
+    return io.StringIO("\n".join(lines) + "\n")
+
+
+def _run_with_timeout(timeout: float = 30, **kwargs):
+    """run_pipeline が止まったままにならないことを確認する"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = run_pipeline(**kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run_pipeline did not finish"
+    return outcome
+
+
+def test_pipeline_writes_all_events():
+    output = io.BytesIO()
+    outcome = _run_with_timeout(
+        model=_ConstantModel(),
+        targets=_targets(),
+        input_stream=_events(50),
+        output_stream=output,
+        batch_size=4,
+        queue_size=1,
+    )
+    assert outcome["result"]["events"] == 50
+    assert len(output.getvalue().splitlines()) == 50
+
+
+def test_malformed_line_with_full_queue_raises():
+    output = _SlowStream()
+    outcome = _run_with_timeout(
+        model=_ConstantModel(),
+        targets=_targets(),
+        input_stream=_events(20, malformed_at=5),
+        output_stream=output,
+        batch_size=1,
+        queue_size=1,
+    )
+    assert isinstance(outcome.get("error"), json.JSONDecodeError)
+
+    # 壊れた行より前の地震は書き出されている
+    written = [json.loads(line)["id"] for line in output.getvalue().splitlines()]
+    assert written == [str(i) for i in range(5)]
+
+
+def test_output_error_does_not_hang():
+    outcome = _run_with_timeout(
+        model=_ConstantModel(),
+        targets=_targets(),
+        input_stream=_events(200),
+        output_stream=_BrokenStream(),
+        batch_size=1,
+        queue_size=1,
+    )
+    assert isinstance(outcome.get("error"), OSError)
+
+
+def test_model_error_is_raised():
+    class _FailingModel:
+        def predict(self, x, batch_size=None):
+            raise RuntimeError("model failed")
+
+    outcome = _run_with_timeout(
+        model=_FailingModel(),
+        targets=_targets(),
+        input_stream=_events(200),
+        output_stream=io.BytesIO(),
+        batch_size=1,
+        queue_size=1,
+    )
+    assert isinstance(outcome.get("error"), RuntimeError)
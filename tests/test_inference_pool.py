@@ -0,0 +1,41 @@
+import os
+import time
+
+os.environ.setdefault("KERAS_BACKEND", "jax")
+
+import numpy as np
+import pytest
+
+from asid_predict.models import PredictModel
+from asid_predict.prediction.inference_pool import InferencePool
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with InferencePool(PredictModel(), n_workers=2) as pool:
+        yield pool
+
+
+def test_slow_batch_survives_health_check(pool):
+    restarts = pool.restarts
+    x = np.random.default_rng(0).random((60000, 6), dtype=np.float32)
+    future = pool.submit(x)
+
+    # 数秒かかるバッチを処理中でも、プロセスが動いていれば正常で再起動しない
+    time.sleep(0.1)
+    assert not future.done()
+    assert pool.health_check() == [True, True]
+    assert pool.restarts == restarts
+    assert future.result(timeout=120).shape == (len(x), 1)
+
+
+def test_health_check_restarts_stopped_worker(pool):
+    restarts = pool.restarts
+    process = pool._workers[0].process
+    process.kill()
+    process.join(timeout=5)
+
+    assert pool.health_check() == [False, True]
+    assert pool.restarts == restarts + 1
+    x = np.random.default_rng(1).random((16, 6), dtype=np.float32)
+    assert pool.predict(x).shape == (16, 1)
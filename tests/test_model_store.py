@@ -0,0 +1,55 @@
+import multiprocessing as mp
+import os
+import threading
+
+os.environ.setdefault("KERAS_BACKEND", "jax")
+
+from asid_predict.models.distillation import StudentModel
+from asid_predict.models.model_store import ModelStore
+
+
+def _save_models(root: str, plate: str, n: int):
+    """別のプロセスから同じ置き場に保存する"""
+    model = StudentModel()
+    store = ModelStore(root)
+    for i in range(n):
+        store.save(model, plate=plate, metrics={"index": i})
+
+
+def test_concurrent_stores_keep_every_entry(tmp_path):
+    model = StudentModel()
+    root = str(tmp_path)
+
+    def save(plate: str):
+        store = ModelStore(root)  # 同じディレクトリを別の ModelStore で使う
+        for _ in range(5):
+            store.save(model, plate=plate)
+
+    threads = [threading.Thread(target=save, args=(f"plate{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    entries = ModelStore(root).entries()
+    assert len(entries) == 20
+    assert len({e.model_id for e in entries}) == 20
+
+
+def test_processes_keep_every_entry(tmp_path):
+    root = str(tmp_path)
+    context = mp.get_context("spawn")
+    processes = [
+        context.Process(target=_save_models, args=(root, plate, 5))
+        for plate in ("pacific", "philippine_sea")
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    store = ModelStore(root)
+    assert len(store.entries()) == 10
+    for plate in ("pacific", "philippine_sea"):
+        assert store.latest_good(plate).metrics == {"index": 4.0}
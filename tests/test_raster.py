@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+os.environ.setdefault("KERAS_BACKEND", "jax")
+
+import numpy as np
+
+from asid_predict.dataclass import Earthquake
+from asid_predict.models import PredictModel
+from asid_predict.prediction import raster
+from asid_predict.prediction.raster import GridSpec, rasterize_intensity_map
+
+
+class _Counter:
+    """同時に処理中の数の最大を数える"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.max = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.max = max(self.max, self.current)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.current -= 1
+
+
+class _ConstantPredictModel(PredictModel):
+    """kerasのモデルを作らない PredictModel (推論が重なったかを数える)"""
+
+    def __init__(self):
+        self.in_predict = _Counter()
+
+    def predict(self, x, batch_size=None):
+        with self.in_predict:
+            time.sleep(0.01)
+            return np.full((len(x), 1), 0.5, dtype=np.float32)
+
+
+def _earthquake() -> Earthquake:
+    return Earthquake(lat=35.0, lon=139.0, depth=300.0, magnitude=6.0)
+
+
+def test_tiles_are_processed_in_parallel(tmp_path, monkeypatch):
+    model = _ConstantPredictModel()
+    in_tile = _Counter()
+    original = raster.predict_intensity_array
+
+    def slow_predict_intensity_array(*args, **kwargs):
+        # 推論以外(入力の作成・震度への変換)に時間がかかるタイル
+        with in_tile:
+            time.sleep(0.05)
+            return original(*args, **kwargs)
+
+    monkeypatch.setattr(raster, "predict_intensity_array", slow_predict_intensity_array)
+
+    grid = GridSpec(lat_min=34, lat_max=36, lon_min=138, lon_max=140, resolution=0.25)
+    output = rasterize_intensity_map(
+        model, _earthquake(), str(tmp_path / "map.npy"), grid, tile_rows=1, workers=4
+    )
+
+    assert in_tile.max > 1
+    assert model.in_predict.max == 1
+    assert output.shape == grid.shape
+    assert np.all(np.isfinite(output))
+
+
+def test_parallel_matches_single_worker(tmp_path):
+    model = _ConstantPredictModel()
+    grid = GridSpec(lat_min=34, lat_max=36, lon_min=138, lon_max=140, resolution=0.25)
+
+    single = rasterize_intensity_map(
+        model, _earthquake(), str(tmp_path / "single.npy"), grid, tile_rows=1
+    )
+    parallel = rasterize_intensity_map(
+        model, _earthquake(), str(tmp_path / "parallel.npy"), grid, tile_rows=1, workers=4
+    )
+
+    np.testing.assert_array_equal(single, parallel)
@@ -0,0 +1,40 @@
+import os
+
+os.environ.setdefault("KERAS_BACKEND", "jax")
+
+import pytest
+
+from asid_predict.training import _split_holdout_earthquakes
+
+
+def test_holdout_split_is_disjoint_and_complete():
+    earthquakes = list(range(50))
+    train, holdout = _split_holdout_earthquakes(earthquakes, 0.2, seed=0)
+
+    assert len(holdout) == 10
+    assert not set(train) & set(holdout)
+    assert sorted(train + holdout) == earthquakes
+
+
+def test_holdout_split_is_reproducible():
+    earthquakes = list(range(50))
+
+    assert _split_holdout_earthquakes(earthquakes, 0.2, seed=1) == (
+        _split_holdout_earthquakes(earthquakes, 0.2, seed=1)
+    )
+    assert _split_holdout_earthquakes(earthquakes, 0.2, seed=1) != (
+        _split_holdout_earthquakes(earthquakes, 0.2, seed=2)
+    )
+
+
+def test_holdout_split_keeps_at_least_one_on_each_side():
+    train, holdout = _split_holdout_earthquakes(list(range(5)), 0.01, seed=0)
+    assert len(holdout) == 1 and len(train) == 4
+
+    train, holdout = _split_holdout_earthquakes([0, 1], 0.9, seed=0)
+    assert len(holdout) == 1 and len(train) == 1
+
+
+def test_holdout_split_needs_two_earthquakes():
+    with pytest.raises(ValueError):
+        _split_holdout_earthquakes([0], 0.1, seed=0)